@@ -15,7 +15,6 @@ Description:
 #import os
 import sys
 #import re
-import gzip
 import time
 import numpy
 #import string
@@ -27,14 +26,16 @@ import ConfigParser
 
 from multiprocessing import Process, Queue, JoinableQueue
 
-#from seqtools.sequence.fastq import FastqReader
-from seqtools.sequence.fasta import FastaQualityReader
 from seqtools.sequence.fasta import FastaWriter
 from seqtools.sequence.transform import DNA_reverse_complement
 
 from demuxipy import db
 from demuxipy import pairwise2
-from demuxipy.lib import FullPaths, ListQueue, Tagged, Parameters
+from demuxipy.lib import FullPaths, ListQueue, Tagged, Parameters, MatchCache
+from demuxipy.reader import FastqReader, MappedFastaQualityReader, \
+        load_index, byte_ranges
+from demuxipy.core import trim_one, trim_two, concat_check, progress
+from demuxipy.core import get_aligner, BatchAligner, PrunedAligner
 
 import pdb
 
@@ -59,350 +60,286 @@ def motd():
     """
     print motd
 
-def matches(tag, seq_match_span, tag_match_span, allowed_errors):
-    """Determine the gap/error counts for a particular match"""
-    # deal with case where tag match might be perfect, but extremely gappy, 
-    # e.g. ACGTCGTGCGGA-------------------------ATC
-    if tag_match_span.count('-') > allowed_errors or \
-        seq_match_span.count('-') > allowed_errors:
-        return 0, 0
-    else:
-        seq_array   = numpy.array(list(seq_match_span))
-        tag_array   = numpy.array(list(tag_match_span))
-        matches     = sum(seq_array == tag_array)
-        error       = sum(seq_array != tag_array) + (len(tag) - \
-            len(tag_match_span.replace('-','')))
-        return matches, error
-
-def align(seq, tags, allowed_errors):
-    """Alignment method for aligning tags with their respective
-    sequences.  Only called when regular expression matching patterns fail.
-    Inspired by http://github.com/chapmanb/bcbb/tree/master"""
-    high_score = {'tag':None, 'seq_match':None, 'mid_match':None, 'score':None, 
-        'start':None, 'end':None, 'matches':None, 'errors':allowed_errors}
-    for tag in tags:
-        #pdb.set_trace()
-        try:
-            seq_match, tag_match, score, start, end = pairwise2.align.localms(seq, 
-            tag, 5.0, -4.0, -9.0, -0.5, one_alignment_only=True)[0]
-            seq_match_span  = seq_match[start:end]
-            tag_match_span  = tag_match[start:end]
-            match, errors   = matches(tag, seq_match_span, tag_match_span, allowed_errors)
-            if match >= len(tag)-allowed_errors and match > high_score['matches'] \
-                and errors <= high_score['errors']:
-                high_score['tag'] = tag
-                high_score['seq_match'] = seq_match
-                high_score['tag_match'] = tag_match
-                high_score['score'] = score
-                high_score['start'] = start
-                high_score['end'] = end
-                high_score['matches'] = match
-                high_score['seq_match_span'] = seq_match_span
-                high_score['errors'] = errors
-        except IndexError:
-            pass
-    if high_score['matches']:
-        return high_score['tag'], high_score['matches'], \
-        high_score['seq_match'], high_score['seq_match_span'], \
-        high_score['start'], high_score['end']
-    else:
-        return None
 
-def get_align_match_position(seq_match_span, start, stop):
-    # slice faster than ''.startswith()
-    if seq_match_span[0] == '-':
-        start = start + seq_match_span.count('-')
-    else:
-        stop = stop - seq_match_span.count('-')
-    return start, stop
-
-def find_left_tag(s, tag_regexes, tag_strings, max_gap_char, tag_len, fuzzy, errors):
-    """Matching methods for left linker - regex first, followed by fuzzy (SW)
-    alignment, if the option is passed"""
-    #pdb.set_trace()
-    for regex in tag_regexes:
-        match = regex.search(s)
-        if match is not None:
-            m_type = 'regex'
-            start, stop = match.start(), match.end()
-            # by default, this is true
-            tag_matched = regex.pattern.split('}')[1]
-            seq_matched = s[start:stop]
-            break
-    if match is None and fuzzy:
-        match = align(s[:max_gap_char + tag_len], tag_strings, errors)
-        # we can trim w/o regex
-        if match:
-            m_type = 'fuzzy'
-            tag_matched = match[0]
-            seq_matched = match[3]
-            start, stop = get_align_match_position(match[3],match[4], match[5])
-    if match:
-        return tag_matched, m_type, start, stop, seq_matched
-    else:
-        return None
-
-def find_right_tag(s, tag_regexes, tag_strings, max_gap_char, tag_len,
-        fuzzy, errors, tagged, revcomp = True):
-    """Matching methods for right linker - regex first, followed by fuzzy (SW)
-    alignment, if the option is passed"""
-    #if 'MID15_NoError_SimpleX1_NoError_F_NEQ_R' in tagged.read.identifier:
-    #    pdb.set_trace()
-
-    for regex in tag_regexes:
-        match = regex.search(s)
-        if match is not None:
-            m_type = 'regex'
-            start, stop = match.start(), match.end()
-            # by default, this is true
-            tag_matched = regex.pattern.split('[')[0]
-            seq_matched = s[start:stop]
-            break
-    if match is None and fuzzy:
-        match = align(s[-(tag_len + max_gap_char):], tag_strings, errors)
-        # we can trim w/o regex
-        if match:
-            # correct match_position
-            start_of_slice = len(s) - (tag_len + max_gap_char)
-            m_type = 'fuzzy'
-            tag_matched = match[0]
-            seq_matched = match[3]
-            start, stop = get_align_match_position(match[3], match[4], match[5])
-            start, stop = start + start_of_slice, stop + start_of_slice
-    if match and revcomp:
-        return DNA_reverse_complement(tag_matched), m_type, start, stop, DNA_reverse_complement(seq_matched)
-    elif match and not revcomp:
-        return tag_matched, m_type, start, stop, seq_matched
-    else:
-        return None
-
-def trim_one(tagged, regexes, strings, buff, length, fuzzy, errors, trim = 0):
-    """Remove the MID tag from the sequence read"""
-    #if sequence.id == 'MID_No_Error_ATACGACGTA':
-    #    pdb.set_trace()
-    #pdb.set_trace()
-    mid = find_left_tag(tagged.read.sequence,
-                regexes,
-                strings,
-                buff,
-                length,
-                fuzzy,
-                errors
-            )
-    if mid:
-        target, match_type, match = mid[0], mid[1], mid[4]
-        #tagged.mid, tagged.m_type, tagged.seq_match = mid[0],mid[1],mid[4]
-        tagged.read = tagged.read.slice(mid[3] + trim, len(tagged.read.sequence), False)
-        #tagged.mid_name = params.sequence_tags.reverse_mid_lookup[tagged.mid]
-        return tagged, target, match_type, match
-    else:
-        return tagged, None, None, None
-
-def trim_two(tagged, fregex, fstring, rregex, rstring, buff,
-        length, fuzzy, errors, trim = 0, revcomp = True):
-    """Use regular expression and (optionally) fuzzy string matching
-    to locate and trim linkers from sequences"""
-
-    left = find_left_tag(tagged.read.sequence,
-                fregex,
-                fstring,
-                buff,
-                length,
-                fuzzy,
-                errors
+def trim_outer(tagged, params, aligner, cache = None):
+    """Find and trim the outer tag(s) of a read"""
+    if (params.search == 'OuterGroups' or params.search == 'OuterInnerGroups'):
+        assert params.outer, "Search != True for Outer tags"
+        if params.outer_type.lower() == 'single':
+            result = trim_one(
+                tagged,
+                params.sequence_tags.outers['forward_regex'],
+                params.sequence_tags.outers['forward_string'],
+                params.sequence_tags.outer_gap,
+                params.sequence_tags.outer_len,
+                params.outer_fuzzy,
+                params.outer_errors,
+                index = params.sequence_tags.outer_index.get('forward'),
+                mismatch = params.sequence_tags.outer_mismatch.get('forward'),
+                aligner = aligner,
+                cache = cache,
+                context = 'outer'
             )
-    
-    right = find_right_tag(tagged.read.sequence,
-                rregex,
-                rstring,
-                buff,
-                length,
-                fuzzy,
-                errors,
+        elif params.outer_type.lower() == 'both':
+            if params.outer_orientation.lower() == 'reverse':
+                revcomp = True
+            else:
+                revcomp = False
+            result = trim_two(
                 tagged,
-                revcomp
+                params.sequence_tags.outers['forward_regex'],
+                params.sequence_tags.outers['forward_string'],
+                params.sequence_tags.outers['reverse_regex'],
+                params.sequence_tags.outers['reverse_string'],
+                params.sequence_tags.outer_gap,
+                params.sequence_tags.outer_len,
+                params.outer_fuzzy,
+                params.outer_errors,
+                revcomp,
+                findex = params.sequence_tags.outer_index.get('forward'),
+                rindex = params.sequence_tags.outer_index.get('reverse'),
+                fmismatch = params.sequence_tags.outer_mismatch.get('forward'),
+                rmismatch = params.sequence_tags.outer_mismatch.get('reverse'),
+                aligner = aligner,
+                cache = cache,
+                context = 'outer'
             )
+    tagged, tagged.outer_seq, tagged.outer_type, tagged.outer_match = result
+    if tagged.outer_seq:
+        tagged.outer_name = params.sequence_tags.reverse_outer_lookup.get(tagged.outer_seq)
+    return tagged
 
-    # we can have 5 types of matches - tags on left and right sides,
-    # tags on left side only, tags on right side only, mismatching tags
-    # and no tags at all.  We take care of matching position (i,e. we
-    # want only matches at the ends) by regex and slicing in the
-    # search methods above.  If for some reason you want to check
-    # for concatemers, then turn that function on.
-
-    if left is not None \
-            and right is not None \
-            and left[0] == right[0]:
-        # trim the read
-        tagged.read = tagged.read.slice(left[3], right[2], False)
-        # left and right are identical so largely pass back the left
-        # info... except for m_type which can be a combination
-        target, match = left[0], left[4]
-        match_type = "{}-{}-both".format(left[1], right[1])
-
-    elif left is not None \
-            and right is not None\
-            and left[0] != right[0]:
-        # these are no good.  check for within gaps
-        # to make sure it's not a spurious match
-        #pdb.set_trace()
-        tagged.trimmed = None
-        target, match = None, None
-        match_type = "tag-mismatch"
 
-    elif right is None and left and left[2] <= buff:
-        tagged.read = tagged.read.slice(left[3], len(tagged.read.sequence), False)
-        target, match = left[0], left[4]
-        match_type = "{}-left".format(left[1])
+def search_inner(tagged, params):
+    return tagged.outer_seq and (params.search == 'OuterInnerGroups' or
+            params.search == 'InnerGroups')
+
+
+def trim_inner(tagged, params, aligner, cache = None):
+    """Find and trim the inner tag(s) of a read"""
+    assert params.inner, "Search != for Inner tags."
+    inner_index = params.sequence_tags.inner_index.get(tagged.outer_seq, {})
+    inner_mismatch = params.sequence_tags.inner_mismatch.get(tagged.outer_seq, {})
+    if params.inner_type.lower() == 'single':
+        result = trim_one(
+            tagged,
+            params.sequence_tags.inners[tagged.outer_seq]['forward_regex'],
+            params.sequence_tags.inners[tagged.outer_seq]['forward_string'],
+            params.sequence_tags.inner_gap,
+            params.sequence_tags.inner_len,
+            params.inner_fuzzy,
+            params.inner_errors,
+            index = inner_index.get('forward'),
+            mismatch = inner_mismatch.get('forward'),
+            aligner = aligner,
+            cache = cache,
+            context = ('inner', tagged.outer_seq)
+        )
+    elif params.inner_type.lower() == 'both':
+        if params.outer_orientation.lower() == 'reverse':
+            revcomp = True
+        else:
+            revcomp = False
+        result = trim_two(
+            tagged,
+            params.sequence_tags.inners[tagged.outer_seq]['forward_regex'],
+            params.sequence_tags.inners[tagged.outer_seq]['forward_string'],
+            params.sequence_tags.inners[tagged.outer_seq]['reverse_regex'],
+            params.sequence_tags.inners[tagged.outer_seq]['reverse_string'],
+            params.sequence_tags.inner_gap,
+            params.sequence_tags.inner_len,
+            params.inner_fuzzy,
+            params.inner_errors,
+            revcomp,
+            findex = inner_index.get('forward'),
+            rindex = inner_index.get('reverse'),
+            fmismatch = inner_mismatch.get('forward'),
+            rmismatch = inner_mismatch.get('reverse'),
+            aligner = aligner,
+            cache = cache,
+            context = ('inner', tagged.outer_seq)
+        )
+    tagged, tagged.inner_seq, tagged.inner_type, tagged.inner_match = result
+    if tagged.inner_seq:
+        tagged.inner_name = params.sequence_tags.reverse_inner_lookup.get(tagged.inner_seq)
+    return tagged
 
-    elif left is None and right and right[2] >= (len(tagged.read.sequence) - (len(right[0]) + buff)):
-        tagged.read = tagged.read.slice(0, right[2], False)
-        target, match = right[0], right[4]
-        match_type = "{}-right".format(right[1])
 
-    else:
-        target, match_type, match = None, None, None
-
-    return tagged, target, match_type, match
-
-
-def concat_check(tagged, params):
-    """Check screened sequence for the presence of concatemers by scanning 
-    for all possible tags - after the 5' and 3' tags have been removed"""
-    s = tagged.read.sequence
-    m_type = None
-    #pdb.set_trace()
-    for tag in params.sequence_tags.all_tags[str(tagged.outer_seq)]['regex']:
-        match = tag.search(s)
-        if match:
-            tagged.concat_seq = tag.pattern
-            tagged.concat_type = "regex-concat"
-            tagged.concat_match = tagged.read.sequence[match.start():match.end()]
-            break
-    if match is None and params.concat_fuzzy:
-        match = align(s,
-                params.sequence_tags.all_tags[str(tagged.outer_seq)]['string'], 
-                params.concat_allowed_errors
+def batch_outer(chunk, params, aligner):
+    """Fuzzy match the outer tags of the reads in a chunk at once"""
+    if not (params.outer_fuzzy and (params.search == 'OuterGroups' or
+            params.search == 'OuterInnerGroups')):
+        return
+    reads = [tagged.read.sequence for tagged in chunk]
+    tags = params.sequence_tags
+    aligner.batch_left(reads,
+            tags.outers['forward_regex'],
+            tags.outers['forward_string'],
+            tags.outer_gap,
+            tags.outer_len,
+            params.outer_errors,
+            tags.outer_index.get('forward'),
+            tags.outer_mismatch.get('forward')
+        )
+    if params.outer_type.lower() == 'both':
+        aligner.batch_right(reads,
+                tags.outers['reverse_regex'],
+                tags.outers['reverse_string'],
+                tags.outer_gap,
+                tags.outer_len,
+                params.outer_errors,
+                tags.outer_index.get('reverse'),
+                tags.outer_mismatch.get('reverse')
             )
-        if match:
-            tagged.concat_seq = match[0]
-            tagged.concat_type = "fuzzy-concat"
-            tagged.concat_match = match[3]
-    return tagged
 
-def progress(count, interval, big_interval):
-    """give a rudimentary indication of progress"""
-    if count % big_interval == 0:
-        sys.stdout.write('%')
-        sys.stdout.flush()
-    elif count % interval == 0:
-        sys.stdout.write('.')
-        sys.stdout.flush()
 
-def singleproc(job, results, params, interval = 1000, big_interval = 10000):
+def batch_inner(chunk, params, aligner):
+    """Fuzzy match the inner tags of the reads in a chunk at once, for each
+    outer tag"""
+    if not params.inner_fuzzy:
+        return
+    groups = {}
+    for tagged in chunk:
+        if search_inner(tagged, params):
+            groups.setdefault(tagged.outer_seq, []).append(tagged.read.sequence)
+    tags = params.sequence_tags
+    for outer, reads in groups.iteritems():
+        inner_index = tags.inner_index.get(outer, {})
+        inner_mismatch = tags.inner_mismatch.get(outer, {})
+        aligner.batch_left(reads,
+                tags.inners[outer]['forward_regex'],
+                tags.inners[outer]['forward_string'],
+                tags.inner_gap,
+                tags.inner_len,
+                params.inner_errors,
+                inner_index.get('forward'),
+                inner_mismatch.get('forward')
+            )
+        if params.inner_type.lower() == 'both':
+            aligner.batch_right(reads,
+                    tags.inners[outer]['reverse_regex'],
+                    tags.inners[outer]['reverse_string'],
+                    tags.inner_gap,
+                    tags.inner_len,
+                    params.inner_errors,
+                    inner_index.get('reverse'),
+                    inner_mismatch.get('reverse')
+                )
+
+
+def print_cache_stats(cache):
+    sys.stdout.write("\nMatch cache: {0} hits, {1} misses ({2:.1%} hit rate), {3} evictions\n".format(
+            cache.hits,
+            cache.misses,
+            cache.hit_rate(),
+            cache.evictions
+        ))
+    sys.stdout.flush()
+
+
+def get_aligners(params):
+    """Return the outer, inner, and concatemer fuzzy matching engines"""
+    return get_aligner(params.outer_engine,
+                params.sequence_tags.outer_distance), \
+            get_aligner(params.inner_engine,
+                params.sequence_tags.inner_distance), \
+            get_aligner(params.concat_engine)
+
+
+def print_aligner_stats(aligners):
+    for level, aligner in zip(['outer', 'inner', 'concatemer'], aligners):
+        if isinstance(aligner, PrunedAligner) and \
+                (aligner.aligned or aligner.skipped):
+            sys.stdout.write("\nPruned {0} alignments: skipped {1} of {2}\n".format(
+                    level,
+                    aligner.skipped,
+                    aligner.aligned + aligner.skipped
+                ))
+            sys.stdout.flush()
+
+
+def singleproc(job, results, params, interval = 1000, big_interval = 10000,
+        chunk_size = 1000, cache = None, aligners = None):
     count = 0
-    for sequence in job:
+    # a worker passes in its cache and aligners, so that they are kept
+    # across jobs
+    own_cache = cache is None and params.match_cache_size > 0
+    if own_cache:
+        cache = MatchCache(params.match_cache_size)
+    own_aligners = aligners is None
+    if own_aligners:
+        aligners = get_aligners(params)
+    outer_aligner, inner_aligner, concat_aligner = aligners
+    job = iter(job)
+    # reads are handled a chunk at a time, so that a BatchAligner can
+    # fuzzy match all of the reads in the chunk at each level at once
+    chunk = list(itertools.islice(job, chunk_size))
+    while chunk:
         #pdb.set_trace()
         # for now, we'll keep this here
-        tagged = Tagged(sequence)
+        chunk = [Tagged(sequence) for sequence in chunk]
         # trim
         if params.qual_trim:
             #pdb.set_trace()
-            tagged.read = tagged.read.trim(params.min_qual, False)
+            for tagged in chunk:
+                tagged.read = tagged.read.trim(params.min_qual, False)
         # check for Outers:
-        if (params.search == 'OuterGroups' or params.search == 'OuterInnerGroups'):
-            assert params.outer, "Search != True for Outer tags"
-            if params.outer_type.lower() == 'single':
-                result = trim_one(
-                    tagged,
-                    params.sequence_tags.outers['forward_regex'],
-                    params.sequence_tags.outers['forward_string'],
-                    params.sequence_tags.outer_gap,
-                    params.sequence_tags.outer_len,
-                    params.outer_fuzzy,
-                    params.outer_errors
-                )
-            elif params.outer_type.lower() == 'both':
-                if params.outer_orientation.lower() == 'reverse':
-                    revcomp = True
-                else:
-                    revcomp = False
-                result = trim_two(
-                    tagged,
-                    params.sequence_tags.outers['forward_regex'],
-                    params.sequence_tags.outers['forward_string'],
-                    params.sequence_tags.outers['reverse_regex'],
-                    params.sequence_tags.outers['reverse_string'],
-                    params.sequence_tags.outer_gap,
-                    params.sequence_tags.outer_len,
-                    params.outer_fuzzy,
-                    params.outer_errors,
-                    revcomp
-                )
-        tagged, tagged.outer_seq, tagged.outer_type, tagged.outer_match = result
-        if tagged.outer_seq:
-            tagged.outer_name = params.sequence_tags.reverse_outer_lookup.get(tagged.outer_seq)
+        if isinstance(outer_aligner, BatchAligner):
+            outer_aligner.clear()
+            batch_outer(chunk, params, outer_aligner)
+        for tagged in chunk:
+            trim_outer(tagged, params, outer_aligner, cache)
         # check for Inners
-        if (tagged.outer_seq and (params.search == 'OuterInnerGroups' or params.search == 'InnerGroups')):
-            assert params.inner, "Search != for Inner tags."
-            if params.inner_type.lower() == 'single':
-                result = trim_one(
-                    tagged,
-                    params.sequence_tags.inners[tagged.outer_seq]['forward_regex'],
-                    params.sequence_tags.inners[tagged.outer_seq]['forward_string'],
-                    params.sequence_tags.inners[tagged.outer_seq]['reverse_regex'],
-                    params.sequence_tags.inners[tagged.outer_seq]['reverse_string'],
-                    params.sequence_tags.inner_gap,
-                    params.sequence_tags.inner_len,
-                    params.inner_fuzzy,
-                    params.inner_errors
-                )
-            elif params.inner_type.lower() == 'both':
-                if params.outer_orientation.lower() == 'reverse':
-                    revcomp = True
-                else:
-                    revcomp = False
-                result = trim_two(
-                    tagged,
-                    params.sequence_tags.inners[tagged.outer_seq]['forward_regex'],
-                    params.sequence_tags.inners[tagged.outer_seq]['forward_string'],
-                    params.sequence_tags.inners[tagged.outer_seq]['reverse_regex'],
-                    params.sequence_tags.inners[tagged.outer_seq]['reverse_string'],
-                    params.sequence_tags.inner_gap,
-                    params.sequence_tags.inner_len,
-                    params.inner_fuzzy,
-                    params.inner_errors,
-                    revcomp
-                )
-            tagged, tagged.inner_seq, tagged.inner_type, tagged.inner_match = result
-            if tagged.inner_seq:
-                tagged.inner_name = params.sequence_tags.reverse_inner_lookup.get(tagged.inner_seq)
-
-        # lookup cluster name; should => None, None is no outers or inners
-        if tagged.outer_seq and tagged.inner_seq:
-            tagged.cluster = params.sequence_tags.cluster_map.get(str(tagged.outer_seq)).get(str(tagged.inner_seq))
-        else:
-            tagged.cluster = None
-        # check for concatemers
-        if (params.concat_check and len(tagged.read.sequence) > 0) and \
-                ((tagged.outer_seq and tagged.inner_seq and params.search ==
-                    'OuterInnerGroups') or \
-                (tagged.outer_seq and params.search == 'OuterGroups') or \
-                (tagged.inner_seq and params.search == 'InnerGroups')):
-            tagged = concat_check(tagged, params)
-        count += 1
-        progress(count, interval, big_interval)
-        results.put(tagged)
+        if isinstance(inner_aligner, BatchAligner):
+            inner_aligner.clear()
+            batch_inner(chunk, params, inner_aligner)
+        for tagged in chunk:
+            if search_inner(tagged, params):
+                trim_inner(tagged, params, inner_aligner, cache)
+        for tagged in chunk:
+            # lookup cluster name; should => None, None is no outers or inners
+            if tagged.outer_seq and tagged.inner_seq:
+                tagged.cluster = params.sequence_tags.cluster_map.get(str(tagged.outer_seq)).get(str(tagged.inner_seq))
+            else:
+                tagged.cluster = None
+            # check for concatemers
+            if (params.concat_check and len(tagged.read.sequence) > 0) and \
+                    ((tagged.outer_seq and tagged.inner_seq and params.search ==
+                        'OuterInnerGroups') or \
+                    (tagged.outer_seq and params.search == 'OuterGroups') or \
+                    (tagged.inner_seq and params.search == 'InnerGroups')):
+                tagged = concat_check(tagged, params, concat_aligner)
+            count += 1
+            progress(count, interval, big_interval)
+            results.put(tagged)
+        chunk = list(itertools.islice(job, chunk_size))
+    if own_aligners:
+        print_aligner_stats(aligners)
+    if own_cache:
+        print_cache_stats(cache)
     return results
 
 
 def multiproc(jobs, results, params):
     """locate linker sequences in a read, returning a record object"""
+    if params.match_cache_size > 0:
+        cache = MatchCache(params.match_cache_size)
+    else:
+        cache = None
+    aligners = get_aligners(params)
     while True:
         job = jobs.get()
         if job is None:
             break
-        _ = singleproc(job, results, params)
+        if isinstance(job, tuple):
+            job = read_range(job, params)
+        _ = singleproc(job, results, params, cache = cache,
+                aligners = aligners)
+    print_aligner_stats(aligners)
+    if cache is not None:
+        print_cache_stats(cache)
+    # tell the main process that this worker is done
+    results.put(None)
 
 
 def get_args():
@@ -414,20 +351,7 @@ def get_args():
     return parser.parse_args()
 
 
-def get_sequence_count(input, kind):
-    """Determine the number of sequence reads in the input"""
-    if kind == 'fasta':
-        return sum([1 for line in open(input, 'rU') if line.startswith('>')])
-    elif kind == 'fastq' and input.endswith('gz'):
-        return sum([1 for line in gzip.open(input, 'rb')]) / 4
-    else:
-        return sum([1 for line in open(input, 'rU')]) / 4
-
-
-def split_fasta_reads_into_groups(reads, num_reads, num_procs):
-    job_size = num_reads / num_procs
-    sys.stdout.write("Parsing reads into groups of {} reads\n".format(job_size))
-    sys.stdout.flush()
+def split_fasta_reads_into_groups(reads, job_size):
     i = iter(reads)
     chunk = list(itertools.islice(i, job_size))
     while chunk:
@@ -440,22 +364,63 @@ def imerge(a, b):
         yield i, j
 
 
+def get_ranges(params):
+    """Yield the byte ranges of groups of params.chunk_size reads, from the
+    (cached) indexes of the input files - (start, end) for a fastq file, or
+    ((start, end), (start, end)) for fasta and qual files"""
+    if params.fastq:
+        for job in byte_ranges(load_index(params.fastq, fastq=True),
+                params.chunk_size):
+            yield job
+    else:
+        fasta = load_index(params.fasta)
+        quality = load_index(params.quality)
+        if len(fasta) != len(quality):
+            raise IOError("{0} and {1} hold different numbers of reads".format(
+                    params.fasta, params.quality))
+        for job in itertools.izip(byte_ranges(fasta, params.chunk_size),
+                byte_ranges(quality, params.chunk_size)):
+            yield job
+
+
+def read_range(job, params):
+    """Return a reader over the byte ranges of a job from get_ranges"""
+    if params.fastq:
+        start, end = job
+        return FastqReader(params.fastq, start=start, end=end)
+    else:
+        fasta, quality = job
+        return MappedFastaQualityReader(params.fasta, params.quality, fasta,
+                quality)
+
+
 def get_work(params):
-    if params.fasta and params.quality:
-        reads = FastaQualityReader(params.fasta, params.quality)
-        # get read count of input
-        num_reads = get_sequence_count(params.fasta, 'fasta')
-        if params.num_procs > 1:
-            # split reads into generator objects based on equal
-            # split across cores
-            work = split_fasta_reads_into_groups(
-                    reads,
-                    num_reads,
-                    params.num_procs
-                )
-        else:
-            work = FastaQualityReader(params.fasta, params.quality)
-    return num_reads, work
+    if params.num_procs > 1 and not (params.fastq and
+            params.fastq.endswith('.gz')):
+        # workers read their own ranges of the input, so that only the
+        # ranges, and no reads, are passed to them
+        return get_ranges(params)
+    if params.fastq:
+        # reads are streamed from the (plain or gzipped) fastq file
+        reads = FastqReader(params.fastq)
+    elif params.fasta and params.quality:
+        reads = MappedFastaQualityReader(params.fasta, params.quality)
+    if params.num_procs > 1:
+        # a gzipped file cannot be read from an offset, so its reads are
+        # split into fixed-size groups, as they are read
+        work = split_fasta_reads_into_groups(reads, params.chunk_size)
+    else:
+        work = reads
+    return work
+
+
+def feed(jobs, params):
+    """Put the groups of reads on the jobs Queue, followed by one None for
+    each worker"""
+    for unit in get_work(params):
+        jobs.put(unit)
+    for i in xrange(params.num_procs):
+        jobs.put(None)
 
 
 def main():
@@ -468,22 +433,40 @@ def main():
     conf = ConfigParser.ConfigParser()
     conf.read(args.config)
     params = Parameters(conf)
+    if params.sequence_tags.mismatch_stats:
+        stats = params.sequence_tags.mismatch_stats
+        print "Mismatch index: {0} variants, {1:.1f} MB, built in {2:.2f} sec".format(
+                stats['variants'],
+                stats['memory'] / 1048576.,
+                stats['time']
+            )
+    for level in ['outer', 'inner']:
+        distance = params.sequence_tags.min_distance[level]
+        if distance is not None:
+            print "{0} tags: minimum edit distance {1}, fuzzy matches with <= {2} errors are unambiguous".format(
+                    level.capitalize(),
+                    distance,
+                    (distance - 1) / 2
+                )
     # create the db and tables, returning connection
     # and cursor
     conn, cur = db.create_db_and_new_tables(params.db)
-    # get num reads and split up work
-    num_reads, work = get_work(params)
     # setup monolithic output files
     outf = FastaWriter(params.output_fasta, params.output_qual)
     # MULTICORE
     if params.multiprocessing and params.num_procs > 1:
-        jobs = Queue()
+        # a few groups of reads per worker are read ahead of the workers
+        jobs = Queue(2 * params.num_procs)
         results = JoinableQueue()
         # We're stacking groups of jobs on the work
         # Queue, conceivably to save the overhead of
-        # placing them on there one-by-one.
-        for unit in work:
-            jobs.put(unit)
+        # placing them on there one-by-one.  They are
+        # read from the input as the workers take them.
+        sys.stdout.write("Parsing reads into groups of {} reads\n".format(
+                params.chunk_size))
+        sys.stdout.flush()
+        feeder = Process(target = feed, args=(jobs, params))
+        feeder.start()
         # setup the processes for the jobs
         sys.stdout.write("Starting {} workers\n".format(params.num_procs))
         sys.stdout.flush()
@@ -493,11 +476,16 @@ def main():
             for i in xrange(params.num_procs)]
         # we're putting single results on the results Queue so
         # that the db can (in theory) consume them at
-        # a rather consistent rate rather than in spurts
-        #for unit in xrange(num_reads):
-        for unit in xrange(num_reads):
+        # a rather consistent rate rather than in spurts.
+        # Each worker puts None on the Queue when it is
+        # done, after all of its results.
+        finished = 0
+        while finished < params.num_procs:
             tagged = results.get()
             results.task_done()
+            if tagged is None:
+                finished += 1
+                continue
             db.insert_record_to_db(cur, tagged)
             if tagged.cluster:
                 tagged.read.identifier += " cluster={0} outer={1} inner={2}".format(
@@ -506,10 +494,7 @@ def main():
                     tagged.inner_type
                 )
                 outf.write(tagged.read)
-        # make sure we put None at end of Queue
-        # in an amount equiv. to num_procs
-        for unit in xrange(params.num_procs):
-            jobs.put(None)
+        feeder.join()
         # join the results, so that they can finish
         results.join()
         # close up our queues
@@ -521,7 +506,7 @@ def main():
         # fake a multiprocessing queue, so stacking and accessing results
         # is identical.
         results = ListQueue()
-        singleproc(work, results, params)
+        singleproc(get_work(params), results, params)
         for tagged in results:
             db.insert_record_to_db(cur, tagged)
             if tagged.cluster:
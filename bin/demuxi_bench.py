@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+File: demuxi_bench.py
+Author: Brant Faircloth
+
+Created by Brant Faircloth on 17 October 2026 11:02 PDT (-0700)
+Copyright (c) 2026 Brant C. Faircloth. All rights reserved.
+
+Description: benchmark the tag matching engines on simulated reads
+
+USAGE:  python demuxi_bench.py --tags 12 96 384 --reads 20000 exact
+        python demuxi_bench.py --tags 12 96 --reads 5000 exact --right \
+            --read-length 600
+        python demuxi_bench.py --tags 12 96 --reads 200 fuzzy --errors 1
+        python demuxi_bench.py --tags 96 384 --prefix 6 --reads 200 fuzzy \
+            --engines Pruned Trie
+        python demuxi_bench.py --tags 12 96 --reads 10 concat --errors 1
+        python demuxi_bench.py --reads 1000000 reader
+
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import random
+import argparse
+
+from demuxipy.core import find_left_tag, find_right_tag, get_aligner, \
+        BatchAligner, PrunedAligner
+from demuxipy.tagindex import TagAutomaton, TagHash
+from demuxipy.reader import MappedFastaQualityReader
+from seqtools.sequence.fasta import FastaQualityReader
+
+
+def get_args():
+    """Get arguments from CLI"""
+    parser = argparse.ArgumentParser(
+            description="""Benchmark demuxipy tag matching""")
+    parser.add_argument(
+            "--reads",
+            type=int,
+            default=20000,
+            help="""The number of simulated reads"""
+        )
+    parser.add_argument(
+            "--tags",
+            type=int,
+            nargs='+',
+            default=[12, 48, 96, 384],
+            help="""The tag set sizes to benchmark"""
+        )
+    parser.add_argument(
+            "--length",
+            type=int,
+            default=10,
+            help="""The length of the simulated tags"""
+        )
+    parser.add_argument(
+            "--prefix",
+            type=int,
+            default=0,
+            help="""The length of the prefixes that the simulated tags share,
+                in families of 8 tags"""
+        )
+    parser.add_argument(
+            "--buffer",
+            type=int,
+            default=5,
+            help="""The Buffer (gap) allowed before a tag"""
+        )
+    parser.add_argument(
+            "--seed",
+            type=int,
+            default=1,
+            help="""The random seed"""
+        )
+    sub = parser.add_subparsers(dest='benchmark')
+    exact = sub.add_parser('exact', help="""exact matching of left tags""")
+    exact.add_argument(
+            "--right",
+            action="store_true",
+            default=False,
+            help="""Match right tags, at the end of longer reads"""
+        )
+    exact.add_argument(
+            "--read-length",
+            type=int,
+            default=100,
+            help="""The length of the simulated reads"""
+        )
+    fuzzy = sub.add_parser('fuzzy', help="""fuzzy matching of left tags""")
+    fuzzy.add_argument(
+            "--errors",
+            type=int,
+            default=1,
+            help="""The errors introduced into (and allowed in) each tag"""
+        )
+    fuzzy.add_argument(
+            "--engines",
+            nargs='+',
+            default=['SmithWaterman', 'Myers', 'Vectorized', 'Batched',
+                'Pruned', 'Trie'],
+            help="""The FuzzyEngines to benchmark"""
+        )
+    concat = sub.add_parser('concat',
+            help="""fuzzy matching of tags anywhere within long reads""")
+    concat.add_argument(
+            "--errors",
+            type=int,
+            default=1,
+            help="""The errors introduced into (and allowed in) each tag"""
+        )
+    concat.add_argument(
+            "--read-length",
+            type=int,
+            default=400,
+            help="""The length of the simulated reads"""
+        )
+    concat.add_argument(
+            "--engines",
+            nargs='+',
+            default=['SmithWaterman', 'QGram'],
+            help="""The ConcatemerFuzzyEngines to benchmark"""
+        )
+    reader = sub.add_parser('reader',
+            help="""reading of simulated fasta and qual files""")
+    reader.add_argument(
+            "--read-length",
+            type=int,
+            default=400,
+            help="""The length of the simulated reads"""
+        )
+    return parser.parse_args()
+
+
+def random_sequence(length):
+    return ''.join([random.choice('ACGT') for i in xrange(length)])
+
+
+def simulate_tags(count, length, prefix=0):
+    tags = set()
+    while len(tags) < count:
+        if prefix and len(tags) % 8:
+            tags.add(family + random_sequence(length - prefix))
+        else:
+            family = random_sequence(prefix)
+            tags.add(family + random_sequence(length - prefix))
+    return tags
+
+
+def simulate_reads(tags, count, gap, length=100, right=False):
+    """reads carrying a tag at a random offset within the gap (from the
+    end of the read, if right)"""
+    tags = list(tags)
+    reads = []
+    for i in xrange(count):
+        offset = random.randint(0, gap)
+        tag = random.choice(tags)
+        read = random_sequence(offset) + tag + \
+                random_sequence(length - offset - len(tag))
+        if right:
+            read = read[::-1]
+        reads.append(read)
+    return reads
+
+
+def mutate(tag, errors):
+    """introduce substitutions, insertions, or deletions into a tag"""
+    tag = list(tag)
+    for i in xrange(errors):
+        pos = random.randrange(len(tag))
+        kind = random.choice(['sub', 'ins', 'del'])
+        if kind == 'sub':
+            tag[pos] = random.choice([b for b in 'ACGT' if b != tag[pos]])
+        elif kind == 'ins':
+            tag.insert(pos, random.choice('ACGT'))
+        else:
+            del tag[pos]
+    return ''.join(tag)
+
+
+def rate(function, reads):
+    start = time.time()
+    for read in reads:
+        function(read)
+    return len(reads) / (time.time() - start)
+
+
+def exact(args):
+    engines = [('regex', None), ('automaton', TagAutomaton), ('hash', TagHash)]
+    print "{0:>8}".format('tags') + ''.join(["{0:>14}".format(name + ' r/s')
+            for name, engine in engines])
+    for count in args.tags:
+        tags = simulate_tags(count, args.length, args.prefix)
+        rates = []
+        if args.right:
+            # reversed reads carry the reversed tags at their ends
+            tags = set([tag[::-1] for tag in tags])
+            reads = simulate_reads(tags, args.reads, args.buffer,
+                    args.read_length, right=True)
+            tags = set([tag[::-1] for tag in tags])
+            regexes = [re.compile('{}[acgtnACGTN]{{0,{}}}$'.format(t,
+                    args.buffer)) for t in tags]
+            for name, engine in engines:
+                index = engine(tags, args.buffer) if engine else None
+                rates.append(rate(lambda s: find_right_tag(s, regexes, tags,
+                    args.buffer, args.length, False, 0, None, False, index),
+                    reads))
+        else:
+            reads = simulate_reads(tags, args.reads, args.buffer,
+                    args.read_length)
+            regexes = [re.compile('^[acgtnACGTN]{{0,{}}}{}'.format(
+                    args.buffer, t)) for t in tags]
+            for name, engine in engines:
+                index = engine(tags, args.buffer) if engine else None
+                rates.append(rate(lambda s: find_left_tag(s, regexes, tags,
+                    args.buffer, args.length, False, 0, index), reads))
+        print "{0:>8}".format(count) + ''.join(["{0:>14.0f}".format(r)
+                for r in rates])
+
+
+def fuzzy(args):
+    print "{0:>8}".format('tags') + ''.join(["{0:>18}".format(name + ' r/s')
+            for name in args.engines])
+    skipped = []
+    for count in args.tags:
+        tags = simulate_tags(count, args.length, args.prefix)
+        windows = [mutate(read[:args.buffer + args.length], args.errors)
+                for read in simulate_reads(tags, args.reads, args.buffer)]
+        rates = []
+        for name in args.engines:
+            aligner = get_aligner(name)
+            if isinstance(aligner, BatchAligner):
+                # the whole set of windows is one chunk
+                start = time.time()
+                aligner.batch(windows, tags, args.errors)
+                for s in windows:
+                    aligner(s, tags, args.errors)
+                rates.append(len(windows) / (time.time() - start))
+            else:
+                rates.append(rate(lambda s: aligner(s, tags, args.errors),
+                    windows))
+            if isinstance(aligner, PrunedAligner):
+                skipped.append((name, count, aligner.skipped,
+                    aligner.aligned + aligner.skipped))
+        print "{0:>8}".format(count) + ''.join(["{0:>18.0f}".format(r)
+                for r in rates])
+    for name, count, skip, total in skipped:
+        print "{0}, {1} tags: skipped traceback for {2} of {3} tags".format(
+                name, count, skip, total)
+
+
+def concat(args):
+    print "{0:>8}".format('tags') + ''.join(["{0:>18}".format(name + ' r/s')
+            for name in args.engines])
+    for count in args.tags:
+        tags = simulate_tags(count, args.length, args.prefix)
+        reads = []
+        for i in xrange(args.reads):
+            read = random_sequence(args.read_length)
+            # half of the reads hold a tag, with errors
+            if i % 2:
+                pos = random.randrange(args.read_length)
+                read = read[:pos] + mutate(random.choice(list(tags)),
+                        args.errors) + read[pos:]
+            reads.append(read)
+        rates = []
+        for name in args.engines:
+            aligner = get_aligner(name)
+            rates.append(rate(lambda s: aligner(s, tags, args.errors), reads))
+        print "{0:>8}".format(count) + ''.join(["{0:>18.2f}".format(r)
+                for r in rates])
+
+
+def write_reads(fasta, qual, count, length):
+    """write count reads, wrapped as 454 fasta and qual files are.  The
+    reads cycle through a pool of 1000 simulated reads, so that writing a
+    million of them is quick"""
+    fasta, qual = open(fasta, 'w'), open(qual, 'w')
+    scores = [str(i) for i in xrange(41)]
+    pool = []
+    for i in xrange(min(count, 1000)):
+        read = random_sequence(length)
+        scored = [random.choice(scores) for j in xrange(length)]
+        pool.append((
+            ''.join([read[j:j + 60] + '\n' for j in xrange(0, length, 60)]),
+            ''.join([' '.join(scored[j:j + 60]) + '\n'
+                for j in xrange(0, length, 60)])
+            ))
+    for i in xrange(count):
+        header = ">read{0} length={1}\n".format(i, length)
+        read, scored = pool[i % len(pool)]
+        fasta.write(header + read)
+        qual.write(header + scored)
+    fasta.close()
+    qual.close()
+
+
+def reader(args):
+    directory = tempfile.mkdtemp()
+    try:
+        fasta = os.path.join(directory, 'reads.fasta')
+        qual = os.path.join(directory, 'reads.qual')
+        write_reads(fasta, qual, args.reads, args.read_length)
+        print "{0:>28}{1:>14}".format('reader', 'r/s')
+        for engine in [FastaQualityReader, MappedFastaQualityReader]:
+            start = time.time()
+            for read in engine(fasta, qual):
+                pass
+            print "{0:>28}{1:>14.0f}".format(engine.__name__,
+                    args.reads / (time.time() - start))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    args = get_args()
+    random.seed(args.seed)
+    if args.benchmark == 'exact':
+        exact(args)
+    elif args.benchmark == 'fuzzy':
+        fuzzy(args)
+    elif args.benchmark == 'concat':
+        concat(args)
+    elif args.benchmark == 'reader':
+        reader(args)
+
+if __name__ == '__main__':
+    main()
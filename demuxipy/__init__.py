@@ -29,6 +29,8 @@ except ImportError: # pragma: no cover
 
 
 from db import *
+from tagindex import *
+from myers import *
 from lib import *
 from pairwise2 import *
 from core import *
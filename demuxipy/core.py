@@ -15,13 +15,13 @@ Description: core functions for demuxipy
 #import os
 import sys
 #import re
-import gzip
 #import time
 import numpy
 #import string
 #import cPickle
 #import sqlite3
 import argparse
+import functools
 import itertools
 #import ConfigParser
 
@@ -33,6 +33,8 @@ from seqtools.sequence.transform import DNA_reverse_complement
 
 #from demuxipy import db
 from demuxipy import pairwise2
+from demuxipy.myers import MyersAligner
+from demuxipy.tagindex import QGramIndex
 
 from demuxipy.lib import FullPaths, ListQueue, Tagged, Parameters
 
@@ -76,33 +78,49 @@ def matches(tag, seq_match_span, tag_match_span, allowed_errors):
         return matches, error
 
 
-def align(seq, tags, allowed_errors):
-    """Alignment method for aligning tags with their respective
-    sequences.  Only called when regular expression matching patterns fail.
-    Inspired by http://github.com/chapmanb/bcbb/tree/master"""
-    high_score = {'tag':None, 'seq_match':None, 'mid_match':None, 'score':None, 
+# tag length (level) -> pairwise2.Aligner, with the buffers for aligning
+# the windows of that level.  Each worker process holds its own.
+_PAIRWISE_ALIGNERS = {}
+
+
+def _get_pairwise_aligner(seq, tag):
+    """Return the pairwise2.Aligner for the level of tag, scoring as
+    localms(seq, tag, 5.0, -4.0, -9.0, -0.5)"""
+    if len(tag) not in _PAIRWISE_ALIGNERS:
+        _PAIRWISE_ALIGNERS[len(tag)] = pairwise2.Aligner(5.0, -4.0, -9.0,
+                -0.5, len(seq), len(tag))
+    return _PAIRWISE_ALIGNERS[len(tag)]
+
+
+def _align_tag(seq, tag, allowed_errors, high_score):
+    """Align a tag to seq, keeping it in high_score if it is the best match"""
+    try:
+        seq_match, tag_match, score, start, end = \
+                _get_pairwise_aligner(seq, tag).align(seq, tag)[0]
+        seq_match_span  = seq_match[start:end]
+        tag_match_span  = tag_match[start:end]
+        match, errors   = matches(tag, seq_match_span, tag_match_span, allowed_errors)
+        if match >= len(tag)-allowed_errors and match > high_score['matches'] \
+            and errors <= high_score['errors']:
+            high_score['tag'] = tag
+            high_score['seq_match'] = seq_match
+            high_score['tag_match'] = tag_match
+            high_score['score'] = score
+            high_score['start'] = start
+            high_score['end'] = end
+            high_score['matches'] = match
+            high_score['seq_match_span'] = seq_match_span
+            high_score['errors'] = errors
+    except IndexError:
+        pass
+
+
+def _high_score(allowed_errors):
+    return {'tag':None, 'seq_match':None, 'mid_match':None, 'score':None, 
         'start':None, 'end':None, 'matches':None, 'errors':allowed_errors}
-    for tag in tags:
-        #pdb.set_trace()
-        try:
-            seq_match, tag_match, score, start, end = pairwise2.align.localms(seq, 
-            tag, 5.0, -4.0, -9.0, -0.5, one_alignment_only=True)[0]
-            seq_match_span  = seq_match[start:end]
-            tag_match_span  = tag_match[start:end]
-            match, errors   = matches(tag, seq_match_span, tag_match_span, allowed_errors)
-            if match >= len(tag)-allowed_errors and match > high_score['matches'] \
-                and errors <= high_score['errors']:
-                high_score['tag'] = tag
-                high_score['seq_match'] = seq_match
-                high_score['tag_match'] = tag_match
-                high_score['score'] = score
-                high_score['start'] = start
-                high_score['end'] = end
-                high_score['matches'] = match
-                high_score['seq_match_span'] = seq_match_span
-                high_score['errors'] = errors
-        except IndexError:
-            pass
+
+
+def _best_match(high_score):
     if high_score['matches']:
         return high_score['tag'], high_score['matches'], \
         high_score['seq_match'], high_score['seq_match_span'], \
@@ -111,6 +129,338 @@ def align(seq, tags, allowed_errors):
         return None
 
 
+def _is_unique(seq, high_score, distances):
+    """True if no tag can replace the best match.  To do so, a tag must have
+    more matches and no more errors.  Tags at a level share a length, so a
+    match without errors can not be beaten.  Otherwise, the best tag matches
+    a part of seq with k errors and another tag would have to match a part of
+    seq with no more than k errors.  The two parts overlap in all but (at
+    most) 2 * (len(seq) - len(tag) + k) bases, so the tags would be within
+    4 * k + 2 * (len(seq) - len(tag)) edits of each other."""
+    tag = high_score['tag']
+    if tag is None:
+        return False
+    if high_score['matches'] == len(tag):
+        return True
+    if tag not in distances:
+        return False
+    k = high_score['errors']
+    return distances[tag] > 4 * k + 2 * (len(seq) - len(tag))
+
+
+def align(seq, tags, allowed_errors, distances=None):
+    """Alignment method for aligning tags with their respective
+    sequences.  Only called when regular expression matching patterns fail.
+    Inspired by http://github.com/chapmanb/bcbb/tree/master
+
+    If given, distances holds the edit distance from each of the tags to the
+    closest other tag, and the search stops once the best match is unique."""
+    high_score = _high_score(allowed_errors)
+    for tag in tags:
+        #pdb.set_trace()
+        _align_tag(seq, tag, allowed_errors, high_score)
+        if distances is not None and _is_unique(seq, high_score, distances):
+            break
+    return _best_match(high_score)
+
+
+class PrunedAligner:
+    """Two stage alignment.  Each tag is first scored without traceback
+    (score_only), and is aligned only if its score allows a match that
+    align() can accept and that beats the best match so far.  With the
+    5/-4/-9/-0.5 scoring, each of the (at most allowed_errors) mismatches and
+    gap characters costs at most 9, so an accepted match, with at least
+    len(tag) - allowed_errors matches, scores at least min_score(); and an
+    alignment scoring S has at most max_matches(S) matches.  Returns the same
+    result as align(); the counts of aligned and skipped tags are kept."""
+    def __init__(self, distances=None):
+        self.aligned = 0
+        self.skipped = 0
+        self.distances = distances
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def min_score(self, length, allowed_errors):
+        return 5.0 * (length - allowed_errors) - 9.0 * allowed_errors
+
+    def max_matches(self, score, allowed_errors):
+        return (score + 9.0 * allowed_errors) / 5.0
+
+    def __call__(self, seq, tags, allowed_errors):
+        if not seq:
+            return None
+        high_score = _high_score(allowed_errors)
+        for tag in tags:
+            score = _get_pairwise_aligner(seq, tag).score(seq, tag)
+            # no alignment, too many errors, or too few matches to win
+            if score <= 0 or score < self.min_score(len(tag), allowed_errors) \
+                    or (high_score['matches'] is not None and
+                    self.max_matches(score, allowed_errors) <
+                    high_score['matches'] + 1):
+                self.skipped += 1
+                continue
+            self.aligned += 1
+            _align_tag(seq, tag, allowed_errors, high_score)
+            if self.distances is not None and \
+                    _is_unique(seq, high_score, self.distances):
+                break
+        return _best_match(high_score)
+
+
+class TrieAligner(PrunedAligner):
+    """Two stage alignment, as PrunedAligner, but the tags are scored all
+    at once against a trie of the tags (pairwise2.TagTrie), so that the
+    prefixes the tags share are only aligned once.  The time to score a
+    sequence grows with the number of nodes in the trie rather than the
+    total length of the tags.  Returns the same result as align()."""
+    def __init__(self, distances=None):
+        PrunedAligner.__init__(self, distances)
+        # tags -> pairwise2.TagTrie
+        self.tries = {}
+
+    def _get_trie(self, tags):
+        key = tuple(tags)
+        if key not in self.tries:
+            self.tries[key] = pairwise2.TagTrie(key, 5.0, -4.0, -9.0, -0.5)
+        return self.tries[key]
+
+    def __call__(self, seq, tags, allowed_errors):
+        if not seq:
+            return None
+        trie = self._get_trie(tags)
+        high_score = _high_score(allowed_errors)
+        for tag, result in zip(trie.sequencesB, trie.scores(seq)):
+            if result is None:
+                continue
+            score = result[0]
+            # no alignment, too many errors, or too few matches to win
+            if score <= 0 or score < self.min_score(len(tag), allowed_errors) \
+                    or (high_score['matches'] is not None and
+                    self.max_matches(score, allowed_errors) <
+                    high_score['matches'] + 1):
+                self.skipped += 1
+                continue
+            self.aligned += 1
+            _align_tag(seq, tag, allowed_errors, high_score)
+            if self.distances is not None and \
+                    _is_unique(seq, high_score, self.distances):
+                break
+        return _best_match(high_score)
+
+
+def align_many(seq, tags, allowed_errors):
+    """Alignment method that scores the sequence against all tags of a given
+    length at once, rather than aligning each tag in turn.  The counts from
+    pairwise2.local_scores_many() give the matches/errors of each tag as
+    matches() would, so the winner is picked with the rules used in align(),
+    and only that tag is aligned."""
+    return align_batch([seq], tags, allowed_errors)[0]
+
+
+def align_edits(seq, tags, allowed_errors):
+    """Alignment method that aligns all of each tag to the part of seq that
+    it matches best (semi-global), with pairwise2.semiglobal_edits().  The
+    errors of a match are the substitutions, insertions, and deletions of the
+    alignment, so matches() is not needed.  The tag with the fewest errors,
+    and no more than allowed_errors, wins; ties go to the first tag.  Returns
+    the tuple that align() does, with the matched part of seq (which has no
+    gaps) as the matched span.  The errors differ from those that align()
+    counts, so it can match a read that align() does not, or a different
+    tag."""
+    best, best_errors = None, allowed_errors + 1
+    for tag in tags:
+        start, end, substitutions, insertions, deletions = \
+                pairwise2.semiglobal_edits(seq, tag)
+        errors = substitutions + insertions + deletions
+        if errors < best_errors and end > start:
+            best_errors = errors
+            best = (tag, len(tag) - substitutions - deletions, seq,
+                    seq[start:end], start, end)
+            if errors == 0:
+                break
+    return best
+
+
+def align_batch(seqs, tags, allowed_errors):
+    """Alignment method that scores many sequences (e.g. the windows of the
+    reads in a chunk) against all tags at once, with
+    pairwise2.local_scores_batch().  Returns the result of align() for each
+    of seqs."""
+    tags = list(tags)
+    results = [None] * len(seqs)
+    # empty windows have no alignment
+    todo = [i for i, seq in enumerate(seqs) if seq]
+    if not todo:
+        return results
+    by_length = {}
+    for i, tag in enumerate(tags):
+        by_length.setdefault(len(tag), []).append(i)
+    lengths = numpy.array([len(tag) for tag in tags])
+    ident = numpy.zeros((len(todo), len(tags)), dtype=int)
+    gaps_seq = numpy.zeros(ident.shape, dtype=int)
+    gaps_tag = numpy.zeros(ident.shape, dtype=int)
+    aligned = numpy.zeros(ident.shape, dtype=bool)
+    for length, indexes in by_length.iteritems():
+        scores, rows, cols, ident[:, indexes], gaps_seq[:, indexes], \
+                gaps_tag[:, indexes] = pairwise2.local_scores_batch(
+                [seqs[i] for i in todo], [tags[i] for i in indexes],
+                5.0, -4.0, -9.0, -0.5)
+        aligned[:, indexes] = scores > 0
+    # as in matches(), alignments with too many gaps have no matches, so
+    # only these tags can win
+    errors = lengths - ident + gaps_tag
+    candidates = aligned & (gaps_tag <= allowed_errors) & \
+            (gaps_seq <= allowed_errors) & (ident >= lengths - allowed_errors)
+    for row, i in enumerate(todo):
+        high_score = {'tag':None, 'matches':None, 'errors':allowed_errors}
+        for j in numpy.nonzero(candidates[row])[0]:
+            if ident[row, j] > high_score['matches'] and \
+                    errors[row, j] <= high_score['errors']:
+                high_score['tag'] = tags[j]
+                high_score['matches'] = ident[row, j]
+                high_score['errors'] = errors[row, j]
+        if high_score['matches']:
+            results[i] = align(seqs[i], [high_score['tag']], allowed_errors)
+    return results
+
+
+class BatchAligner:
+    """Fuzzy match the windows of a whole chunk of reads at once.  batch_left()
+    and batch_right() take the reads of a chunk, find those that the exact
+    (regex or index) search does not match, and align all of their windows
+    against all of the tags with align_batch().  Called afterwards as align()
+    is, e.g. from trim_one()/trim_two(), a BatchAligner returns these results
+    and aligns any other window with align_many()."""
+    def __init__(self, cells=2**18):
+        # the (windows x tags x window length) cells filled per batch
+        self.cells = cells
+        self.results = {}
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def __call__(self, seq, tags, allowed_errors):
+        key = (seq, tuple(tags), allowed_errors)
+        if key in self.results:
+            return self.results[key]
+        return align_many(seq, tags, allowed_errors)
+
+    def clear(self):
+        self.results = {}
+
+    def batch(self, windows, tags, allowed_errors, mismatch=None):
+        """Align windows against tags, skipping those already aligned and
+        those that mismatch (a MismatchIndex) resolves"""
+        tags = tuple(tags)
+        todo = set()
+        for seq in windows:
+            if (seq, tags, allowed_errors) in self.results:
+                continue
+            if mismatch is not None and mismatch.search(seq) is not None:
+                continue
+            todo.add(seq)
+        if not todo or not tags:
+            return
+        todo = list(todo)
+        size = max(1, self.cells / (len(tags) *
+                max([len(seq) for seq in todo] + [1])))
+        for i in xrange(0, len(todo), size):
+            seqs = todo[i:i + size]
+            for seq, result in zip(seqs,
+                    align_batch(seqs, tags, allowed_errors)):
+                self.results[(seq, tags, allowed_errors)] = result
+
+    def batch_left(self, reads, tag_regexes, tag_strings, max_gap_char,
+            tag_len, errors, index=None, mismatch=None):
+        """Batch the left windows that find_left_tag() fuzzy matches"""
+        windows = [s[:max_gap_char + tag_len] for s in reads
+                if find_left_tag(s, tag_regexes, tag_strings, max_gap_char,
+                    tag_len, False, errors, index) is None]
+        self.batch(windows, tag_strings, errors, mismatch)
+
+    def batch_right(self, reads, tag_regexes, tag_strings, max_gap_char,
+            tag_len, errors, index=None, mismatch=None):
+        """Batch the right windows that find_right_tag() fuzzy matches"""
+        windows = [s[-(tag_len + max_gap_char):] for s in reads
+                if find_right_tag(s, tag_regexes, tag_strings, max_gap_char,
+                    tag_len, False, errors, None, False, index) is None]
+        self.batch(windows, tag_strings, errors, mismatch)
+
+
+class QGramAligner:
+    """Fuzzy match tags within long sequences (e.g. concatemers within a
+    read) by filtering the tags, and the regions of the sequence, that can
+    hold a match with a QGramIndex.  Each region is checked for an
+    occurrence of the tag within allowed_errors edits with the bit-parallel
+    search of MyersAligner, and only the tags found are passed on to
+    aligner.  As with MyersAligner, the result is that of aligner."""
+    def __init__(self, aligner):
+        self.aligner = aligner
+        self.myers = MyersAligner(aligner)
+        # (tags, allowed_errors) -> QGramIndex
+        self.indexes = {}
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def _get_index(self, tags, allowed_errors):
+        key = (tuple(tags), allowed_errors)
+        if key not in self.indexes:
+            self.indexes[key] = QGramIndex(key[0], allowed_errors)
+        return self.indexes[key]
+
+    def __call__(self, seq, tags, allowed_errors):
+        if not tags:
+            return None
+        index = self._get_index(tags, allowed_errors)
+        candidates = []
+        for order, regions in sorted(index.candidates(seq).iteritems()):
+            tag = index.tags[order]
+            for start, end in regions:
+                if self.myers.within(seq[start:end], tag, allowed_errors):
+                    candidates.append(tag)
+                    break
+        if not candidates:
+            return None
+        return self.aligner(seq, candidates, allowed_errors)
+
+
+def get_aligner(engine, distances=None):
+    """Return the fuzzy matching function for a FuzzyEngine.  Each takes
+    and returns the same arguments as align().  If given, the tag distances
+    (see align()) let the SmithWaterman, Myers, Pruned and Trie engines
+    stop early."""
+    if distances is not None:
+        aligner = functools.partial(align, distances=distances)
+    else:
+        aligner = align
+    if engine.lower() == 'myers':
+        return MyersAligner(aligner)
+    elif engine.lower() == 'vectorized':
+        return align_many
+    elif engine.lower() == 'batched':
+        return BatchAligner()
+    elif engine.lower() == 'pruned':
+        return PrunedAligner(distances)
+    elif engine.lower() == 'trie':
+        return TrieAligner(distances)
+    elif engine.lower() == 'qgram':
+        return QGramAligner(aligner)
+    elif engine.lower() == 'semiglobal':
+        return align_edits
+    return aligner
+
+
 def get_align_match_position(seq_match_span, start, stop):
     # slice faster than ''.startswith()
     if seq_match_span[0] == '-':
@@ -120,20 +470,88 @@ def get_align_match_position(seq_match_span, start, stop):
     return start, stop
 
 
-def find_left_tag(s, tag_regexes, tag_strings, max_gap_char, tag_len, fuzzy, errors):
+def _is_unique_hit(seq, match, allowed_errors, distances):
+    """True if no other tag can match seq as well as a MismatchIndex hit.
+    Unlike _is_unique(), the other tags have not been aligned, and align()
+    keeps the first of tags with equal matches, so any tag that align()
+    accepts (with up to allowed_errors) must be ruled out.  As there, the
+    two tags would be within 2 * (k + allowed_errors) + 2 * (len(seq) -
+    len(tag)) edits of each other, where k is the errors of the hit."""
+    tag, matches = match[0], match[1]
+    if tag not in distances:
+        return False
+    k = len(tag) - matches
+    return distances[tag] > 2 * (k + allowed_errors) + \
+            2 * (len(seq) - len(tag))
+
+
+def fuzzy_match(s, tag_strings, errors, mismatch=None, aligner=align):
+    """Fuzzy match a window of sequence to tags.  If given, a MismatchIndex
+    resolves substitution-only matches that no other tag can beat, leaving
+    the aligner (SW, by default) for the remainder (e.g. indels)."""
+    match = None
+    if mismatch is not None:
+        match = mismatch.search(s)
+        if match is not None and not _is_unique_hit(s, match, errors,
+                mismatch.distances):
+            # another tag may align as well or better (e.g. with an indel,
+            # or clipped), so align to all of the tags
+            match = None
+        elif match is not None and len(match[0]) - match[1] > 1:
+            # beyond one substitution, an indel alignment to the same tag
+            # may score higher, so check the hit against that tag alone
+            match = aligner(s, [match[0]], errors)
+    if match is None:
+        match = aligner(s, tag_strings, errors)
+    return match
+
+
+def _shift_match(match, offset):
+    if match is None:
+        return None
+    tag_matched, m_type, start, stop, seq_matched = match
+    return tag_matched, m_type, start + offset, stop + offset, seq_matched
+
+
+def find_left_tag(s, tag_regexes, tag_strings, max_gap_char, tag_len, fuzzy,
+        errors, index=None, mismatch=None, aligner=align, cache=None,
+        context=None):
     """Matching methods for left linker - regex first, followed by fuzzy (SW)
-    alignment, if the option is passed"""
-    for regex in tag_regexes:
-        match = regex.search(s)
+    alignment, if the option is passed.  If given, a tag index replaces the
+    regex loop; it returns the same tag and positions, so the match type is
+    still 'regex'.
+
+    The result only depends on the first max_gap_char + tag_len bases, so if
+    given a cache (lib.MatchCache), results are stored by that window and
+    the context (e.g. the level and outer tag) of the tags."""
+    if cache is not None:
+        key = ('left', context, s[:max_gap_char + tag_len])
+        try:
+            return cache[key]
+        except KeyError:
+            match = find_left_tag(s, tag_regexes, tag_strings, max_gap_char,
+                    tag_len, fuzzy, errors, index, mismatch, aligner)
+            cache[key] = match
+            return match
+    if index is not None:
+        match = index.left(s)
         if match is not None:
             m_type = 'regex'
-            start, stop = match.start(), match.end()
-            # by default, this is true
-            tag_matched = regex.pattern.split('}')[1]
+            tag_matched, start, stop = match
             seq_matched = s[start:stop]
-            break
+    else:
+        for regex in tag_regexes:
+            match = regex.search(s)
+            if match is not None:
+                m_type = 'regex'
+                start, stop = match.start(), match.end()
+                # by default, this is true
+                tag_matched = regex.pattern.split('}')[1]
+                seq_matched = s[start:stop]
+                break
     if match is None and fuzzy:
-        match = align(s[:max_gap_char + tag_len], tag_strings, errors)
+        match = fuzzy_match(s[:max_gap_char + tag_len], tag_strings, errors,
+                mismatch, aligner)
         # we can trim w/o regex
         if match:
             m_type = 'fuzzy'
@@ -147,22 +565,48 @@ def find_left_tag(s, tag_regexes, tag_strings, max_gap_char, tag_len, fuzzy, err
 
 
 def find_right_tag(s, tag_regexes, tag_strings, max_gap_char, tag_len,
-        fuzzy, errors, tagged, revcomp = True):
+        fuzzy, errors, tagged, revcomp = True, index = None, mismatch = None,
+        aligner = align, cache = None, context = None):
     """Matching methods for right linker - regex first, followed by fuzzy (SW)
-    alignment, if the option is passed"""
+    alignment, if the option is passed.  If given, a tag index replaces the
+    regex loop, and a cache stores results by the last max_gap_char +
+    tag_len bases, as in find_left_tag().  Cached positions are relative to
+    the end of the read."""
+    if cache is not None:
+        key = ('right', context, s[-(tag_len + max_gap_char):])
+        try:
+            return _shift_match(cache[key], len(s))
+        except KeyError:
+            match = find_right_tag(s, tag_regexes, tag_strings, max_gap_char,
+                    tag_len, fuzzy, errors, tagged, revcomp, index, mismatch,
+                    aligner)
+            cache[key] = _shift_match(match, -len(s))
+            return match
     #if 'MID15_NoError_SimpleX1_NoError_F_NEQ_R' in tagged.read.identifier:
     #    pdb.set_trace()
-    for regex in tag_regexes:
-        match = regex.search(s)
+    if index is not None:
+        match = index.right(s)
         if match is not None:
             m_type = 'regex'
-            start, stop = match.start(), match.end()
-            # by default, this is true
-            tag_matched = regex.pattern.split('[')[0]
+            tag_matched, start, stop = match
             seq_matched = s[start:stop]
-            break
+    else:
+        # TAG[acgtnACGTN]{0,gap}$ can only match within the last tag_len +
+        # max_gap_char bases, so don't search the rest of the read
+        offset = max(len(s) - (tag_len + max_gap_char), 0)
+        tail = s[offset:]
+        for regex in tag_regexes:
+            match = regex.search(tail)
+            if match is not None:
+                m_type = 'regex'
+                start, stop = match.start() + offset, match.end() + offset
+                # by default, this is true
+                tag_matched = regex.pattern.split('[')[0]
+                seq_matched = s[start:stop]
+                break
     if match is None and fuzzy:
-        match = align(s[-(tag_len + max_gap_char):], tag_strings, errors)
+        match = fuzzy_match(s[-(tag_len + max_gap_char):], tag_strings,
+                errors, mismatch, aligner)
         # we can trim w/o regex
         if match:
             # correct match_position
@@ -180,7 +624,9 @@ def find_right_tag(s, tag_regexes, tag_strings, max_gap_char, tag_len,
         return None
 
 
-def trim_one(tagged, regexes, strings, buff, length, fuzzy, errors, trim = 0):
+def trim_one(tagged, regexes, strings, buff, length, fuzzy, errors, trim = 0,
+        index = None, mismatch = None, aligner = align, cache = None,
+        context = None):
     """Remove the MID tag from the sequence read"""
     #if sequence.id == 'MID_No_Error_ATACGACGTA':
     #    pdb.set_trace()
@@ -191,7 +637,12 @@ def trim_one(tagged, regexes, strings, buff, length, fuzzy, errors, trim = 0):
                 buff,
                 length,
                 fuzzy,
-                errors
+                errors,
+                index,
+                mismatch,
+                aligner,
+                cache,
+                context
             )
     if mid:
         target, match_type, match = mid[0], mid[1], mid[4]
@@ -204,7 +655,9 @@ def trim_one(tagged, regexes, strings, buff, length, fuzzy, errors, trim = 0):
 
 
 def trim_two(tagged, fregex, fstring, rregex, rstring, buff,
-        length, fuzzy, errors, trim = 0, revcomp = True):
+        length, fuzzy, errors, trim = 0, revcomp = True, findex = None,
+        rindex = None, fmismatch = None, rmismatch = None, aligner = align,
+        cache = None, context = None):
     """Use regular expression and (optionally) fuzzy string matching
     to locate and trim linkers from sequences"""
 
@@ -214,7 +667,12 @@ def trim_two(tagged, fregex, fstring, rregex, rstring, buff,
                 buff,
                 length,
                 fuzzy,
-                errors
+                errors,
+                findex,
+                fmismatch,
+                aligner,
+                cache,
+                context
             )
     
     right = find_right_tag(tagged.read.sequence,
@@ -225,7 +683,12 @@ def trim_two(tagged, fregex, fstring, rregex, rstring, buff,
                 fuzzy,
                 errors,
                 tagged,
-                revcomp
+                revcomp,
+                rindex,
+                rmismatch,
+                aligner,
+                cache,
+                context
             )
 
     # we can have 5 types of matches - tags on left and right sides,
@@ -271,21 +734,23 @@ def trim_two(tagged, fregex, fstring, rregex, rstring, buff,
     return tagged, target, match_type, match
 
 
-def concat_check(tagged, params):
+def concat_check(tagged, params, aligner=align):
     """Check screened sequence for the presence of concatemers by scanning 
     for all possible tags - after the 5' and 3' tags have been removed"""
     s = tagged.read.sequence
     m_type = None
     #pdb.set_trace()
-    for tag in params.sequence_tags.all_tags[str(tagged.outer_seq)]['regex']:
-        match = tag.search(s)
-        if match:
-            tagged.concat_seq = tag.pattern
-            tagged.concat_type = "regex-concat"
-            tagged.concat_match = tagged.read.sequence[match.start():match.end()]
-            break
+    # one pass of the automaton finds the tag that the first matching
+    # regular expression would
+    automaton = params.sequence_tags.all_tags[str(tagged.outer_seq)].get(
+            'automaton')
+    match = automaton.first(s) if automaton is not None else None
+    if match:
+        tagged.concat_seq = match[0]
+        tagged.concat_type = "regex-concat"
+        tagged.concat_match = tagged.read.sequence[match[1]:match[2]]
     if match is None and params.concat_fuzzy:
-        match = align(s,
+        match = aligner(s,
                 params.sequence_tags.all_tags[str(tagged.outer_seq)]['string'], 
                 params.concat_allowed_errors
             )
@@ -315,26 +780,6 @@ def get_args():
     return parser.parse_args()
 
 
-def get_sequence_count(input, kind):
-    """Determine the number of sequence reads in the input"""
-    if kind == 'fasta':
-        return sum([1 for line in open(input, 'rU') if line.startswith('>')])
-    elif kind == 'fastq' and input.endswith('gz'):
-        return sum([1 for line in gzip.open(input, 'rb')]) / 4
-    else:
-        return sum([1 for line in open(input, 'rU')]) / 4
-
-
-def split_fasta_reads_into_groups(reads, num_reads, num_procs):
-    job_size = num_reads / num_procs
-    print "Parsing reads into groups of {} reads".format(job_size)
-    i = iter(reads)
-    chunk = list(itertools.islice(i, job_size))
-    while chunk:
-        yield chunk
-        chunk = list(itertools.islice(i, job_size))
-
-
 def merge_fastq(a, b):
     for i, j in itertools.izip(a, b):
         yield i, j
@@ -11,17 +11,35 @@ Description:  common files for demuxi.py
 import os
 import re
 import sys
+import time
 import argparse
 import ConfigParser
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from multiprocessing import cpu_count
 from seqtools.sequence.fasta import FastaSequence
 from seqtools.sequence.transform import DNA_reverse_complement, DNA_complement
 from seqtools.sequence.transform import reverse as DNA_reverse
 
+from demuxipy.tagindex import TagAutomaton, TagHash, MismatchIndex, \
+        min_distances
+
 import pdb
 
 
+# exact-match engines that may be given as ExactMatching.  'regex' keeps
+# the compiled regular expressions and builds no index.
+TAG_INDEXES = {
+        'regex': None,
+        'automaton': TagAutomaton,
+        'hash': TagHash
+    }
+
+# fuzzy-match engines that may be given as FuzzyEngine.  core.get_aligner()
+# returns the function for each.
+FUZZY_ENGINES = ['smithwaterman', 'myers', 'vectorized', 'batched',
+        'pruned', 'qgram', 'semiglobal', 'trie']
+
+
 class FullPaths(argparse.Action):
     """Expand user- and relative-paths"""
     def __call__(self, parser, namespace, values, option_string=None):
@@ -41,15 +59,68 @@ class ListQueue(list):
         return self.pop()
 
 
+class MatchCache:
+    """Bounded, least-recently-used cache of tag match results, keyed on
+    the level, outer tag, and window of sequence searched.  Used as a dict,
+    but a missing key raises KeyError and is counted as a miss."""
+    def __init__(self, size):
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getitem__(self, key):
+        try:
+            value = self.cache.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        # move it to the most recently used end
+        self.cache[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.cache:
+            del self.cache[key]
+        self.cache[key] = value
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.
+        return float(self.hits) / lookups
+
+
 class Parameters:
     '''linkers.py run parameters'''
     def __init__(self, conf):
         self.conf = conf
         try:
-            self.fasta = os.path.abspath(os.path.expanduser(
-                    self.conf.get('Input', 'fasta').strip("'")))
-            self.quality = os.path.abspath(os.path.expanduser( \
-                    self.conf.get('Input', 'quality').strip("'")))
+            # a fastq file (plain or gzipped) replaces the fasta and qual
+            if self.conf.has_option('Input', 'fastq'):
+                self.fastq = os.path.abspath(os.path.expanduser(
+                        self.conf.get('Input', 'fastq').strip("'")))
+                self.fasta, self.quality = None, None
+            else:
+                self.fastq = None
+                self.fasta = os.path.abspath(os.path.expanduser(
+                        self.conf.get('Input', 'fasta').strip("'")))
+                self.quality = os.path.abspath(os.path.expanduser( \
+                        self.conf.get('Input', 'quality').strip("'")))
         except ConfigParser.NoOptionError:
             raise (IOError, "Cannot find valid sequence/quality files in [Input] section of {}".format(self.conf))
         self.db = self.conf.get('Output', 'Database')
@@ -60,8 +131,15 @@ class Parameters:
         self.drop = self.conf.getboolean('Quality', 'DropN')
         self.concat_check = self.conf.getboolean('Concatemers', 'ConcatemerChecking')
         self.concat_fuzzy = self.conf.getboolean('Concatemers', 'ConcatemerFuzzyMatching')
-        self.concat_allowed_errors = self.conf.getboolean('Concatemers', 'ConcatemerAllowedErrors')
+        self.concat_allowed_errors = self.conf.getint('Concatemers', 'ConcatemerAllowedErrors')
+        self.concat_engine = self._get_optional('Concatemers',
+                'ConcatemerFuzzyEngine', 'SmithWaterman')
         self.search = self.conf.get('Search', 'SearchFor')
+        self.match_cache_size = self._get_optional('Search', 'MatchCacheSize',
+                0, 'getint')
+        # reads are handed to the worker processes in chunks of this size
+        self.chunk_size = self._get_optional('Multiprocessing', 'ChunkSize',
+                10000, 'getint')
         #if self.search.lower() in ['innergroups', 'outerinnergroups', 'hierarchicalcombinatorial']:
         #    assert self.conf.has_section('InnerTags')
         #elif self.search == 'OuterGroups':
@@ -77,6 +155,12 @@ class Parameters:
             self.outer_trim = self.conf.getint('OuterTags', 'Trim')
             self.outer_fuzzy = self.conf.getboolean('OuterTags', 'FuzzyMatching')
             self.outer_errors = self.conf.getint('OuterTags', 'AllowedErrors')
+            self.outer_exact = self._get_optional('OuterTags', 'ExactMatching',
+                    'Regex')
+            self.outer_mismatch = self._get_optional('OuterTags',
+                    'MismatchIndex', False, 'getboolean')
+            self.outer_engine = self._get_optional('OuterTags', 'FuzzyEngine',
+                    'SmithWaterman')
         if self.conf.has_section('InnerTags'):
             self.inner = self.conf.getboolean('InnerTags', 'Search')
             self.inner_type = self.conf.get('InnerTags', 'TrimType')
@@ -85,6 +169,12 @@ class Parameters:
             self.inner_trim = self.conf.getint('InnerTags', 'Trim')
             self.inner_fuzzy = self.conf.getboolean('InnerTags', 'FuzzyMatching')
             self.inner_errors = self.conf.getint('InnerTags', 'AllowedErrors')
+            self.inner_exact = self._get_optional('InnerTags', 'ExactMatching',
+                    'Regex')
+            self.inner_mismatch = self._get_optional('InnerTags',
+                    'MismatchIndex', False, 'getboolean')
+            self.inner_engine = self._get_optional('InnerTags', 'FuzzyEngine',
+                    'SmithWaterman')
         #all_outer             = self._get_all_outer()
         #all_inner             = self._get_all_inner()
         self._check_values()
@@ -116,6 +206,12 @@ class Parameters:
     def __repr__(self):
         return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
 
+    def _get_optional(self, section, option, default, kind='get'):
+        """return an option that older configuration files may not have"""
+        if self.conf.has_option(section, option):
+            return getattr(self.conf, kind)(section, option)
+        return default
+
     def _get_all_outer(self):
         # if only linkers, you don't need MIDs
         if self.search.lower() in ['outergroups', 'outerinnergroups',
@@ -144,9 +240,20 @@ class Parameters:
                 self.outer_type,
                 self.outer_orientation,
                 self.inner_type,
-                self.inner_orientation
+                self.inner_orientation,
+                o_exact=self.outer_exact,
+                i_exact=self.inner_exact,
+                o_mismatch=self._get_mismatch_errors('outer'),
+                i_mismatch=self._get_mismatch_errors('inner')
             )
 
+    def _get_mismatch_errors(self, level):
+        # only index substitution variants when fuzzy matching is on
+        if getattr(self, '{}_fuzzy'.format(level)) and \
+                getattr(self, '{}_mismatch'.format(level)):
+            return getattr(self, '{}_errors'.format(level))
+        return None
+
     def _check_values(self):
         assert self.outer_type.lower() in ['single', 'both'], \
                 "Outer type must be one of ['Single','Both']"
@@ -156,6 +263,20 @@ class Parameters:
                 "Outer type must be one of ['Single','Both']"
         assert self.inner_orientation.lower() in ['reverse', 'forward'], \
                 "Inner orientation must be one of ['Forward','Reverse']"
+        assert self.outer_exact.lower() in TAG_INDEXES, \
+                "Outer ExactMatching must be one of ['Regex','Automaton','Hash']"
+        assert self.inner_exact.lower() in TAG_INDEXES, \
+                "Inner ExactMatching must be one of ['Regex','Automaton','Hash']"
+        assert self.outer_engine.lower() in FUZZY_ENGINES, \
+                "Outer FuzzyEngine must be one of ['SmithWaterman','Myers','Vectorized','Batched','Pruned','QGram','SemiGlobal','Trie']"
+        assert self.inner_engine.lower() in FUZZY_ENGINES, \
+                "Inner FuzzyEngine must be one of ['SmithWaterman','Myers','Vectorized','Batched','Pruned','QGram','SemiGlobal','Trie']"
+        assert self.concat_engine.lower() in FUZZY_ENGINES, \
+                "ConcatemerFuzzyEngine must be one of ['SmithWaterman','Myers','Vectorized','Batched','Pruned','QGram','SemiGlobal','Trie']"
+        assert self.match_cache_size >= 0, \
+                "MatchCacheSize must be >= 0"
+        assert self.chunk_size > 0, \
+                "ChunkSize must be > 0"
         assert self.search.lower() in \
                 [
                     'innergroups',
@@ -186,11 +307,21 @@ class Primers:
 class SequenceTags:
     """ """
     def __init__(self, all_outers, all_inners, search, group, outer_gap, inner_gap,
-            concat, o_type, o_orientation, i_type, i_orientation):
+            concat, o_type, o_orientation, i_type, i_orientation,
+            o_exact='regex', i_exact='regex', o_mismatch=None,
+            i_mismatch=None):
         self.outers = None
         self.inners = None
         self.cluster_map = None
         self.all_tags = None
+        self.outer_index = {}
+        self.inner_index = {}
+        self.outer_mismatch = {}
+        self.inner_mismatch = {}
+        self.mismatch_stats = None
+        self.outer_distance = {}
+        self.inner_distance = {}
+        self.min_distance = {'outer': None, 'inner': None}
         self.outer_gap = outer_gap
         self.inner_gap = inner_gap
         if all_outers:
@@ -204,6 +335,13 @@ class SequenceTags:
         # pare down the list of linkers and MIDS to those we've used
         self._generate_clusters_and_get_cluster_tags(all_outers, all_inners, search,
                 group, o_type, o_orientation, i_type, i_orientation)
+        # build exact-match indexes for anything other than the regexes
+        self._generate_indexes(o_exact, i_exact)
+        # the distance from each tag to its closest neighbour
+        self._generate_distances()
+        # and substitution variants of tags for fuzzy matching
+        if o_mismatch is not None or i_mismatch is not None:
+            self._generate_mismatch_indexes(o_mismatch, i_mismatch)
         # do we check for concatemers?
         if concat:
             self._all_possible_tags(search)
@@ -270,7 +408,90 @@ class SequenceTags:
             if inner_type.lower() == 'both':
                 self.inners[m]['reverse_regex'] = \
                 self._build_regex(self.inners[m]['reverse_string'],
-                self.inner_gap)
+                self.inner_gap, rev=True)
+
+    def _build_index(self, tags, gap, kind):
+        index = TAG_INDEXES[kind.lower()]
+        if index is None or not tags:
+            return None
+        return index(tags, gap)
+
+    def _build_indexes(self, tags, gap, kind):
+        # index the strings in the same (set) order used to build the
+        # regular expressions, so the first tag to match is the same
+        return {
+                'forward': self._build_index(tags.get('forward_string'),
+                    gap, kind),
+                'reverse': self._build_index(tags.get('reverse_string'),
+                    gap, kind)
+            }
+
+    def _generate_indexes(self, o_exact, i_exact):
+        if self.outers:
+            self.outer_index = self._build_indexes(self.outers,
+                    self.outer_gap, o_exact)
+        if self.inners:
+            for m in self.inners:
+                self.inner_index[m] = self._build_indexes(self.inners[m],
+                        self.inner_gap, i_exact)
+
+    def _build_mismatch_indexes(self, tags, errors):
+        indexes = {}
+        for direction in ['forward', 'reverse']:
+            strings = tags.get('{}_string'.format(direction))
+            indexes[direction] = MismatchIndex(strings, errors) if strings \
+                    else None
+        return indexes
+
+    def _generate_mismatch_indexes(self, o_mismatch, i_mismatch):
+        start = time.time()
+        if self.outers and o_mismatch is not None:
+            self.outer_mismatch = self._build_mismatch_indexes(self.outers,
+                    o_mismatch)
+        if self.inners and i_mismatch is not None:
+            for m in self.inners:
+                self.inner_mismatch[m] = self._build_mismatch_indexes(
+                        self.inners[m], i_mismatch)
+        indexes = [i for i in self.outer_mismatch.values() if i] + \
+                [i for d in self.inner_mismatch.values() for i in d.values()
+                    if i]
+        self.mismatch_stats = {
+                'time': time.time() - start,
+                'variants': sum([len(i) for i in indexes]),
+                'memory': sum([i.memory() for i in indexes])
+            }
+
+    def _build_distances(self, tag_sets):
+        # merge the distances of tags found in more than one set (e.g. the
+        # forward and reverse strings) by keeping the smallest
+        distances, computed = {}, {}
+        for tags in tag_sets:
+            if not tags:
+                continue
+            key = frozenset(tags)
+            if key not in computed:
+                computed[key] = min_distances(tags)
+            for tag, distance in computed[key].iteritems():
+                if tag not in distances or distance < distances[tag]:
+                    distances[tag] = distance
+        return distances
+
+    def _generate_distances(self):
+        if self.outers:
+            self.outer_distance = self._build_distances([
+                    self.outers.get('forward_string'),
+                    self.outers.get('reverse_string')
+                ])
+        if self.inners:
+            self.inner_distance = self._build_distances([
+                    self.inners[m].get(direction)
+                    for m in self.inners
+                    for direction in ['forward_string', 'reverse_string']
+                ])
+        for level, distances in [('outer', self.outer_distance),
+                ('inner', self.inner_distance)]:
+            if distances:
+                self.min_distance[level] = min(distances.values())
 
     def _generate_outer_reverse_strings(self, m, outer_type, outer_orientation):
         if outer_type.lower() == 'both':
@@ -434,9 +655,13 @@ class SequenceTags:
             else:
                 self.all_tags[m]['string'] = \
                              self.all_tags[m]['string'].union(self.outers['forward_string'])
-        # compile
-        self.all_tags[m]['regex'] = [re.compile(t) for t in
-                self.all_tags[m]['string']]
+        # compile, for each outer tag.  The automaton numbers the tags in
+        # the same order as the regular expressions.
+        for m in self.all_tags:
+            strings = list(self.all_tags[m]['string'])
+            self.all_tags[m]['regex'] = [re.compile(t) for t in strings]
+            if strings:
+                self.all_tags[m]['automaton'] = TagAutomaton(strings, 0)
 
 
 class Tagged:
@@ -0,0 +1,112 @@
+"""
+File: myers.py
+Author: Brant Faircloth
+
+Created by Brant Faircloth on 17 October 2026 14:40 PDT (-0700)
+Copyright (c) 2026 Brant C. Faircloth. All rights reserved.
+
+Description: bit-parallel (Myers/Hyyro) approximate matching of sequence
+tags, to limit the Smith-Waterman alignment in core.align() to the tags
+that can match
+
+"""
+
+
+class MyersAligner:
+    """Fuzzy match sequence tags using the bit-parallel edit distance of each
+    tag to a window of sequence, with python ints as bit vectors over the
+    tag.  Any alignment that core.align() accepts is within allowed_errors
+    edits of the tag, so only the tags within that distance are passed on to
+    aligner, which gives the same result as aligning all of them.  Called
+    as core.align() is, and returns the same tuple."""
+    def __init__(self, aligner):
+        self.aligner = aligner
+        # per-tag match vectors (Peq), for the forward and reversed tag
+        self.peq = {}
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def __call__(self, seq, tags, allowed_errors):
+        candidates = [tag for tag in tags
+                if self.within(seq, tag, allowed_errors)]
+        if not candidates:
+            return None
+        return self.aligner(seq, candidates, allowed_errors)
+
+    def _get_peq(self, tag):
+        if tag not in self.peq:
+            self.peq[tag] = (self._build_peq(tag), self._build_peq(tag[::-1]))
+        return self.peq[tag]
+
+    def _build_peq(self, tag):
+        peq = {}
+        for i, base in enumerate(tag):
+            peq[base] = peq.get(base, 0) | (1 << i)
+        return peq
+
+    def _scores(self, seq, peq, m, anchored=False):
+        """Yield the edit distance of the tag to the best substring of seq
+        ending at each position.  If anchored, substrings start at 0."""
+        mask = (1 << m) - 1
+        high = 1 << (m - 1)
+        pv, mv, score = mask, 0, m
+        for base in seq:
+            eq = peq.get(base, 0)
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & mask)
+            mh = pv & xh
+            if ph & high:
+                score += 1
+            elif mh & high:
+                score -= 1
+            ph = (ph << 1) & mask
+            mh = (mh << 1) & mask
+            if anchored:
+                ph |= 1
+            pv = mh | (~(xv | ph) & mask)
+            mv = ph & xv
+            yield score
+
+    def within(self, seq, tag, allowed_errors):
+        """True if tag occurs in seq with no more than allowed_errors"""
+        for score in self._scores(seq, self._get_peq(tag)[0], len(tag)):
+            if score <= allowed_errors:
+                return True
+        return False
+
+    def _pick(self, positions, seq, base):
+        # a local alignment keeps an end of the tag if it matches and drops
+        # it if it does not, so prefer the widest span whose terminal base
+        # matches the tag and otherwise the narrowest
+        for pos in reversed(positions):
+            if seq[pos] == base:
+                return pos
+        return positions[0]
+
+    def search(self, seq, tag, allowed_errors):
+        """Return (errors, start, end) for the closest occurrence of tag in
+        seq, or None if it has more than allowed_errors.  Positions are in
+        seq, without gaps, as core.get_align_match_position() returns them."""
+        m = len(tag)
+        forward, reverse = self._get_peq(tag)
+        best, ends = allowed_errors + 1, []
+        for pos, score in enumerate(self._scores(seq, forward, m)):
+            if score < best:
+                best, ends = score, [pos]
+            elif score == best:
+                ends.append(pos)
+        if best > allowed_errors:
+            return None
+        # the ends are sorted by distance from the start of seq, and the
+        # starts by distance from the end
+        end = self._pick(ends, seq, tag[-1]) + 1
+        starts = [end - length - 1 for length, score in
+                enumerate(self._scores(seq[end - 1::-1], reverse, m, True))
+                if score == best]
+        start = self._pick(starts, seq, tag[0])
+        return best, start, end
@@ -87,15 +87,28 @@ localds(sequenceA, sequenceB, match_dict, open, extend) -> alignments
 #   Which character to use as a gap character in the alignment
 #   returned.  By default, uses '-'.
 # - force_generic: boolean
-#   Always use the generic, non-cached, dynamic programming function.
-#   For debugging.
+#   Always use the generic dynamic programming function, which calls
+#   the gap functions rather than caching affine penalties.  For
+#   debugging.
+# - nonaffine_gaps: boolean
+#   The gap functions are not affine, so for each cell scan every
+#   previous row and column for the best gap
+#   (_make_score_matrix_nonaffine).  This is O(n^2 m + n m^2), and
+#   much slower than the O(n m) of the other functions.
+# - force_numpy: boolean
+#   Always fill the matrices with numpy (_make_score_matrix_numpy)
+#   when the gap penalties are affine.  By default, numpy is only used
+#   for large matrices, and only without the C implementation.
 # - score_only: boolean
 #   Only get the best score, don't recover any alignments.  The return
 #   value of the function is the score.
 # - one_alignment_only: boolean
 #   Only recover one alignment.
 
+import numpy
+
 MAX_ALIGNMENTS = 1000   # maximum alignments recovered in traceback
+NUMPY_MIN_WIDTH = 16    # mean anti-diagonal length for the numpy fill
 
 class align(object):
     """This class provides functions that do alignments."""
@@ -132,7 +145,10 @@ and extendB for sequeneB.  The penalties should be negative."""),
             'c' : (['gap_A_fn', 'gap_B_fn'],
 """gap_A_fn and gap_B_fn are callback functions that takes 1) the
 index where the gap is opened, and 2) the length of the gap.  They
-should return a gap penalty."""),
+should return a gap penalty.  The penalty for opening a gap may
+depend on the index, but each residue added to a gap should cost the
+same (affine penalties).  Pass nonaffine_gaps=1 for any other
+penalties, which is much slower."""),
             }
 
         def __init__(self, name):
@@ -235,6 +251,8 @@ alignment occurs.
                 ('align_globally', self.align_type == 'global'),
                 ('gap_char', '-'),
                 ('force_generic', 0),
+                ('force_numpy', 0),
+                ('nonaffine_gaps', 0),
                 ('score_only', 0),
                 ('one_alignment_only', 0)
                 ]
@@ -254,15 +272,70 @@ align = align()
 def _align(sequenceA, sequenceB, match_fn, gap_A_fn, gap_B_fn,
            penalize_extend_when_opening, penalize_end_gaps,
            align_globally, gap_char, force_generic, score_only,
-           one_alignment_only):
+           one_alignment_only, force_numpy, nonaffine_gaps):
     if not sequenceA or not sequenceB:
         return []
 
-    if (not force_generic) and isinstance(gap_A_fn, affine_penalty) \
+    if (not force_generic) and (not nonaffine_gaps) \
+    and isinstance(gap_A_fn, affine_penalty) \
+    and isinstance(gap_B_fn, affine_penalty) and not _HAVE_C:
+        # Scores that are exactly integers once scaled (e.g. 5, -4,
+        # -9, -0.5) are aligned as integers, which need no rint(), and
+        # scaled back.
+        values = _match_values(match_fn)
+        if values is not None:
+            values.extend([gap_A_fn.open, gap_A_fn.extend,
+                           gap_B_fn.open, gap_B_fn.extend])
+            scale = _integer_scale(values)
+            if scale is not None and not _is_integer(values):
+                x = _align(
+                    sequenceA, sequenceB, _scale_match(match_fn, scale),
+                    _scale_penalty(gap_A_fn, scale),
+                    _scale_penalty(gap_B_fn, scale),
+                    penalize_extend_when_opening, penalize_end_gaps,
+                    align_globally, gap_char, force_generic, score_only,
+                    one_alignment_only, force_numpy, nonaffine_gaps)
+                if score_only:
+                    return x / float(scale)
+                return [(seqA, seqB, score / float(scale), begin, end)
+                        for seqA, seqB, score, begin, end in x]
+
+    if nonaffine_gaps:
+        x = _make_score_matrix_nonaffine(
+            sequenceA, sequenceB, match_fn, gap_A_fn, gap_B_fn,
+            penalize_extend_when_opening, penalize_end_gaps, align_globally,
+            score_only)
+    elif (not force_generic) and isinstance(gap_A_fn, affine_penalty) \
     and isinstance(gap_B_fn, affine_penalty):
         open_A, extend_A = gap_A_fn.open, gap_A_fn.extend
         open_B, extend_B = gap_B_fn.open, gap_B_fn.extend
-        x = _make_score_matrix_fast(
+        # Filling the matrix by anti-diagonals only pays off when they
+        # are long.
+        lenA, lenB = len(sequenceA), len(sequenceB)
+        if score_only and not force_numpy and not _HAVE_C:
+            best_score, best_pos = _score_only_fast(
+                sequenceA, sequenceB, match_fn, open_A, extend_A, open_B,
+                extend_B, penalize_extend_when_opening, penalize_end_gaps,
+                align_globally)
+            return best_score
+        if force_numpy or (not _HAVE_C and
+                           lenA * lenB >= NUMPY_MIN_WIDTH * (lenA + lenB)):
+            make_score_matrix = _make_score_matrix_numpy
+        else:
+            make_score_matrix = _make_score_matrix_fast
+        if make_score_matrix is _make_score_matrix_fast and not _HAVE_C \
+        and one_alignment_only and not align_globally and not score_only:
+            # Only the first of the best cells is traced back, so keep
+            # it during the fill.
+            score_matrix, trace_matrix, starts = make_score_matrix(
+                sequenceA, sequenceB, match_fn, open_A, extend_A, open_B,
+                extend_B, penalize_extend_when_opening, penalize_end_gaps,
+                align_globally, score_only, True)
+            return _recover_alignments(
+                sequenceA, sequenceB, starts, score_matrix, trace_matrix,
+                align_globally, penalize_end_gaps, gap_char,
+                one_alignment_only)
+        x = make_score_matrix(
             sequenceA, sequenceB, match_fn, open_A, extend_A, open_B, extend_B,
             penalize_extend_when_opening, penalize_end_gaps, align_globally,
             score_only)
@@ -276,28 +349,30 @@ def _align(sequenceA, sequenceB, match_fn, gap_A_fn, gap_B_fn,
     #print "SCORE"; print_matrix(score_matrix)
     #print "TRACEBACK"; print_matrix(trace_matrix)
          
-    # Look for the proper starting point.  Get a list of all possible
-    # starting points.
-    starts = _find_start(
-        score_matrix, sequenceA, sequenceB,
-        gap_A_fn, gap_B_fn, penalize_end_gaps, align_globally)
-    # Find the highest score.
-    best_score = max([x[0] for x in starts])
-
-    # If they only want the score, then return it.
-    if score_only:
-        return best_score
-    
     tolerance = 0  # XXX do anything with this?
-    # Now find all the positions within some tolerance of the best
-    # score.
-    i = 0
-    while i < len(starts):
-        score, pos = starts[i]
-        if rint(abs(score-best_score)) > rint(tolerance):
-            del starts[i]
-        else:
-            i += 1
+    if one_alignment_only and not align_globally and not score_only:
+        # Only the first of the best cells is traced back, so find it
+        # without listing every cell.  The numpy fill goes by
+        # anti-diagonals, and the C and callback fills do not keep it,
+        # so the filled matrix is scanned.
+        starts = _find_local_best_start(score_matrix, tolerance)
+    else:
+        # Look for the proper starting point.  Get a list of all
+        # possible starting points.
+        starts = _find_start(
+            score_matrix, sequenceA, sequenceB,
+            gap_A_fn, gap_B_fn, penalize_end_gaps, align_globally)
+        # Find the highest score.
+        best_score = max([x[0] for x in starts])
+
+        # If they only want the score, then return it.
+        if score_only:
+            return best_score
+
+        # Now find all the positions within some tolerance of the best
+        # score.
+        starts = [(score, pos) for score, pos in starts
+                  if rint(abs(score-best_score)) <= rint(tolerance)]
     
     # Recover the alignments and return them.
     x = _recover_alignments(
@@ -306,11 +381,120 @@ def _align(sequenceA, sequenceB, match_fn, gap_A_fn, gap_B_fn,
     return x
 
 def _make_score_matrix_generic(
+    sequenceA, sequenceB, match_fn, gap_A_fn, gap_B_fn,
+    penalize_extend_when_opening, penalize_end_gaps, align_globally,
+    score_only):
+    # Gotoh's algorithm, for any affine gap functions.  As in
+    # _make_score_matrix_fast, the best score of a gap in each row and
+    # column (the gap states) is cached, along with the indexes it
+    # comes from, and a gap is either opened from the previous cell or
+    # extended from the cache.  The penalties come from the gap
+    # functions: opening a gap costs gap_fn(index, 1) at its index,
+    # and extending it by one costs the same wherever it was opened,
+    # so the cached gap stays the best one, and its score is that of
+    # the cell it comes from plus gap_fn(index, length).
+
+    # Create the score and traceback matrices.  These should be in the
+    # shape:
+    # sequenceA (down) x sequenceB (across)
+    lenA, lenB = len(sequenceA), len(sequenceB)
+    score_matrix, trace_matrix = [], []
+    for i in range(lenA):
+        score_matrix.append([None] * lenB)
+        trace_matrix.append([[None]] * lenB)
+
+    # The top and left borders, as in _make_score_matrix_nonaffine.
+    for i in range(lenA):
+        score = match_fn(sequenceA[i], sequenceB[0])
+        if penalize_end_gaps:
+            score += gap_B_fn(0, i)
+        score_matrix[i][0] = score
+    for i in range(1, lenB):
+        score = match_fn(sequenceA[0], sequenceB[i])
+        if penalize_end_gaps:
+            score += gap_A_fn(0, i)
+        score_matrix[0][i] = score
+
+    # The best gap score and indexes for each row and column.  A gap
+    # in sequenceA from (row, i) to column col has length col-1-i, and
+    # a gap in sequenceB from (i, col) to row row has length row-1-i.
+    row_cache_score, row_cache_index = [None]*(lenA-1), [None]*(lenA-1)
+    col_cache_score, col_cache_index = [None]*(lenB-1), [None]*(lenB-1)
+    for i in range(lenA-1):
+        row_cache_score[i] = score_matrix[i][0] + gap_A_fn(0, 1)
+        row_cache_index[i] = [(i, 0)]
+    for i in range(lenB-1):
+        col_cache_score[i] = score_matrix[0][i] + gap_B_fn(0, 1)
+        col_cache_index[i] = [(0, i)]
+
+    for row in range(1, lenA):
+        for col in range(1, lenB):
+            nogap_score = score_matrix[row-1][col-1]
+            if col > 1:
+                row_score = row_cache_score[row-1]
+            else:
+                row_score = nogap_score - 1   # Make sure it's not the best.
+            if row > 1:
+                col_score = col_cache_score[col-1]
+            else:
+                col_score = nogap_score - 1
+
+            best_score = max(nogap_score, row_score, col_score)
+            best_score_rint = rint(best_score)
+            best_index = []
+            if best_score_rint == rint(nogap_score):
+                best_index.append((row-1, col-1))
+            if best_score_rint == rint(row_score):
+                best_index.extend(row_cache_index[row-1])
+            if best_score_rint == rint(col_score):
+                best_index.extend(col_cache_index[col-1])
+
+            score = best_score + match_fn(sequenceA[row], sequenceB[col])
+            if not align_globally and score < 0:
+                score_matrix[row][col] = 0
+            else:
+                score_matrix[row][col] = score
+            trace_matrix[row][col] = best_index
+
+            # Update the cached column scores, for a gap in sequenceB
+            # reaching row+1.
+            open_score = score_matrix[row-1][col-1] + gap_B_fn(row-1, 1)
+            i = col_cache_index[col-1][0][0]
+            extend_score = score_matrix[i][col-1] + gap_B_fn(i, row-i)
+            col_cache_score[col-1], col_cache_index[col-1] = _best_gap(
+                open_score, extend_score, col_cache_index[col-1],
+                (row-1, col-1))
+
+            # Update the cached row scores, for a gap in sequenceA
+            # reaching col+1.
+            open_score = score_matrix[row-1][col-1] + gap_A_fn(col-1, 1)
+            i = row_cache_index[row-1][0][1]
+            extend_score = score_matrix[row-1][i] + gap_A_fn(i, col-i)
+            row_cache_score[row-1], row_cache_index[row-1] = _best_gap(
+                open_score, extend_score, row_cache_index[row-1],
+                (row-1, col-1))
+    return score_matrix, trace_matrix
+
+def _best_gap(open_score, extend_score, extend_index, open_index):
+    # Return the score and indexes of the better of opening and
+    # extending a gap, or of both if they tie.
+    open_score_rint, extend_score_rint = rint(open_score), rint(extend_score)
+    if open_score_rint > extend_score_rint:
+        return open_score, [open_index]
+    elif extend_score_rint > open_score_rint:
+        return extend_score, extend_index
+    if open_index not in extend_index:
+        extend_index = extend_index + [open_index]
+    return open_score, extend_index
+
+def _make_score_matrix_nonaffine(
     sequenceA, sequenceB, match_fn, gap_A_fn, gap_B_fn, 
     penalize_extend_when_opening, penalize_end_gaps, align_globally,
     score_only):
     # This is an implementation of the Needleman-Wunsch dynamic
-    # programming algorithm for aligning sequences.
+    # programming algorithm for aligning sequences, for any gap
+    # functions.  It is O(n^2 m + n m^2), so it is only used when
+    # asked for (nonaffine_gaps).
     
     # Create the score and traceback matrices.  These should be in the
     # shape:
@@ -389,7 +573,11 @@ def _make_score_matrix_generic(
 def _make_score_matrix_fast(
     sequenceA, sequenceB, match_fn, open_A, extend_A, open_B, extend_B,
     penalize_extend_when_opening, penalize_end_gaps,
-    align_globally, score_only):
+    align_globally, score_only, track_best=False):
+    # With track_best, the best score and the first cell (by row, then
+    # column) with it are kept as the cells are filled, and returned as
+    # a third item, [(score, (row, col))], as _find_local_best_start
+    # returns them.
     first_A_gap = calc_affine_penalty(1, open_A, extend_A,
                                       penalize_extend_when_opening)
     first_B_gap = calc_affine_penalty(1, open_B, extend_B,
@@ -432,6 +620,9 @@ def _make_score_matrix_fast(
     # cache for the best one.  Whenever the row or col increments, the
     # best cached score just decreases by extending the gap longer.
 
+    # Integer scores break ties without rint().
+    integer = _is_integer_scoring(match_fn, open_A, extend_A, open_B, extend_B)
+
     # The best score and indexes for each row (goes down all columns).
     # I don't need to store the last row because it's the end of the
     # sequence.
@@ -447,9 +638,27 @@ def _make_score_matrix_fast(
     for i in range(lenB-1):
         col_cache_score[i] = score_matrix[0][i] + first_B_gap
         col_cache_index[i] = [(0, i)]
+
+    if track_best:
+        # A later cell only replaces the best cell with a score higher
+        # by more than rint() tolerance, and the score kept is the
+        # highest seen.
+        top_score, top_pos = score_matrix[0][0], (0, 0)
+        for col in range(1, lenB):
+            score = score_matrix[0][col]
+            if score > top_score:
+                if integer or rint(score-top_score) > 0:
+                    top_pos = (0, col)
+                top_score = score
         
     # Fill in the score_matrix.
     for row in range(1, lenA):
+        if track_best:
+            score = score_matrix[row][0]
+            if score > top_score:
+                if integer or rint(score-top_score) > 0:
+                    top_pos = (row, 0)
+                top_score = score
         for col in range(1, lenB):
             # Calculate the score that would occur by extending the
             # alignment without gaps.
@@ -469,22 +678,33 @@ def _make_score_matrix_fast(
                 col_score = nogap_score - 1
 
             best_score = max(nogap_score, row_score, col_score)
-            best_score_rint = rint(best_score)
             best_index = []
-            if best_score_rint == rint(nogap_score):
-                best_index.append((row-1, col-1))
-            if best_score_rint == rint(row_score):
-                best_index.extend(row_cache_index[row-1])
-            if best_score_rint == rint(col_score):
-                best_index.extend(col_cache_index[col-1])
+            if integer:
+                if best_score == nogap_score:
+                    best_index.append((row-1, col-1))
+                if best_score == row_score:
+                    best_index.extend(row_cache_index[row-1])
+                if best_score == col_score:
+                    best_index.extend(col_cache_index[col-1])
+            else:
+                best_score_rint = rint(best_score)
+                if best_score_rint == rint(nogap_score):
+                    best_index.append((row-1, col-1))
+                if best_score_rint == rint(row_score):
+                    best_index.extend(row_cache_index[row-1])
+                if best_score_rint == rint(col_score):
+                    best_index.extend(col_cache_index[col-1])
 
             # Set the score and traceback matrices.
             score = best_score + match_fn(sequenceA[row], sequenceB[col])
             if not align_globally and score < 0:
-                score_matrix[row][col] = 0
-            else:
-                score_matrix[row][col] = score
+                score = 0
+            score_matrix[row][col] = score
             trace_matrix[row][col] = best_index
+            if track_best and score > top_score:
+                if integer or rint(score-top_score) > 0:
+                    top_pos = (row, col)
+                top_score = score
 
             # Update the cached column scores.  The best score for
             # this can come from either extending the gap in the
@@ -493,8 +713,11 @@ def _make_score_matrix_fast(
             # and keep the best one.
             open_score = score_matrix[row-1][col-1] + first_B_gap
             extend_score = col_cache_score[col-1] + extend_B
-            open_score_rint, extend_score_rint = \
-                             rint(open_score), rint(extend_score)
+            if integer:
+                open_score_rint, extend_score_rint = open_score, extend_score
+            else:
+                open_score_rint, extend_score_rint = \
+                                 rint(open_score), rint(extend_score)
             if open_score_rint > extend_score_rint:
                 col_cache_score[col-1] = open_score
                 col_cache_index[col-1] = [(row-1, col-1)]
@@ -509,8 +732,11 @@ def _make_score_matrix_fast(
             # Update the cached row scores.
             open_score = score_matrix[row-1][col-1] + first_A_gap
             extend_score = row_cache_score[row-1] + extend_A
-            open_score_rint, extend_score_rint = \
-                             rint(open_score), rint(extend_score)
+            if integer:
+                open_score_rint, extend_score_rint = open_score, extend_score
+            else:
+                open_score_rint, extend_score_rint = \
+                                 rint(open_score), rint(extend_score)
             if open_score_rint > extend_score_rint:
                 row_cache_score[row-1] = open_score
                 row_cache_index[row-1] = [(row-1, col-1)]
@@ -522,8 +748,286 @@ def _make_score_matrix_fast(
                     row_cache_index[row-1] = row_cache_index[row-1] + \
                                              [(row-1, col-1)]
                     
+    if track_best:
+        row, col = top_pos
+        return score_matrix, trace_matrix, [(score_matrix[row][col], top_pos)]
     return score_matrix, trace_matrix
     
+def _score_only_fast(
+    sequenceA, sequenceB, match_fn, open_A, extend_A, open_B, extend_B,
+    penalize_extend_when_opening, penalize_end_gaps, align_globally):
+    # The scores of _make_score_matrix_fast, and the best of the starts
+    # that _find_start would return, without the traceback.  Only the
+    # previous row of scores and the gap caches are kept.  Returns the
+    # best score and the (row, col) of the first cell (or, for global
+    # alignments, start) with that score.
+    first_A_gap = calc_affine_penalty(1, open_A, extend_A,
+                                      penalize_extend_when_opening)
+    first_B_gap = calc_affine_penalty(1, open_B, extend_B,
+                                      penalize_extend_when_opening)
+    lenA, lenB = len(sequenceA), len(sequenceB)
+    scores, rowsA, colsB = _match_matrix(sequenceA, sequenceB, match_fn)
+    colsB = colsB.tolist()
+    integer = _is_integer(
+        [open_A, extend_A, open_B, extend_B] + sum(scores, []))
+
+    # The first row.
+    matches = scores[rowsA[0]]
+    prev_row = [matches[i] for i in colsB]
+    if penalize_end_gaps:
+        prev_row[0] += calc_affine_penalty(
+            0, open_B, extend_B, penalize_extend_when_opening)
+        for i in range(1, lenB):
+            prev_row[i] += calc_affine_penalty(
+                i, open_A, extend_A, penalize_extend_when_opening)
+    col_cache_score = [score + first_B_gap for score in prev_row[:-1]]
+    best_score, best_pos = None, None
+    if not align_globally:
+        best_score = max(prev_row)
+        best_pos = (0, prev_row.index(best_score))
+    last_col = [prev_row[-1]]
+
+    for row in range(1, lenA):
+        matches = scores[rowsA[row]]
+        score = matches[colsB[0]]
+        if penalize_end_gaps:
+            score += calc_affine_penalty(
+                row, open_B, extend_B, penalize_extend_when_opening)
+        this_row = [score]
+        row_cache_score = prev_row[0] + first_A_gap
+        for col in range(1, lenB):
+            nogap_score = prev_row[col-1]
+            if col > 1:
+                row_score = row_cache_score
+            else:
+                row_score = nogap_score - 1
+            if row > 1:
+                col_score = col_cache_score[col-1]
+            else:
+                col_score = nogap_score - 1
+            score = max(nogap_score, row_score, col_score) + \
+                    matches[colsB[col]]
+            if not align_globally and score < 0:
+                score = 0
+            this_row.append(score)
+
+            # Update the caches, keeping the open score on ties as
+            # _make_score_matrix_fast does.
+            open_score = nogap_score + first_B_gap
+            extend_score = col_cache_score[col-1] + extend_B
+            if integer:
+                extended = extend_score > open_score
+            else:
+                extended = rint(extend_score) > rint(open_score)
+            if extended:
+                col_cache_score[col-1] = extend_score
+            else:
+                col_cache_score[col-1] = open_score
+            open_score = nogap_score + first_A_gap
+            extend_score = row_cache_score + extend_A
+            if integer:
+                extended = extend_score > open_score
+            else:
+                extended = rint(extend_score) > rint(open_score)
+            if extended:
+                row_cache_score = extend_score
+            else:
+                row_cache_score = open_score
+        if not align_globally:
+            score = max(this_row)
+            if score > best_score:
+                best_score, best_pos = score, (row, this_row.index(score))
+        last_col.append(this_row[-1])
+        prev_row = this_row
+
+    if not align_globally:
+        return best_score, best_pos
+    # The starts of a global alignment are in the last column, then the
+    # last row.
+    for row in range(lenA):
+        score = last_col[row]
+        if penalize_end_gaps:
+            score += calc_affine_penalty(
+                lenA-row-1, open_B, extend_B, penalize_extend_when_opening)
+        if best_pos is None or score > best_score:
+            best_score, best_pos = score, (row, lenB-1)
+    for col in range(lenB-1):
+        score = prev_row[col]
+        if penalize_end_gaps:
+            score += calc_affine_penalty(
+                lenB-col-1, open_A, extend_A, penalize_extend_when_opening)
+        if score > best_score:
+            best_score, best_pos = score, (lenA-1, col)
+    return best_score, best_pos
+
+# Traceback flags for _make_score_matrix_numpy.  The first three give
+# the best indexes of a cell: the previous cell without gaps, the
+# cached gap in sequenceA along the previous row, and the cached gap in
+# sequenceB down the previous column.  The others record how each cell
+# updated the row and column caches, opening a gap from the previous
+# cell, extending the cached gap, or both (when they tie).
+_TRACE_NOGAP, _TRACE_ROW, _TRACE_COL = 1, 2, 4
+_ROW_OPEN, _ROW_EXTEND, _COL_OPEN, _COL_EXTEND = 8, 16, 32, 64
+
+def _rint_array(x, precision=None):
+    # rint() of each element of an array, truncating as int() does.
+    return numpy.trunc(x * (precision or _PRECISION) + 0.5)
+
+def _match_matrix(sequenceA, sequenceB, match_fn):
+    # Score every pair of residues, calling match_fn once for each pair
+    # of distinct residues rather than once for each cell.
+    residuesA, residuesB = list(set(sequenceA)), list(set(sequenceB))
+    scores = [[match_fn(a, b) for b in residuesB] for a in residuesA]
+    indexA = dict([(a, i) for i, a in enumerate(residuesA)])
+    indexB = dict([(b, i) for i, b in enumerate(residuesB)])
+    rows = numpy.array([indexA[a] for a in sequenceA])
+    cols = numpy.array([indexB[b] for b in sequenceB])
+    return scores, rows, cols
+
+def _make_score_matrix_numpy(
+    sequenceA, sequenceB, match_fn, open_A, extend_A, open_B, extend_B,
+    penalize_extend_when_opening, penalize_end_gaps,
+    align_globally, score_only):
+    # The same algorithm as _make_score_matrix_fast, returning the same
+    # scores, but the score matrix is a numpy array and the traceback
+    # matrix an array of flags (above) that _recover_alignments
+    # decodes.  Each cell depends only on the cell diagonally before it
+    # and on the row and column caches, which only the cells in that
+    # row and column update, so the cells of each anti-diagonal are
+    # filled at once, in the same order of operations as the loops of
+    # _make_score_matrix_fast.
+    first_A_gap = calc_affine_penalty(1, open_A, extend_A,
+                                      penalize_extend_when_opening)
+    first_B_gap = calc_affine_penalty(1, open_B, extend_B,
+                                      penalize_extend_when_opening)
+    lenA, lenB = len(sequenceA), len(sequenceB)
+    scores, rowsA, colsB = _match_matrix(sequenceA, sequenceB, match_fn)
+    # Keep integer scores as integers, as the python lists would.
+    dtype = int
+    for value in [first_A_gap, first_B_gap, extend_A, extend_B] + \
+            [x for row in scores for x in row]:
+        if not isinstance(value, (int, long)):
+            dtype = float
+            break
+    match_matrix = numpy.array(scores, dtype=dtype)[rowsA[:, None],
+                                                    colsB[None, :]]
+    score_matrix = numpy.empty((lenA, lenB), dtype=dtype)
+    trace_matrix = numpy.zeros((lenA, lenB), dtype=numpy.uint8)
+
+    # The top and left borders.
+    score_matrix[:, 0] = match_matrix[:, 0]
+    score_matrix[0, 1:] = match_matrix[0, 1:]
+    if penalize_end_gaps:
+        for i in range(lenA):
+            score_matrix[i, 0] += calc_affine_penalty(
+                i, open_B, extend_B, penalize_extend_when_opening)
+        for i in range(1, lenB):
+            score_matrix[0, i] += calc_affine_penalty(
+                i, open_A, extend_A, penalize_extend_when_opening)
+
+    # The row and column caches.
+    row_cache_score = score_matrix[:-1, 0] + first_A_gap
+    col_cache_score = score_matrix[0, :-1] + first_B_gap
+
+    # Work on the flattened matrices, with the index of each cell.
+    scores, traces = score_matrix.ravel(), trace_matrix.ravel()
+    matches = match_matrix.ravel()
+    if lenA < 2 or lenB < 2:
+        diagonals = []
+    else:
+        diagonals = range(2, lenA + lenB - 1)
+    for diagonal in diagonals:
+        rows = numpy.arange(max(1, diagonal - lenB + 1),
+                            min(lenA - 1, diagonal - 1) + 1)
+        cols = diagonal - rows
+        cells = rows * lenB + cols
+        nogap_score = scores.take(cells - lenB - 1)
+        row_cache = row_cache_score.take(rows - 1)
+        col_cache = col_cache_score.take(cols - 1)
+        # Only the first row and column have no cached gap, which
+        # would be nogap_score - 1, never the best.
+        row_score, col_score = row_cache, col_cache
+        if cols[-1] == 1:
+            row_score = row_cache.copy()
+            row_score[-1] = nogap_score[-1] - 1
+        if rows[0] == 1:
+            col_score = col_cache.copy()
+            col_score[0] = nogap_score[0] - 1
+        best_score = numpy.maximum(numpy.maximum(nogap_score, row_score),
+                                   col_score)
+        best_score_rint = _rint_array(best_score)
+        trace = (best_score_rint == _rint_array(nogap_score)) * _TRACE_NOGAP
+        trace |= (best_score_rint == _rint_array(row_score)) * _TRACE_ROW
+        trace |= (best_score_rint == _rint_array(col_score)) * _TRACE_COL
+
+        score = best_score + matches.take(cells)
+        if not align_globally:
+            score[score < 0] = 0
+        scores[cells] = score
+
+        # Update the cached column, then row, scores.
+        open_score = nogap_score + first_B_gap
+        extend_score = col_cache + extend_B
+        open_score_rint = _rint_array(open_score)
+        extend_score_rint = _rint_array(extend_score)
+        extended = extend_score_rint > open_score_rint
+        open_score[extended] = extend_score[extended]
+        col_cache_score[cols - 1] = open_score
+        trace |= ~extended * _COL_OPEN
+        trace |= (extend_score_rint >= open_score_rint) * _COL_EXTEND
+
+        open_score = nogap_score + first_A_gap
+        extend_score = row_cache + extend_A
+        open_score_rint = _rint_array(open_score)
+        extend_score_rint = _rint_array(extend_score)
+        extended = extend_score_rint > open_score_rint
+        open_score[extended] = extend_score[extended]
+        row_cache_score[rows - 1] = open_score
+        trace |= ~extended * _ROW_OPEN
+        trace |= (extend_score_rint >= open_score_rint) * _ROW_EXTEND
+        traces[cells] = trace
+
+    return score_matrix, trace_matrix
+
+def _trace_indexes(trace_matrix, row, col):
+    # Return the best indexes for a cell, in the order that
+    # _make_score_matrix_fast lists them.
+    if not isinstance(trace_matrix, numpy.ndarray):
+        return trace_matrix[row][col]
+    if row == 0 or col == 0:
+        return [None]
+    trace = trace_matrix[row, col]
+    indexes = []
+    if trace & _TRACE_NOGAP:
+        indexes.append((row-1, col-1))
+    if trace & _TRACE_ROW:
+        # Follow the row cache back to the gaps it holds.  The cache
+        # always starts from the first column.
+        gaps, i = [], col - 1
+        while i > 1:
+            if trace_matrix[row, i] & _ROW_OPEN:
+                gaps.append((row-1, i-1))
+            if not trace_matrix[row, i] & _ROW_EXTEND:
+                break
+            i -= 1
+        else:
+            gaps.append((row-1, 0))
+        gaps.reverse()
+        indexes.extend(gaps)
+    if trace & _TRACE_COL:
+        gaps, i = [], row - 1
+        while i > 1:
+            if trace_matrix[i, col] & _COL_OPEN:
+                gaps.append((i-1, col-1))
+            if not trace_matrix[i, col] & _COL_EXTEND:
+                break
+            i -= 1
+        else:
+            gaps.append((0, col-1))
+        gaps.reverse()
+        indexes.extend(gaps)
+    return indexes
+
 def _recover_alignments(sequenceA, sequenceB, starts,
                         score_matrix, trace_matrix, align_globally,
                         penalize_end_gaps, gap_char, one_alignment_only):
@@ -591,7 +1095,7 @@ def _recover_alignments(sequenceA, sequenceB, starts,
                 in_process.append(
                     (seqA, seqB, score, begin, end, prev_pos, None))
             else:
-                for next_pos in trace_matrix[nextA][nextB]:
+                for next_pos in _trace_indexes(trace_matrix, nextA, nextB):
                     in_process.append(
                         (seqA, seqB, score, begin, end, prev_pos, next_pos))
                     if one_alignment_only:
@@ -603,6 +1107,8 @@ def _find_start(score_matrix, sequenceA, sequenceB, gap_A_fn, gap_B_fn,
                 penalize_end_gaps, align_globally):
     # Return a list of (score, (row, col)) indicating every possible
     # place to start the tracebacks.
+    if isinstance(score_matrix, numpy.ndarray):
+        score_matrix = score_matrix.tolist()
     if align_globally:
         if penalize_end_gaps:
             starts = _find_global_start(
@@ -645,6 +1151,21 @@ def _find_local_start(score_matrix):
             positions.append((score, (row, col)))
     return positions
 
+def _find_local_best_start(score_matrix, tolerance):
+    # Return a list holding the first (score, (row, col)) of
+    # _find_local_start within tolerance of the best score.  Rows whose
+    # best score is not within tolerance are skipped.
+    if isinstance(score_matrix, numpy.ndarray):
+        score_matrix = score_matrix.tolist()
+    row_best = [max(row) for row in score_matrix]
+    best_score = max(row_best)
+    for row in range(len(score_matrix)):
+        if rint(best_score-row_best[row]) > rint(tolerance):
+            continue
+        for col, score in enumerate(score_matrix[row]):
+            if rint(abs(score-best_score)) <= rint(tolerance):
+                return [(score, (row, col))]
+
 def _clean_alignments(alignments):
     # Take a list of alignments and return a cleaned version.  Remove
     # duplicates, make sure begin and end are set correctly, remove
@@ -700,6 +1221,69 @@ _PRECISION = 1000
 def rint(x, precision=_PRECISION):
     return int(x * precision + 0.5)
 
+# The largest power of two that _integer_scale() scales scores by.  Scores
+# that are distinct multiples of 1/256 stay distinct under rint(), so the
+# integers break ties as rint() would, and sums of them are exact in
+# floating point, so scaling back returns the same scores.
+_MAX_SCALE = 256
+
+def _is_integer_scoring(match_fn, open_A, extend_A, open_B, extend_B):
+    values = _match_values(match_fn)
+    return values is not None and \
+           _is_integer(values + [open_A, extend_A, open_B, extend_B])
+
+def _is_integer(values):
+    for value in values:
+        if not isinstance(value, (int, long)):
+            return False
+    return True
+
+def _integer_scale(values):
+    # Return the smallest power of two that makes each of values an
+    # integer, or None.
+    for value in values:
+        if not isinstance(value, (int, long, float)):
+            return None
+    scale = 1
+    while scale <= _MAX_SCALE:
+        for value in values:
+            if value * scale != int(value * scale):
+                break
+        else:
+            return scale
+        scale *= 2
+    return None
+
+def _integer_scores(values):
+    # Return whether values are integers once scaled, the scale (None
+    # if they need none or can not be), and the scaled values.
+    if _is_integer(values):
+        return True, None, values
+    scale = _integer_scale(values)
+    if scale is None:
+        return False, None, values
+    return True, scale, [int(value * scale) for value in values]
+
+def _match_values(match_fn):
+    # The scores that a match function can return, if known.
+    if isinstance(match_fn, identity_match):
+        return [match_fn.match, match_fn.mismatch]
+    elif isinstance(match_fn, dictionary_match):
+        return match_fn.score_dict.values()
+    return None
+
+def _scale_match(match_fn, scale):
+    if isinstance(match_fn, identity_match):
+        return identity_match(int(match_fn.match * scale),
+                              int(match_fn.mismatch * scale))
+    score_dict = dict([(key, int(value * scale))
+                       for key, value in match_fn.score_dict.items()])
+    return dictionary_match(score_dict, match_fn.symmetric)
+
+def _scale_penalty(gap_fn, scale):
+    return affine_penalty(int(gap_fn.open * scale), int(gap_fn.extend * scale),
+                          gap_fn.penalize_extend_when_opening)
+
 class identity_match:
     """identity_match([match][, mismatch]) -> match_fn
 
@@ -791,9 +1375,578 @@ def format_alignment(align1, align2, score, begin, end):
     return ''.join(s)
 
 
+class Aligner:
+    """Aligner(match, mismatch, open, extend[, lenA, lenB]) -> aligner
+
+    Local alignment of strings with the scores of align.localms, set
+    up once for many alignments.  The score and traceback matrices,
+    for sequences of up to lenA by lenB residues, are kept between
+    alignments and grown when a longer sequence is aligned.
+
+    align(sequenceA, sequenceB) returns the alignments of
+    align.localms(sequenceA, sequenceB, match, mismatch, open, extend,
+    one_alignment_only=True), and score(sequenceA, sequenceB) the
+    score of score_only=True.
+
+    """
+    def __init__(self, match, mismatch, open, extend, lenA=0, lenB=0,
+                 gap_char='-'):
+        if open > 0 or extend > 0:
+            raise ValueError("Gap penalties should be non-positive.")
+        # Scores that are exactly integers once scaled are aligned as
+        # integers, as _align does, and scaled back.
+        self.integer, self.scale, (match, mismatch, open, extend) = \
+                      _integer_scores([match, mismatch, open, extend])
+        self.match, self.mismatch = match, mismatch
+        self.open, self.extend = open, extend
+        self.first_gap = calc_affine_penalty(1, open, extend, 0)
+        self.gap_char = gap_char
+        self.lenA, self.lenB = 0, 0
+        self._allocate(lenA, lenB)
+
+    def _allocate(self, lenA, lenB):
+        if lenA <= self.lenA and lenB <= self.lenB:
+            return
+        self.lenA, self.lenB = max(lenA, self.lenA), max(lenB, self.lenB)
+        self.score_matrix = [[0] * self.lenB for i in range(self.lenA)]
+        self.trace_matrix = [[None] * self.lenB for i in range(self.lenA)]
+        self.col_cache_score = [0] * self.lenB
+        self.col_cache_index = [None] * self.lenB
+
+    def _fill(self, sequenceA, sequenceB, traceback):
+        # _make_score_matrix_fast for a local alignment.  One alignment
+        # only follows the first of the best indexes of each cell, so
+        # the traceback and the caches keep just that one.
+        lenA, lenB = len(sequenceA), len(sequenceB)
+        self._allocate(lenA, lenB)
+        match, mismatch = self.match, self.mismatch
+        first_gap, extend = self.first_gap, self.extend
+        score_matrix, trace_matrix = self.score_matrix, self.trace_matrix
+        col_cache_score = self.col_cache_score
+        col_cache_index = self.col_cache_index
+        integer = self.integer
+
+        # The top and left borders.
+        this_row, base = score_matrix[0], sequenceA[0]
+        for col in range(lenB):
+            if base == sequenceB[col]:
+                this_row[col] = match
+            else:
+                this_row[col] = mismatch
+        base = sequenceB[0]
+        for row in range(1, lenA):
+            if sequenceA[row] == base:
+                score_matrix[row][0] = match
+            else:
+                score_matrix[row][0] = mismatch
+        for col in range(lenB-1):
+            col_cache_score[col] = this_row[col] + first_gap
+            col_cache_index[col] = (0, col)
+
+        # The best score, and the first cell (by row, then column) with
+        # it, are kept as the cells are filled.  A later cell only
+        # replaces the best cell with a score higher by more than rint()
+        # tolerance, and the score kept is the highest seen.
+        best_score, best_row, best_col = this_row[0], 0, 0
+        for col in range(1, lenB):
+            if this_row[col] > best_score:
+                if integer or rint(this_row[col]-best_score) > 0:
+                    best_col = col
+                best_score = this_row[col]
+
+        for row in range(1, lenA):
+            prev_row, this_row = score_matrix[row-1], score_matrix[row]
+            trace_row, base = trace_matrix[row], sequenceA[row]
+            if this_row[0] > best_score:
+                if integer or rint(this_row[0]-best_score) > 0:
+                    best_row, best_col = row, 0
+                best_score = this_row[0]
+            row_cache_score = prev_row[0] + first_gap
+            row_cache_index = (row-1, 0)
+            for col in range(1, lenB):
+                nogap_score = prev_row[col-1]
+                if col > 1:
+                    row_score = row_cache_score
+                else:
+                    row_score = nogap_score - 1
+                if row > 1:
+                    col_score = col_cache_score[col-1]
+                else:
+                    col_score = nogap_score - 1
+                prev_score = max(nogap_score, row_score, col_score)
+                if traceback:
+                    if integer:
+                        if prev_score == nogap_score:
+                            trace_row[col] = (row-1, col-1)
+                        elif prev_score == row_score:
+                            trace_row[col] = row_cache_index
+                        else:
+                            trace_row[col] = col_cache_index[col-1]
+                    else:
+                        prev_score_rint = rint(prev_score)
+                        if prev_score_rint == rint(nogap_score):
+                            trace_row[col] = (row-1, col-1)
+                        elif prev_score_rint == rint(row_score):
+                            trace_row[col] = row_cache_index
+                        else:
+                            trace_row[col] = col_cache_index[col-1]
+                if base == sequenceB[col]:
+                    score = prev_score + match
+                else:
+                    score = prev_score + mismatch
+                if score < 0:
+                    score = 0
+                this_row[col] = score
+                if score > best_score:
+                    if integer or rint(score-best_score) > 0:
+                        best_row, best_col = row, col
+                    best_score = score
+
+                # Update the caches.  On ties, the open score and the
+                # first index are kept.
+                open_score = nogap_score + first_gap
+                extend_score = col_cache_score[col-1] + extend
+                if integer:
+                    open_score_rint = open_score
+                    extend_score_rint = extend_score
+                else:
+                    open_score_rint = rint(open_score)
+                    extend_score_rint = rint(extend_score)
+                if extend_score_rint > open_score_rint:
+                    col_cache_score[col-1] = extend_score
+                else:
+                    col_cache_score[col-1] = open_score
+                    if traceback and open_score_rint > extend_score_rint:
+                        col_cache_index[col-1] = (row-1, col-1)
+                extend_score = row_cache_score + extend
+                if integer:
+                    extend_score_rint = extend_score
+                else:
+                    extend_score_rint = rint(extend_score)
+                if extend_score_rint > open_score_rint:
+                    row_cache_score = extend_score
+                else:
+                    row_cache_score = open_score
+                    if traceback and open_score_rint > extend_score_rint:
+                        row_cache_index = (row-1, col-1)
+
+        return best_score, best_row, best_col
+
+    def _unscale(self, score):
+        if self.scale is None:
+            return score
+        return score / float(self.scale)
+
+    def score(self, sequenceA, sequenceB):
+        """score(sequenceA, sequenceB) -> score"""
+        if not sequenceA or not sequenceB:
+            return []
+        return self._unscale(self._fill(sequenceA, sequenceB, False)[0])
+
+    def align(self, sequenceA, sequenceB):
+        """align(sequenceA, sequenceB) -> alignments"""
+        if not sequenceA or not sequenceB:
+            return []
+        best_score, row, col = self._fill(sequenceA, sequenceB, True)
+        lenA, lenB = len(sequenceA), len(sequenceB)
+        score_matrix, trace_matrix = self.score_matrix, self.trace_matrix
+        gap_char = self.gap_char
+        # Follow the traceback from the best cell, as
+        # _recover_alignments does for one alignment.
+        score = self._unscale(score_matrix[row][col])
+        seqA, seqB = '', ''
+        begin, end = None, -max(lenA-row, lenB-col)+1
+        if not end:
+            end = None
+        prevA, prevB = lenA, lenB
+        next_pos = (row, col)
+        while next_pos is not None:
+            nextA, nextB = next_pos
+            nseqA, nseqB = prevA-nextA, prevB-nextB
+            maxseq = max(nseqA, nseqB)
+            seqA = sequenceA[nextA:nextA+nseqA] + gap_char*(maxseq-nseqA) \
+                   + seqA
+            seqB = sequenceB[nextB:nextB+nseqB] + gap_char*(maxseq-nseqB) \
+                   + seqB
+            if score_matrix[nextA][nextB] <= 0:
+                # local alignment stops early if score falls < 0
+                begin = max(prevA, prevB)
+                prevA, prevB = nextA, nextB
+                break
+            prevA, prevB = nextA, nextB
+            if nextA == 0 or nextB == 0:
+                break
+            next_pos = trace_matrix[nextA][nextB]
+        prevlen = len(seqA)
+        seqA = sequenceA[:prevA] + seqA
+        seqB = sequenceB[:prevB] + seqB
+        seqA, seqB = _lpad_until_equal(seqA, seqB, gap_char)
+        if begin is None:
+            begin = len(seqA) - prevlen
+        return _clean_alignments([(seqA, seqB, score, begin, end)])
+
+
+class TagTrie:
+    """TagTrie(sequencesB, match, mismatch, open, extend) -> trie
+
+    Local alignment scores of a sequence to each of sequencesB (e.g. a
+    set of tags), with the scores of align.localms.  sequencesB are
+    held in a trie, and the columns of the dynamic programming matrix
+    are filled once for each node of the trie, so a prefix that many
+    of sequencesB share is only aligned once.
+
+    scores(sequenceA) returns, for each of sequencesB, the score that
+    Aligner(match, mismatch, open, extend).score gives, and the row and
+    column of the first cell with that score, or None if either
+    sequence is empty.
+
+    """
+    def __init__(self, sequencesB, match, mismatch, open, extend):
+        if open > 0 or extend > 0:
+            raise ValueError("Gap penalties should be non-positive.")
+        self.integer, self.scale, (match, mismatch, open, extend) = \
+                      _integer_scores([match, mismatch, open, extend])
+        self.match, self.mismatch = match, mismatch
+        self.first_gap = calc_affine_penalty(1, open, extend, 0)
+        self.extend = extend
+        self.sequencesB = list(sequencesB)
+        # Each node is (children, indexes of the sequencesB ending
+        # there), with the children keyed by residue.
+        self.root = ({}, [])
+        self.nodes = 0
+        for index, sequence in enumerate(self.sequencesB):
+            node = self.root
+            for residue in sequence:
+                if residue not in node[0]:
+                    node[0][residue] = ({}, [])
+                    self.nodes += 1
+                node = node[0][residue]
+            node[1].append(index)
+
+    def scores(self, sequenceA):
+        """scores(sequenceA) -> list of (score, row, col)"""
+        results = [None] * len(self.sequencesB)
+        lenA = len(sequenceA)
+        if not lenA:
+            return results
+        match, mismatch = self.match, self.mismatch
+        first_gap, extend = self.first_gap, self.extend
+        integer = self.integer
+        # Fill the first column of the matrix for each residue that
+        # sequencesB start with, as Aligner._fill fills the left
+        # border.  The stack holds the nodes to visit, each with the
+        # last column of its parent, the row caches, and the best
+        # score of the prefix so far.
+        stack = []
+        for residue, child in self.root[0].items():
+            column = [mismatch] * lenA
+            for row in range(lenA):
+                if sequenceA[row] == residue:
+                    column[row] = match
+            row_cache = [score + first_gap for score in column[:-1]]
+            best_score = max(column)
+            stack.append((child, 0, column, row_cache,
+                          best_score, column.index(best_score), 0))
+        while stack:
+            node, col, prev_column, prev_row_cache, best_score, best_row, \
+                  best_col = stack.pop()
+            children, indexes = node
+            for index in indexes:
+                if self.scale is None:
+                    results[index] = best_score, best_row, best_col
+                else:
+                    results[index] = best_score / float(self.scale), \
+                                     best_row, best_col
+            col += 1
+            for residue, child in children.items():
+                # The cells of column col, in the order of operations
+                # of Aligner._fill.
+                column = [0] * lenA
+                row_cache = prev_row_cache[:]
+                if sequenceA[0] == residue:
+                    column[0] = match
+                else:
+                    column[0] = mismatch
+                col_cache = prev_column[0] + first_gap
+                for row in range(1, lenA):
+                    nogap_score = prev_column[row-1]
+                    if col > 1:
+                        row_score = row_cache[row-1]
+                    else:
+                        row_score = nogap_score - 1
+                    if row > 1:
+                        col_score = col_cache
+                    else:
+                        col_score = nogap_score - 1
+                    score = max(nogap_score, row_score, col_score)
+                    if sequenceA[row] == residue:
+                        score += match
+                    else:
+                        score += mismatch
+                    if score < 0:
+                        score = 0
+                    column[row] = score
+
+                    open_score = nogap_score + first_gap
+                    extend_score = col_cache + extend
+                    if integer:
+                        open_score_rint = open_score
+                        extend_score_rint = extend_score
+                    else:
+                        open_score_rint = rint(open_score)
+                        extend_score_rint = rint(extend_score)
+                    if extend_score_rint > open_score_rint:
+                        col_cache = extend_score
+                    else:
+                        col_cache = open_score
+                    extend_score = row_cache[row-1] + extend
+                    if integer:
+                        extend_score_rint = extend_score
+                    else:
+                        extend_score_rint = rint(extend_score)
+                    if extend_score_rint > open_score_rint:
+                        row_cache[row-1] = extend_score
+                    else:
+                        row_cache[row-1] = open_score
+                # The first cell with the best score, by row and then
+                # by column.
+                score = max(column)
+                row = column.index(score)
+                if score > best_score or \
+                   (score == best_score and row < best_row):
+                    stack.append((child, col, column, row_cache,
+                                  score, row, col))
+                else:
+                    stack.append((child, col, column, row_cache,
+                                  best_score, best_row, best_col))
+        return results
+
+
+def semiglobal_edits(sequenceA, sequenceB):
+    """semiglobal_edits(sequenceA, sequenceB) -> start, end, substitutions,
+    insertions, deletions
+
+    Align all of sequenceB (e.g. a tag) to the part of sequenceA (e.g.
+    a window of a read) that it matches best, counting edits: gaps in
+    sequenceA before and after the alignment are free, and every
+    mismatch and gap within it costs one.  Returns the part of
+    sequenceA, sequenceA[start:end], and the substitutions, the
+    insertions (residues of sequenceA not in sequenceB) and the
+    deletions (residues of sequenceB not in sequenceA) of the
+    alignment, which together give the edit distance of sequenceB to
+    the closest part of sequenceA.  Of equally close parts, the one
+    ending first is returned.  On ties within the alignment,
+    substitutions are preferred to deletions, and deletions to
+    insertions.
+
+    """
+    lenB = len(sequenceB)
+    # The edits, and the start, of the best alignment of sequenceB[:i]
+    # ending at the current position of sequenceA.  Before sequenceA,
+    # all of sequenceB is deleted.
+    edits, starts = range(lenB + 1), [0] * (lenB + 1)
+    insertions, deletions = [0] * (lenB + 1), range(lenB + 1)
+    best_edits, best = lenB, (0, 0, 0, 0, lenB)
+    for end in range(1, len(sequenceA) + 1):
+        base = sequenceA[end-1]
+        this_edits, this_starts = [0], [end]
+        this_insertions, this_deletions = [0], [0]
+        for i in range(1, lenB + 1):
+            # substitution (or match), deletion, insertion
+            cost = edits[i-1]
+            if base != sequenceB[i-1]:
+                cost += 1
+            ins, dels = insertions[i-1], deletions[i-1]
+            start = starts[i-1]
+            if this_edits[i-1] + 1 < cost:
+                cost = this_edits[i-1] + 1
+                start = this_starts[i-1]
+                ins, dels = this_insertions[i-1], this_deletions[i-1] + 1
+            if edits[i] + 1 < cost:
+                cost = edits[i] + 1
+                start = starts[i]
+                ins, dels = insertions[i] + 1, deletions[i]
+            this_edits.append(cost)
+            this_starts.append(start)
+            this_insertions.append(ins)
+            this_deletions.append(dels)
+        edits, starts = this_edits, this_starts
+        insertions, deletions = this_insertions, this_deletions
+        if edits[lenB] < best_edits:
+            best_edits = edits[lenB]
+            best = (starts[lenB], end,
+                    edits[lenB] - insertions[lenB] - deletions[lenB],
+                    insertions[lenB], deletions[lenB])
+    return best
+
+
+def local_score(sequenceA, sequenceB, match, mismatch, open, extend):
+    """local_score(sequenceA, sequenceB, match, mismatch, open, extend)
+    -> score, row, col
+
+    The best score of the local alignments of sequenceA and sequenceB,
+    as align.localms(..., score_only=True) returns it, and the row and
+    column of the first cell with that score: where the best alignment
+    ends in sequenceA and sequenceB.  Neither the traceback nor the
+    score matrix is kept, so memory is linear in len(sequenceB).  If
+    the score is not positive, localms returns no alignment.
+
+    """
+    assert sequenceA and sequenceB, "sequences must not be empty"
+    score, (row, col) = _score_only_fast(
+        sequenceA, sequenceB, identity_match(match, mismatch), open, extend,
+        open, extend, 0, 0, 0)
+    return score, row, col
+
+
+def local_scores_many(sequenceA, sequencesB, match, mismatch, open, extend):
+    """local_scores_many(sequenceA, sequencesB, match, mismatch, open,
+    extend) -> scores, rows, cols, identities, gaps_A, gaps_B
+
+    Locally align sequenceA to each of sequencesB, which must all be
+    the same length, with the scores align.localms uses, but fill the
+    dynamic programming matrices for all of sequencesB at once.  Rather
+    than recovering the alignments, return numpy arrays holding, for
+    each of sequencesB, the best score, the row and column of the first
+    cell with that score, and the number of identities and of gap
+    characters in sequenceA and in sequenceB within the alignment that
+    localms(..., one_alignment_only=True) returns.  If the best score
+    is not positive, localms returns no alignment.  The counts assume
+    that an alignment can not begin with a gap (match + open <= 0).
+
+    """
+    results = local_scores_batch([sequenceA], sequencesB, match, mismatch,
+                                 open, extend)
+    return tuple([x[0] for x in results])
+
+
+def local_scores_batch(sequencesA, sequencesB, match, mismatch, open, extend):
+    """local_scores_batch(sequencesA, sequencesB, match, mismatch, open,
+    extend) -> scores, rows, cols, identities, gaps_A, gaps_B
+
+    As local_scores_many, but for each of sequencesA, which may differ
+    in length, filling the matrices of every pair of sequencesA and
+    sequencesB at once.  sequencesA are padded to the longest of them.
+    Each of the arrays returned is indexed by [A, B].
+
+    """
+    lengths = numpy.array([len(s) for s in sequencesA])
+    n, m = lengths.max(), len(sequencesB[0])
+    assert lengths.min() > 0, "sequencesA must not be empty"
+    A = numpy.frombuffer(''.join([s.ljust(n, '\0') for s in sequencesA]),
+                         dtype=numpy.uint8).reshape(len(sequencesA), n)
+    B = numpy.frombuffer(''.join(sequencesB), dtype=numpy.uint8).reshape(
+        len(sequencesB), m)
+    first_gap = calc_affine_penalty(1, open, extend, 0)
+    cols = numpy.arange(m)
+    # Index arrays to pick a column for each pair.
+    seqs, tags = numpy.ix_(numpy.arange(len(A)), numpy.arange(len(B)))
+    shape = (len(A), len(B), m)
+
+    # The first row and column are special cases, as in
+    # _make_score_matrix_fast.  They are not clipped at 0.
+    identical = B[None, :, :] == A[:, 0, None, None]
+    score = numpy.where(identical, match, mismatch).astype(float)
+    ident = identical.astype(int)
+    gaps_A = numpy.zeros(shape, dtype=int)
+    gaps_B = numpy.zeros(shape, dtype=int)
+    best_score, best_col = score.max(2), score.argmax(2)
+    best_row = numpy.zeros(best_col.shape, dtype=int)
+    best_ident = ident[seqs, tags, best_col]
+    best_gaps_A = numpy.zeros(best_col.shape, dtype=int)
+    best_gaps_B = numpy.zeros(best_col.shape, dtype=int)
+
+    # The cached score for a gap in sequenceB down each column, the
+    # row the gap was opened from, and the counts of the alignment
+    # ending there.
+    col_score = score[..., :-1] + first_gap
+    col_row = numpy.zeros(col_score.shape, dtype=int)
+    col_ident = ident[..., :-1]
+    col_gaps_A = gaps_A[..., :-1]
+    col_gaps_B = gaps_B[..., :-1]
+
+    for row in range(1, n):
+        nogap = score[..., :-1]
+        # The cached score for a gap in sequenceA along the previous
+        # row.  At column col, opening the gap from column k scores
+        # score[k] + first_gap + extend*(col-2-k).  Find the best k
+        # with a running maximum; as in the cache, the earliest k wins
+        # ties.
+        weighted = score - extend*cols
+        running = numpy.maximum.accumulate(weighted, axis=2)
+        new_best = numpy.ones(weighted.shape, dtype=bool)
+        new_best[..., 1:] = weighted[..., 1:] > running[..., :-1]
+        first = numpy.maximum.accumulate(
+            numpy.where(new_best, cols, 0), axis=2)
+        row_score = numpy.empty(nogap.shape)
+        row_score[..., :1] = nogap[..., :1] - 1   # Make sure it's not the best.
+        row_score[..., 1:] = running[..., :-2] + first_gap + extend*cols[:-2]
+        row_from = numpy.zeros(nogap.shape, dtype=int)
+        row_from[..., 1:] = first[..., :-2]
+        if row > 1:
+            gap_score = col_score
+        else:
+            gap_score = nogap - 1
+        best = numpy.maximum(numpy.maximum(nogap, row_score), gap_score)
+
+        # The traceback follows the first of the best indexes: no gap,
+        # then a gap in sequenceA, then a gap in sequenceB.  It stops
+        # before any score that is not positive.
+        use_nogap = best == nogap
+        use_row = ~use_nogap & (best == row_score)
+        positive = nogap > 0
+        from_row = seqs[..., None], tags[..., None], row_from
+        prev_ident = numpy.where(use_nogap, ident[..., :-1]*positive,
+                     numpy.where(use_row, ident[from_row], col_ident))
+        prev_gaps_A = numpy.where(use_nogap, gaps_A[..., :-1]*positive,
+                      numpy.where(use_row, gaps_A[from_row] +
+                                  cols[1:] - row_from - 1, col_gaps_A))
+        prev_gaps_B = numpy.where(use_nogap, gaps_B[..., :-1]*positive,
+                      numpy.where(use_row, gaps_B[from_row],
+                                  col_gaps_B + row - col_row - 1))
+
+        # Update the cached column scores with the previous row.
+        open_score = nogap + first_gap
+        extend_score = col_score + extend
+        opened = open_score > extend_score
+        col_score = numpy.maximum(open_score, extend_score)
+        col_row = numpy.where(opened, row - 1, col_row)
+        col_ident = numpy.where(opened, ident[..., :-1], col_ident)
+        col_gaps_A = numpy.where(opened, gaps_A[..., :-1], col_gaps_A)
+        col_gaps_B = numpy.where(opened, gaps_B[..., :-1], col_gaps_B)
+
+        # Fill in the row.
+        identical = B[None, :, :] == A[:, row, None, None]
+        score = numpy.where(identical, match, mismatch).astype(float)
+        score[..., 1:] = numpy.maximum(score[..., 1:] + best, 0)
+        ident = identical.astype(int)
+        ident[..., 1:] += prev_ident
+        gaps_A = numpy.zeros(shape, dtype=int)
+        gaps_A[..., 1:] = prev_gaps_A
+        gaps_B = numpy.zeros(shape, dtype=int)
+        gaps_B[..., 1:] = prev_gaps_B
+
+        # Keep the first of the best scores in the matrix.  Rows past
+        # the end of a (padded) sequenceA are not part of its matrix.
+        row_best, row_col = score.max(2), score.argmax(2)
+        better = (row_best > best_score) & (lengths > row)[:, None]
+        best_score = numpy.where(better, row_best, best_score)
+        best_row = numpy.where(better, row, best_row)
+        best_col = numpy.where(better, row_col, best_col)
+        best_ident = numpy.where(better, ident[seqs, tags, row_col],
+                                 best_ident)
+        best_gaps_A = numpy.where(better, gaps_A[seqs, tags, row_col],
+                                  best_gaps_A)
+        best_gaps_B = numpy.where(better, gaps_B[seqs, tags, row_col],
+                                  best_gaps_B)
+    return best_score, best_row, best_col, best_ident, best_gaps_A, \
+           best_gaps_B
+
+
 # Try and load C implementations of functions.  If I can't,
 # then just ignore and use the pure python implementations.
 try:
     from cpairwise2 import rint, _make_score_matrix_fast
+    _HAVE_C = True
 except ImportError:
-    pass
+    _HAVE_C = False
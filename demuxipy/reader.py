@@ -0,0 +1,339 @@
+"""
+File: reader.py
+Author: Brant Faircloth
+
+Created by Brant Faircloth on 17 October 2026 16:05 PDT (-0700)
+Copyright (c) 2026 Brant C. Faircloth. All rights reserved.
+
+Description: streaming readers for sequence input (plain or gzipped FASTQ,
+and memory-mapped FASTA + QUAL), the compact reads that they return, and
+byte-offset indexes of their records
+
+"""
+
+import os
+import mmap
+import zlib
+import itertools
+import numpy
+
+
+def bulk_lines(path, size=2**20, start=0, end=None):
+    """Yield the lines of path, which may be gzipped, in lists read size
+    bytes at a time.  Lines keep their line endings.  Reading blocks, and
+    decompressing them with zlib, is much faster than reading gzip files a
+    line at a time.  Plain files may be read from byte start to byte end."""
+    if path.endswith('.gz'):
+        assert start == 0 and end is None, \
+                "gzipped files cannot be read from a byte offset"
+        blocks = _gzip_blocks(path, size)
+    else:
+        blocks = _plain_blocks(path, size, start, end)
+    remainder = ''
+    for block in blocks:
+        lines = (remainder + block).splitlines(True)
+        if lines and not lines[-1].endswith('\n'):
+            remainder = lines.pop()
+        else:
+            remainder = ''
+        if lines:
+            yield lines
+    if remainder:
+        yield [remainder]
+
+
+def _plain_blocks(path, size, start=0, end=None):
+    handle = open(path, 'rb')
+    try:
+        handle.seek(start)
+        if end is None:
+            block = handle.read(size)
+        else:
+            remaining = end - start
+            block = handle.read(min(size, remaining))
+        while block:
+            yield block
+            if end is None:
+                block = handle.read(size)
+            else:
+                remaining -= len(block)
+                block = handle.read(min(size, remaining))
+    finally:
+        handle.close()
+
+
+def _gzip_blocks(path, size):
+    handle = open(path, 'rb')
+    try:
+        # 16 + MAX_WBITS reads the gzip header and trailer.  Files written
+        # in pieces (e.g. by concatenation) hold several gzip members, each
+        # of which needs its own decompressor.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        block = handle.read(size)
+        while block:
+            data = decompressor.decompress(block)
+            while decompressor.unused_data:
+                block = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += decompressor.decompress(block)
+            if data:
+                yield data
+            block = handle.read(size)
+        data = decompressor.flush()
+        if data:
+            yield data
+    finally:
+        handle.close()
+
+
+class Read(object):
+    """A read that stands in for the FastaSequence objects of
+    FastaQualityReader.  The sequence (a str) and quality scores (a numpy
+    uint8 array) of the record are kept whole, and slice() and trim() only
+    move the start and end of the part of them that is the read, whether or
+    not they copy.  The sequence of that part is made when it is first
+    used, and quality is a view.  Only that part is pickled (e.g. to return
+    the read from a worker for output)."""
+    __slots__ = ['identifier', 'data', 'scores', 'start', 'end', '_sequence']
+
+    def __init__(self, identifier, data, scores, start=0, end=None):
+        self.identifier = identifier
+        self.data = data
+        self.scores = scores
+        self.start = start
+        if end is None:
+            end = len(data)
+        self.end = end
+        self._sequence = None
+
+    def __str__(self):
+        return "{0}({1}, {2}:{3})".format(self.__class__, self.identifier,
+                self.start, self.end)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getstate__(self):
+        return self.identifier, self.sequence, self.quality
+
+    def __setstate__(self, state):
+        self.identifier, self.data, self.scores = state
+        self.start, self.end, self._sequence = 0, len(self.data), None
+
+    @property
+    def sequence(self):
+        if self._sequence is None:
+            self._sequence = self.data[self.start:self.end]
+        return self._sequence
+
+    @property
+    def quality(self):
+        return self.scores[self.start:self.end]
+
+    def slice(self, start, end, copy=True):
+        """Return the read from start to end (as sequence[start:end])"""
+        start, end, step = slice(start, end).indices(self.end - self.start)
+        start, end = self.start + start, self.start + max(start, end)
+        if copy:
+            return Read(self.identifier, self.data, self.scores, start, end)
+        self.start, self.end, self._sequence = start, end, None
+        return self
+
+    def trim(self, min_qual=10, copy=True):
+        """Return the read from its first to its last quality score of at
+        least min_qual (or an empty read)"""
+        good = numpy.flatnonzero(self.quality >= min_qual)
+        if len(good):
+            return self.slice(int(good[0]), int(good[-1]) + 1, copy)
+        return self.slice(0, 0, copy)
+
+
+class FastqReader:
+    """Iterate over the reads of a FASTQ file, which may be gzipped (.gz),
+    as Reads, so that quality trimming, slicing, and output work as they do
+    for the reads of FastaQualityReader.  Records have four
+    lines (no wrapping), and quality scores are offset by 33 (Sanger and
+    Illumina 1.8+) unless another offset is given.  Plain files may be read
+    from byte start to byte end (see record_offsets)."""
+    def __init__(self, path, offset=33, size=2**20, start=0, end=None):
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def __iter__(self):
+        offset = self.offset
+        record = []
+        for lines in bulk_lines(self.path, self.size, self.start, self.end):
+            # records may span two lists of lines
+            if record:
+                lines = record + lines
+            end = len(lines) - len(lines) % 4
+            for i in xrange(0, end, 4):
+                header, sequence, plus, quality = lines[i:i + 4]
+                if header[:1] != '@' or plus[:1] != '+':
+                    raise IOError("{0} is not a valid FASTQ file (at {1})".format(
+                            self.path, header.rstrip()))
+                scores = numpy.fromstring(quality.rstrip(),
+                        dtype=numpy.uint8)
+                # scores are unsigned, so check before they would wrap
+                if len(scores) and scores.min() < offset:
+                    raise IOError("{0} has quality scores below the offset "
+                            "of {1} (at {2}); check the offset, or for a "
+                            "corrupt quality line".format(self.path, offset,
+                            header.rstrip()))
+                scores -= offset
+                yield Read(header[1:].rstrip(), sequence.rstrip(), scores)
+            record = lines[end:]
+        if [line for line in record if line.strip()]:
+            raise IOError("{0} is truncated (at {1})".format(self.path,
+                    record[0].rstrip()))
+
+
+def mapped_records(path, start=0, end=None):
+    """Yield the (header, body) of each record of a FASTA-formatted file
+    (sequence or quality), from byte start to byte end.  The file is
+    memory-mapped and records are found with bulk find() calls, so each body
+    is one string, newlines and all, rather than one string per line."""
+    handle = open(path, 'rb')
+    try:
+        size = os.fstat(handle.fileno()).st_size
+        if end is None or end > size:
+            end = size
+        if start >= end:
+            return
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            first = data.find('>', start, end)
+            if first == -1 or data[start:first].strip():
+                raise IOError("{0} is not a valid FASTA file".format(path))
+            start = first
+            while start != -1:
+                eol = data.find('\n', start, end)
+                if eol == -1:
+                    eol = end
+                stop = data.find('\n>', eol, end)
+                if stop == -1:
+                    yield data[start + 1:eol].strip(), data[eol + 1:end]
+                    start = -1
+                else:
+                    yield data[start + 1:eol].strip(), data[eol + 1:stop]
+                    start = stop + 1
+        finally:
+            data.close()
+    finally:
+        handle.close()
+
+
+class MappedFastaQualityReader:
+    """Iterate over the reads of a FASTA file and its QUAL file, as Reads,
+    like FastaQualityReader.  Both files are memory-mapped; sequences are
+    joined from a single slice of each record and quality scores are parsed,
+    in bulk, to a numpy uint8 array.  The files may be read over (start,
+    end) byte ranges (see record_offsets)."""
+    def __init__(self, fasta, quality, fasta_range=(0, None),
+            quality_range=(0, None)):
+        self.fasta = fasta
+        self.quality = quality
+        self.fasta_range = fasta_range
+        self.quality_range = quality_range
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def __iter__(self):
+        records = itertools.izip_longest(
+                mapped_records(self.fasta, *self.fasta_range),
+                mapped_records(self.quality, *self.quality_range))
+        for sequence, quality in records:
+            if sequence is None or quality is None:
+                raise IOError("{0} and {1} hold different numbers of "
+                        "reads".format(self.fasta, self.quality))
+            if sequence[0] != quality[0]:
+                raise IOError("{0} and {1} are out of order (at {2})".format(
+                        self.fasta, self.quality, sequence[0]))
+            # drop newlines (and any other whitespace) without a split()
+            yield Read(sequence[0], sequence[1].translate(None, ' \t\r\n'),
+                    numpy.fromstring(quality[1], dtype=numpy.uint8, sep=' '))
+
+
+def record_offsets(path, fastq=False, size=2**24):
+    """Return a numpy int64 array of the byte offsets at which the records
+    of a plain FASTA, QUAL or (if fastq) FASTQ file start, followed by the
+    size of the file, so that record i spans bytes index[i] to index[i + 1].
+    Newlines are found with numpy, size bytes at a time.  FASTA records
+    start at a '>' following a newline; FASTQ records start every fourth
+    line, because quality lines may also start with '@'."""
+    handle = open(path, 'rb')
+    try:
+        length = os.fstat(handle.fileno()).st_size
+        if not length:
+            return numpy.zeros(1, dtype=numpy.int64)
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[0] != ('@' if fastq else '>'):
+                raise IOError("{0} is not a valid {1} file".format(path,
+                        'FASTQ' if fastq else 'FASTA'))
+            view = numpy.frombuffer(data, dtype=numpy.uint8)
+            offsets = [numpy.zeros(1, dtype=numpy.int64)]
+            lines = 0
+            for i in xrange(0, length, size):
+                # one byte of overlap, to see what follows each newline
+                block = view[i:i + size + 1]
+                if fastq:
+                    newlines = numpy.flatnonzero(block[:size] == 10)
+                    ends = newlines[(3 - lines) % 4::4]
+                    lines += len(newlines)
+                else:
+                    ends = numpy.flatnonzero((block[:-1] == 10) &
+                            (block[1:] == 62))
+                offsets.append(ends.astype(numpy.int64) + i + 1)
+            del view, block
+        finally:
+            data.close()
+    finally:
+        handle.close()
+    offsets = numpy.concatenate(offsets)
+    # a final newline ends the last record, rather than starting another
+    offsets = offsets[offsets < length]
+    return numpy.append(offsets, length)
+
+
+def load_index(path, fastq=False):
+    """Return the record_offsets of path, which are kept in a sidecar file
+    (path + '.idx') so that they are only found once.  A sidecar older than
+    path, or that does not end at its size, is rebuilt."""
+    sidecar = path + '.idx'
+    if os.path.exists(sidecar) and \
+            os.path.getmtime(sidecar) >= os.path.getmtime(path):
+        index = numpy.fromfile(sidecar, dtype='<i8')
+        if len(index) and index[-1] == os.path.getsize(path):
+            return index
+    index = record_offsets(path, fastq)
+    try:
+        index.astype('<i8').tofile(sidecar)
+    except IOError:
+        # e.g. a read-only directory; the offsets are found again next time
+        pass
+    return index
+
+
+def byte_ranges(index, chunk_size):
+    """Yield the (start, end) byte ranges of consecutive groups of
+    chunk_size records of an index"""
+    records = len(index) - 1
+    for i in xrange(0, records, chunk_size):
+        yield int(index[i]), int(index[min(i + chunk_size, records)])
@@ -0,0 +1,420 @@
+"""
+File: tagindex.py
+Author: Brant Faircloth
+
+Created by Brant Faircloth on 17 October 2026 10:12 PDT (-0700)
+Copyright (c) 2026 Brant C. Faircloth. All rights reserved.
+
+Description: multi-tag indexes used to locate sequence tags in reads
+without looping over one compiled regular expression per tag
+
+"""
+
+import re
+import sys
+import numpy
+
+# the character class the tag regular expressions allow within the gap
+# that precedes (left) or follows (right) a tag
+GAP_CHARS = re.compile('[acgtnACGTN]*')
+
+
+class TagAutomaton:
+    """Aho-Corasick automaton over a set of sequence tags.  A single pass
+    over a string reports every tag occurrence along with its offset.  Tags
+    are numbered in the order given, which should be the order in which the
+    corresponding regular expressions are built."""
+    def __init__(self, tags, gap):
+        self.tags = list(tags)
+        self.gap = gap
+        self.length = len(self.tags[0])
+        # state 0 is the root.  goto holds a dict of transitions per state,
+        # fail the failure link, and out the tags (by number) ending there
+        self.goto, self.fail, self.out = [{}], [0], [[]]
+        for order, tag in enumerate(self.tags):
+            self._add(tag, order)
+        self._link()
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def _add(self, tag, order):
+        state = 0
+        for base in tag:
+            nxt = self.goto[state].get(base)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][base] = nxt
+            state = nxt
+        self.out[state].append(order)
+
+    def _link(self):
+        # breadth-first, so that failure links always point to states that
+        # have already been linked.  Children of the root fail to the root.
+        queue = self.goto[0].values()
+        for state in queue:
+            for base, nxt in self.goto[state].iteritems():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and base not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(base, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def scan(self, s, start=0, end=None):
+        """Yield (tag number, offset) for every tag occurring in s[start:end]"""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        if end is None:
+            end = len(s)
+        for pos in xrange(start, end):
+            base = s[pos]
+            while state and base not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(base, 0)
+            for order in out[state]:
+                yield order, pos - len(self.tags[order]) + 1
+
+    def left(self, s):
+        """Return the (tag, start, stop) that the ^[acgtnACGTN]{0,gap}TAG
+        regular expressions return for s, or None.  As with the regular
+        expressions, the first tag (in build order) that matches wins and,
+        because {0,gap} is greedy, it matches at its right-most offset."""
+        limit = GAP_CHARS.match(s, 0, self.gap).end()
+        best = None
+        for order, offset in self.scan(s, 0, min(len(s), limit + self.length)):
+            if best is None or order < best[0] or \
+                    (order == best[0] and offset > best[1]):
+                best = (order, offset)
+        if best is None:
+            return None
+        return self.tags[best[0]], 0, best[1] + self.length
+
+    def first(self, s):
+        """Return the (tag, start, stop) of the first tag (in build order)
+        that occurs anywhere in s, at its left-most offset, as a loop of
+        re.search() over the tags returns it, or None"""
+        best = None
+        for order, offset in self.scan(s):
+            if best is None or order < best[0]:
+                best = (order, offset)
+                if order == 0:
+                    break
+        if best is None:
+            return None
+        tag = self.tags[best[0]]
+        return tag, best[1], best[1] + len(tag)
+
+    def right(self, s):
+        """Return the (tag, start, stop) that the TAG[acgtnACGTN]{0,gap}$
+        regular expressions return for s, or None.  Only the last gap +
+        tag length bases are scanned.  The first tag that matches wins, at
+        its left-most start."""
+        end = len(s)
+        if self.gap:
+            limit = GAP_CHARS.match(s[-self.gap:][::-1]).end()
+        else:
+            limit = 0
+        first = max(end - self.length - limit, 0)
+        best = None
+        for order, offset in self.scan(s, first, end):
+            if offset >= first and (best is None or order < best[0] or
+                    (order == best[0] and offset < best[1])):
+                best = (order, offset)
+        if best is None:
+            return None
+        return self.tags[best[0]], best[1], end
+
+
+class TagHash:
+    """Exact tag lookup using a dict from tag string to tag number.  Tags
+    at one level share a length, so an exact match at a given offset is a
+    single slice and lookup.  Tags are numbered in the order given, which
+    should be the order in which the corresponding regular expressions are
+    built."""
+    def __init__(self, tags, gap):
+        self.tags = list(tags)
+        self.gap = gap
+        self.length = len(self.tags[0])
+        self.lookup = dict((tag, order) for order, tag in enumerate(self.tags))
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def _best(self, s, offsets):
+        # offsets are probed in the order the greedy regex would try them,
+        # so the first hit for a tag is the one its regex returns.
+        lookup, length = self.lookup, self.length
+        best = None
+        for offset in offsets:
+            order = lookup.get(s[offset:offset + length])
+            if order is not None and (best is None or order < best[0]):
+                best = (order, offset)
+                if order == 0:
+                    break
+        return best
+
+    def left(self, s):
+        """Return the (tag, start, stop) that the ^[acgtnACGTN]{0,gap}TAG
+        regular expressions return for s, or None"""
+        if not self.gap:
+            order = self.lookup.get(s[:self.length])
+            if order is None:
+                return None
+            return self.tags[order], 0, self.length
+        limit = GAP_CHARS.match(s, 0, self.gap).end()
+        best = self._best(s, xrange(limit, -1, -1))
+        if best is None:
+            return None
+        return self.tags[best[0]], 0, best[1] + self.length
+
+    def right(self, s):
+        """Return the (tag, start, stop) that the TAG[acgtnACGTN]{0,gap}$
+        regular expressions return for s, or None.  The left-most start
+        wins, so each tag matches with the longest trailing gap."""
+        end = len(s)
+        if not self.gap:
+            if end < self.length:
+                return None
+            order = self.lookup.get(s[end - self.length:])
+            if order is None:
+                return None
+            return self.tags[order], end - self.length, end
+        limit = GAP_CHARS.match(s[-self.gap:][::-1]).end()
+        start = end - self.length
+        best = self._best(s, xrange(max(start - limit, 0), start + 1))
+        if best is None:
+            return None
+        return self.tags[best[0]], best[1], end
+
+
+class MismatchIndex:
+    """Every variant of a set of sequence tags within a given number of
+    substitutions, mapped to the tag and its number of substitutions.  A
+    variant that is equally close to two or more tags is ambiguous and is
+    not resolved here.  This lets substitution-only fuzzy matches skip the
+    Smith-Waterman alignment in core.align(), when the edit distances from
+    each tag to the closest other tag show that no other tag can match."""
+    def __init__(self, tags, errors, alphabet='ACGTN'):
+        self.tags = list(tags)
+        self.errors = errors
+        self.length = len(self.tags[0])
+        self.alphabet = alphabet
+        self.distances = min_distances(self.tags)
+        # variant -> (tag number, substitutions); None marks an ambiguous
+        # variant
+        self.lookup = {}
+        for order, tag in enumerate(self.tags):
+            for variant, distance in self._variants(tag):
+                self._add(variant, order, distance)
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def __len__(self):
+        return len(self.lookup)
+
+    def _variants(self, tag):
+        variants = {tag: 0}
+        edge = [tag]
+        for distance in xrange(1, self.errors + 1):
+            nxt = []
+            for seq in edge:
+                for pos in xrange(self.length):
+                    for base in self.alphabet:
+                        if base == tag[pos] or base == seq[pos]:
+                            continue
+                        variant = seq[:pos] + base + seq[pos + 1:]
+                        if variant not in variants:
+                            variants[variant] = distance
+                            nxt.append(variant)
+            edge = nxt
+        return variants.iteritems()
+
+    def _add(self, variant, order, distance):
+        if variant not in self.lookup:
+            self.lookup[variant] = (order, distance)
+            return
+        current = self.lookup[variant]
+        if current is not None and current[1] > distance:
+            self.lookup[variant] = (order, distance)
+        elif current is None or current[1] == distance:
+            self.lookup[variant] = None
+
+    def _span(self, seq, tag):
+        # local alignment drops mismatches at the ends of a substitution-only
+        # alignment.  Keep the best scoring (5/-4) run of the diagonal.
+        best, best_start, best_end = 0, 0, 0
+        score, start = 0, 0
+        for pos in xrange(self.length):
+            if score <= 0:
+                score, start = 0, pos
+            score += 5 if seq[pos] == tag[pos] else -4
+            if score > best:
+                best, best_start, best_end = score, start, pos + 1
+        return best_start, best_end
+
+    def memory(self):
+        """Approximate size of the index, in bytes"""
+        return sys.getsizeof(self.lookup) + \
+                sum([sys.getsizeof(k) for k in self.lookup]) + \
+                sum([sys.getsizeof(v) for v in self.lookup.itervalues()
+                    if v is not None])
+
+    def search(self, s):
+        """Return the result that core.align() gives for window s, when the
+        best hit is a substitution-only match to one tag, otherwise None.  The
+        result is (tag, matches, seq_match, seq_match_span, start, end)."""
+        lookup, length = self.lookup, self.length
+        best = None
+        for offset in xrange(len(s) - length + 1):
+            hit = lookup.get(s[offset:offset + length], False)
+            if hit is False:
+                continue
+            elif hit is None:
+                # ambiguous between tags - leave this one to the alignment
+                return None
+            elif best is None or hit[1] < best[1]:
+                best = (hit[0], hit[1], offset)
+            elif hit[1] == best[1] and hit[0] != best[0]:
+                return None
+        if best is None:
+            return None
+        order, distance, offset = best
+        tag = self.tags[order]
+        start, end = self._span(s[offset:offset + length], tag)
+        # as in core.matches(), bases clipped from the alignment count as
+        # errors, so the match may no longer be within the allowed errors
+        matches = sum([1 for a, b in zip(s[offset + start:offset + end],
+                tag[start:end]) if a == b])
+        if length - matches > self.errors:
+            return None
+        start, end = start + offset, end + offset
+        return tag, matches, s, s[start:end], start, end
+
+
+class QGramIndex:
+    """The positions of the q-grams of a set of sequence tags, to filter
+    the places a tag can occur in a read with no more than a given number of
+    errors (edits).  By the q-gram lemma, such an occurrence shares at least
+    len(tag) - q + 1 - q * errors q-grams with the tag, and with no more than
+    errors indels, these lie on diagonals (read position - tag position)
+    no more than errors apart.  The filter is lossless: every occurrence
+    with no more than errors edits is within a region it returns."""
+    def __init__(self, tags, errors, q=None):
+        self.tags = list(tags)
+        self.errors = errors
+        if q is None:
+            q = self._choose_q(min([len(tag) for tag in self.tags]), errors)
+        self.q = q
+        # q-gram -> [(tag number, position in tag)]
+        self.lookup = {}
+        for order, tag in enumerate(self.tags):
+            for pos in xrange(len(tag) - q + 1):
+                self.lookup.setdefault(tag[pos:pos + q], []).append(
+                        (order, pos))
+        self.threshold = [len(tag) - q + 1 - q * errors for tag in self.tags]
+
+    def __str__(self):
+        return "{0}({1})".format(self.__class__, self.__dict__)
+
+    def __repr__(self):
+        return "<{0} instance at {1}>".format(self.__class__, hex(id(self)))
+
+    def _choose_q(self, length, errors):
+        # the longest q-grams that still need 2 shared q-grams per
+        # occurrence, otherwise 1
+        for threshold in [2, 1]:
+            for q in xrange(length, 0, -1):
+                if length - q + 1 - q * errors >= threshold:
+                    return q
+        return 1
+
+    def _regions(self, diagonals, threshold):
+        # windows of diagonals no more than errors apart holding at least
+        # threshold hits, merged where they overlap
+        diagonals.sort()
+        regions = []
+        first = 0
+        for last in xrange(len(diagonals)):
+            while diagonals[last] - diagonals[first] > self.errors:
+                first += 1
+            if last - first + 1 >= threshold:
+                if regions and diagonals[first] <= regions[-1][1]:
+                    regions[-1] = (regions[-1][0], diagonals[last])
+                else:
+                    regions.append((diagonals[first], diagonals[last]))
+        return regions
+
+    def candidates(self, s):
+        """Return a dict of tag number -> [(start, end)], the regions of s
+        that may hold an occurrence of the tag with no more than errors
+        edits.  A tag too short for the filter (threshold < 1) may occur
+        anywhere in s."""
+        q, lookup = self.q, self.lookup
+        hits = {}
+        for i in xrange(len(s) - q + 1):
+            for order, pos in lookup.get(s[i:i + q], ()):
+                hits.setdefault(order, []).append(i - pos)
+        candidates = {}
+        for order, tag in enumerate(self.tags):
+            threshold = self.threshold[order]
+            if threshold < 1:
+                candidates[order] = [(0, len(s))]
+                continue
+            regions = self._regions(hits.get(order, []), threshold)
+            if regions:
+                # an occurrence can start, or end, up to errors bases off
+                # its diagonals
+                candidates[order] = [(max(lo - self.errors, 0),
+                        min(hi + len(tag) + self.errors, len(s)))
+                        for lo, hi in regions]
+        return candidates
+
+
+def edit_distances(tags):
+    """Return the matrix of pairwise edit (Levenshtein) distances between
+    tags, which must share a length.  Each tag is compared to all of the tags
+    at once, one cell of the dynamic programming matrix at a time."""
+    tags = list(tags)
+    length = len(tags[0])
+    others = numpy.frombuffer(''.join(tags), dtype=numpy.uint8).reshape(
+            len(tags), length)
+    distances = numpy.zeros((len(tags), len(tags)), dtype=int)
+    for i, tag in enumerate(tags):
+        prev = numpy.tile(numpy.arange(length + 1), (len(tags), 1))
+        for row in xrange(length):
+            cost = others != ord(tag[row])
+            # substitution (or match) and deletion are known from the
+            # previous row, insertion from the cell to the left
+            best = numpy.minimum(prev[:, :-1] + cost, prev[:, 1:] + 1)
+            cur = numpy.empty(prev.shape, dtype=int)
+            cur[:, 0] = row + 1
+            for col in xrange(length):
+                cur[:, col + 1] = numpy.minimum(best[:, col], cur[:, col] + 1)
+            prev = cur
+        distances[i] = prev[:, length]
+    return distances
+
+
+def min_distances(tags):
+    """Return a dict of the edit distance from each tag to the closest other
+    tag in tags.  A tag with no others is left out."""
+    tags = list(tags)
+    if len(tags) < 2:
+        return {}
+    distances = edit_distances(tags)
+    numpy.fill_diagonal(distances, distances.max() + 1)
+    return dict(zip(tags, distances.min(1)))
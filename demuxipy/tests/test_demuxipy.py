@@ -10,10 +10,20 @@ Description: Tests for demuxipy/lib.py
 """
 
 import os
+import gzip
+import itertools
+import shutil
+import tempfile
 import unittest
+import numpy
+import cPickle
 import ConfigParser
 from demuxipy import *
+from demuxipy.reader import FastqReader, MappedFastaQualityReader, \
+        bulk_lines, mapped_records, record_offsets, load_index, byte_ranges, \
+        Read
 from seqtools.sequence.transform import DNA_reverse_complement
+from seqtools.sequence.fasta import FastaQualityReader
 
 import pdb
 
@@ -92,6 +102,11 @@ class TestParametersMethods(unittest.TestCase):
         self.p.inner_orientation = 'Reverse'
         self.p._check_values()
 
+    def test_chunk_size(self):
+        assert self.p.chunk_size == 10000
+        self.p.chunk_size = 0
+        self.assertRaises(AssertionError, self.p._check_values)
+
     def test_wrong_outer_orientation(self):
         self.p.outer_orientation = 'Bob'
         self.assertRaises(AssertionError, self.p._check_values)
@@ -601,6 +616,18 @@ class TestSequenceTagsGroupMethods(unittest.TestCase):
                 }
         self.check_map(p, clust)
 
+    def test_inner_combo_regex(self):
+        p = Parameters(self.conf)
+        p.search = 'InnerCombinatorial'
+        p.inner_type = 'Both'
+        p.sequence_tags = self.refresh(p)
+        inners = p.sequence_tags.inners['None']
+        assert self.regex(inners['forward_regex'], inners['forward_string'],
+                p.inner_buffer)
+        # the reverse tags are found at the end of the read
+        assert self.regex(inners['reverse_regex'], inners['reverse_string'],
+                p.inner_buffer, True)
+
     def test_hierarchical_combo_outers(self):
         p = Parameters(self.conf)
         p.search = 'HierarchicalCombinatorial'
@@ -731,6 +758,848 @@ class TestSequenceTagsAllPossibleTags(unittest.TestCase):
         self.p.sequence_tags = None
         self.p.sequence_tags = self.refresh(self.p)
 
+class TestTagAutomaton(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.tags = self.p.sequence_tags.outers['forward_string']
+        self.gap = self.p.sequence_tags.outer_gap
+        self.regexes = self.p.sequence_tags.outers['forward_regex']
+        self.index = TagAutomaton(self.tags, self.gap)
+
+    def test_scan(self):
+        observed = list(self.index.scan('GGATACGACGTAGG'))
+        expected = [(self.index.tags.index('ATACGACGTA'), 2)]
+        assert observed == expected
+
+    def test_left_matches_regex(self):
+        reads = [
+                'ATACGACGTAGAGAGAGAG',
+                'GGGATACGACGTAGAGAGAG',
+                'GGGGGGATACGACGTAGAGAG',
+                'GXATACGACGTAGAGAGAG',
+                'TCACGTACTAATACGACGTA',
+                'ATACGACGTATCACGTACTA',
+                'ATACGACGTATATACGACGTA',
+                'ATACGACG',
+                ''
+            ]
+        for read in reads:
+            assert self.index.left(read) == _regex_match(self.regexes, read)
+
+    def test_right_matches_regex(self):
+        reads = [
+                'GAGAGATACGACGTA',
+                'GAGAGATACGACGTAGG',
+                'GAGAGATACGACGTAGGGGGG',
+                'GAGAGATACGACGTAGXGG',
+                'TCACGTACTAATACGACGTA',
+                'ATACGACGTATCACGTACTA',
+                'ATACGACGTATATACGACGTA',
+                'ATACGACG',
+                ''
+            ]
+        for gap in [0, self.gap]:
+            index = TagAutomaton(self.tags, gap)
+            regexes = self.p.sequence_tags._build_regex(self.tags, gap, True)
+            for read in reads:
+                assert index.right(read) == _regex_match(regexes, read, True)
+
+    def test_sequence_tags_index(self):
+        self.p.outer_exact = 'Automaton'
+        st = self.p._get_sequence_tags(self.p._get_all_outer(),
+                self.p._get_all_inner())
+        assert isinstance(st.outer_index['forward'], TagAutomaton)
+        for outer in st.inners:
+            assert st.inner_index[outer]['forward'] is None
+        self.p.inner_exact = 'Automaton'
+        st = self.p._get_sequence_tags(self.p._get_all_outer(),
+                self.p._get_all_inner())
+        for outer in st.inners:
+            assert st.inner_index[outer]['forward'].tags == \
+                    list(st.inners[outer]['forward_string'])
+
+    def test_wrong_exact_matching(self):
+        self.p.outer_exact = 'Bob'
+        self.assertRaises(AssertionError, self.p._check_values)
+
+
+class TestTagHash(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.tags = self.p.sequence_tags.outers['forward_string']
+        self.reads = [
+                'ATACGACGTAGAGAGAGAG',
+                'GGGATACGACGTAGAGAGAG',
+                'GGGGGGATACGACGTAGAGAG',
+                'GXATACGACGTAGAGAGAG',
+                'TCACGTACTAATACGACGTA',
+                'ATACGACGTATCACGTACTA',
+                'ATACGACGTATATACGACGTA',
+                'GAGAGATACGACGTAGG',
+                'GAGAGATACGACGTAGGGGGG',
+                'GAGAGATACGACGTAGXGG',
+                'ATACGACG',
+                ''
+            ]
+
+    def test_left_and_right_match_regex(self):
+        for gap in [0, 5]:
+            index = TagHash(self.tags, gap)
+            fregex = self.p.sequence_tags._build_regex(self.tags, gap)
+            rregex = self.p.sequence_tags._build_regex(self.tags, gap, True)
+            for read in self.reads:
+                assert index.left(read) == _regex_match(fregex, read)
+                assert index.right(read) == _regex_match(rregex, read, True)
+
+    def test_sequence_tags_index(self):
+        self.p.inner_exact = 'Hash'
+        st = self.p._get_sequence_tags(self.p._get_all_outer(),
+                self.p._get_all_inner())
+        assert st.outer_index['forward'] is None
+        for outer in st.inners:
+            assert st.inner_index[outer]['forward'].tags == \
+                    list(st.inners[outer]['forward_string'])
+            assert st.inner_index[outer]['reverse'].tags == \
+                    list(st.inners[outer]['reverse_string'])
+
+
+class TestMismatchIndex(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.tags = list(self.p.sequence_tags.outers['forward_string'])
+        self.index = MismatchIndex(self.tags, 1)
+
+    def test_variants(self):
+        # the tag plus 4 substitutions at each position
+        index = MismatchIndex(['ACGTACGTAC'], 1)
+        assert len(index) == 41
+        assert index.lookup['ACGTACGTAC'] == (0, 0)
+        assert index.lookup['ACGTNCGTAC'] == (0, 1)
+        assert 'ACGTNCGTAN' not in index.lookup
+        index = MismatchIndex(['ACGTACGTAC'], 2)
+        assert index.lookup['ACGTNCGTAN'] == (0, 2)
+
+    def test_ambiguous_variants(self):
+        index = MismatchIndex(['AAAA', 'AATT', 'CCCC'], 1)
+        assert index.lookup['AAAT'] is None
+        assert index.lookup['AAAA'] == (0, 0)
+        assert index.search('GAAATG') is None
+
+    def test_search_matches_align(self):
+        windows = [
+                'ATACGACGTAGAGAG',
+                'GGATACGACGTAGAG',
+                'GGATACGNCGTAGAG',
+                'GGATACGACGTTGAG',
+                'TTACGACGTAGAGAG',
+                'GGGGGATACGACGTT',
+            ]
+        for window in windows:
+            assert self.index.search(window) == align(window, self.tags, 1)
+
+    def test_search_indel(self):
+        assert self.index.search('GGATACGACCGTAGAG') is None
+        assert fuzzy_match('GGATACGACCGTAGAG', self.tags, 1, self.index) == \
+                align('GGATACGACCGTAGAG', self.tags, 1)
+
+    def test_search_beaten_by_other_tag(self):
+        # the index finds TCACGTACTA with 2 substitutions, but a gapped
+        # alignment to ATACGACGTA has more matches
+        tags = ['ATACGACGTA', 'TCACGTACTA']
+        index = MismatchIndex(tags, 2)
+        window = 'AAATCACGACCTACT'
+        assert index.search(window)[:2] == ('TCACGTACTA', 8)
+        match = fuzzy_match(window, tags, 2, index)
+        assert match == align(window, tags, 2)
+        assert match[:2] == ('ATACGACGTA', 9)
+
+    def test_search_unique_hit(self):
+        # tags far enough apart that no other tag can match the window
+        tags = ['AAAAAAAAAA', 'CCCCCCCCCC']
+        index = MismatchIndex(tags, 1)
+        assert index.distances == {'AAAAAAAAAA': 10, 'CCCCCCCCCC': 10}
+        assert fuzzy_match('AAAAGAAAAA', tags, 1, index) == \
+                index.search('AAAAGAAAAA') == align('AAAAGAAAAA', tags, 1)
+
+    def test_sequence_tags_index(self):
+        st = self.p.sequence_tags
+        assert st.outer_mismatch == {}
+        assert st.mismatch_stats is None
+        self.p.outer_mismatch = True
+        st = self.p._get_sequence_tags(self.p._get_all_outer(),
+                self.p._get_all_inner())
+        assert st.outer_mismatch['forward'].tags == \
+                list(st.outers['forward_string'])
+        assert st.inner_mismatch == {}
+        assert st.mismatch_stats['variants'] == len(st.outer_mismatch['forward'])
+
+
+def _regex_match(regexes, s, rev=False):
+    """the (tag, start, end) of the first of the (forward, or if rev,
+    reverse) tag regexes to match s, or None"""
+    for regex in regexes:
+        match = regex.search(s)
+        if match is not None:
+            if rev:
+                tag = regex.pattern.split('[')[0]
+            else:
+                tag = regex.pattern.split('}')[1]
+            return tag, match.start(), match.end()
+    return None
+
+
+def _data_windows(st):
+    """windows of the test reads, with the tags to align them to"""
+    levels = [(st.outers['forward_string'], st.outer_gap, st.outer_len)]
+    for outer in st.inners:
+        levels.append((st.inners[outer]['forward_string'], st.inner_gap,
+            st.inner_len))
+    reads = FastaQualityReader('./test-data/454_test_sequence.fasta',
+            './test-data/454_test_sequence.qual')
+    for read in reads:
+        for tags, gap, length in levels:
+            # windows at, and downstream of, the start of the read
+            for start in xrange(0, 30, 3):
+                yield read.sequence[start:start + gap + length], tags
+
+
+class TestMyersAligner(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.myers = MyersAligner(align)
+
+    def test_search(self):
+        tag = 'ATACGACGTA'
+        assert self.myers.search('GGATACGACGTAGG', tag, 1) == (0, 2, 12)
+        # substitution, insertion and deletion
+        assert self.myers.search('GGATACCACGTAGG', tag, 1) == (1, 2, 12)
+        assert self.myers.search('GGATACGTACGTAGG', tag, 1) == (1, 2, 13)
+        assert self.myers.search('GGATACACGTAGG', tag, 1) == (1, 2, 11)
+        assert self.myers.search('GGATACACGTTGG', tag, 1) is None
+        assert self.myers.search('GGATACACGTTGG', tag, 2) == (2, 2, 10)
+
+    def test_within(self):
+        assert self.myers.within('GGATACACGTAGG', 'ATACGACGTA', 1)
+        assert not self.myers.within('GGATACACGTTGG', 'ATACGACGTA', 1)
+
+    def test_get_aligner(self):
+        assert get_aligner('SmithWaterman') is align
+        assert isinstance(get_aligner('Myers'), MyersAligner)
+
+    def test_matches_align_on_test_data(self):
+        for window, tags in _data_windows(self.p.sequence_tags):
+            for errors in [1, 2]:
+                assert self.myers(window, tags, errors) == \
+                        align(window, tags, errors)
+
+    def test_wrong_fuzzy_engine(self):
+        self.p.inner_engine = 'Bob'
+        self.assertRaises(AssertionError, self.p._check_values)
+
+
+class TestAlignMany(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+
+    def test_local_scores_many(self):
+        seq = 'GGATACCACGTTAGG'
+        tags = ['ATACGACGTA', 'ATACGTACGT', 'TTTTTTTTTT']
+        scores, rows, cols, ident, gaps_seq, gaps_tag = \
+                pairwise2.local_scores_many(seq, tags, 5.0, -4.0, -9.0, -0.5)
+        for i, tag in enumerate(tags):
+            seq_match, tag_match, score, start, end = \
+                    pairwise2.align.localms(seq, tag, 5.0, -4.0, -9.0, -0.5,
+                    one_alignment_only=True)[0]
+            seq_span, tag_span = seq_match[start:end], tag_match[start:end]
+            assert scores[i] == score
+            assert ident[i] == sum([1 for a, b in zip(seq_span, tag_span)
+                if a == b])
+            assert gaps_seq[i] == seq_span.count('-')
+            assert gaps_tag[i] == tag_span.count('-')
+
+    def test_get_aligner(self):
+        assert get_aligner('Vectorized') is align_many
+
+    def test_matches_align_on_test_data(self):
+        for window, tags in _data_windows(self.p.sequence_tags):
+            for errors in [1, 2]:
+                assert align_many(window, tags, errors) == \
+                        align(window, tags, errors)
+
+class TestBatchAligner(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+
+    def test_local_scores_batch(self):
+        seqs = ['GGATACCACGTTAGG', 'ATACGTAC', 'TTTTATTTTTTT']
+        tags = ['ATACGACGTA', 'ATACGTACGT', 'TTTTTTTTTT']
+        batch = pairwise2.local_scores_batch(seqs, tags, 5.0, -4.0, -9.0,
+                -0.5)
+        for i, seq in enumerate(seqs):
+            many = pairwise2.local_scores_many(seq, tags, 5.0, -4.0, -9.0,
+                    -0.5)
+            for x, y in zip(batch, many):
+                assert list(x[i]) == list(y)
+
+    def test_get_aligner(self):
+        assert isinstance(get_aligner('Batched'), BatchAligner)
+
+    def test_matches_align_on_test_data(self):
+        windows = {}
+        for window, tags in _data_windows(self.p.sequence_tags):
+            windows.setdefault(tuple(tags), []).append(window)
+        for tags, seqs in windows.iteritems():
+            for errors in [1, 2]:
+                assert align_batch(seqs, tags, errors) == \
+                        [align(seq, tags, errors) for seq in seqs]
+
+    def test_batch(self):
+        tags = self.p.sequence_tags.outers['forward_string']
+        aligner = BatchAligner(cells=100)
+        windows = ['ATACGCGTAGG', 'GGATACGTCGTA', '', 'TTTTTTTTTTT']
+        aligner.batch(windows, tags, 1)
+        assert len(aligner.results) == len(windows)
+        for window in windows:
+            assert aligner(window, tags, 1) == align(window, tags, 1)
+        aligner.clear()
+        assert aligner.results == {}
+
+
+class TestPrunedAligner(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.pruned = PrunedAligner()
+
+    def test_bounds(self):
+        # 9 matches and a mismatch, or 9 matches and a gap
+        assert self.pruned.min_score(10, 1) == 36.
+        assert 9 * 5.0 - 4.0 >= self.pruned.min_score(10, 1)
+        assert 9 * 5.0 - 9.0 >= self.pruned.min_score(10, 1)
+        assert self.pruned.max_matches(41., 1) == 10.
+
+    def test_get_aligner(self):
+        assert isinstance(get_aligner('Pruned'), PrunedAligner)
+
+    def test_matches_align_on_test_data(self):
+        for window, tags in _data_windows(self.p.sequence_tags):
+            for errors in [1, 2]:
+                assert self.pruned(window, tags, errors) == \
+                        align(window, tags, errors)
+        assert self.pruned.skipped > 0
+        assert self.pruned.aligned > 0
+
+
+class TestTagDistances(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+
+    def test_edit_distances(self):
+        tags = ['ACGTACGT', 'ACGTACGA', 'CGTACGTA', 'TTTTACGT']
+        distances = edit_distances(tags)
+        assert list(distances[0]) == [0, 1, 2, 3]
+        assert (distances == distances.T).all()
+
+    def test_min_distances(self):
+        tags = ['ACGTACGT', 'ACGTACGA', 'CGTACGTA', 'TTTTACGT']
+        assert min_distances(tags) == {'ACGTACGT': 1, 'ACGTACGA': 1,
+                'CGTACGTA': 2, 'TTTTACGT': 3}
+        assert min_distances(['ACGT']) == {}
+
+    def test_sequence_tags_distances(self):
+        st = self.p.sequence_tags
+        outers = st.outers['forward_string']
+        assert set(st.outer_distance) >= outers
+        assert st.min_distance['outer'] == \
+                min(min_distances(outers).values())
+        assert st.min_distance['inner'] == min(st.inner_distance.values())
+
+    def test_align_unique(self):
+        tags = ['ACGTACGTAC', 'TTGGCCAATT']
+        distances = min_distances(tags)
+        high_score = {'tag':'ACGTACGTAC', 'matches':9, 'errors':1}
+        # 8 > 4 * 1 + 2 * 0, but not > 4 * 1 + 2 * 3
+        assert core._is_unique('ACGTACGTCC', high_score, distances)
+        assert not core._is_unique('ACGTACGTCCTGA', high_score, distances)
+        high_score['matches'] = 10
+        assert core._is_unique('ACGTACGTACTGA', high_score, distances)
+
+    def test_align_with_distances(self):
+        st = self.p.sequence_tags
+        for window, tags in _data_windows(st):
+            for errors in [1, 2]:
+                assert align(window, tags, errors, st.outer_distance) == \
+                        align(window, tags, errors)
+
+
+class TestMatchCache(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+
+    def test_lru(self):
+        cache = MatchCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        assert cache['a'] == 1
+        # 'b' is now the least recently used
+        cache['c'] = 3
+        assert len(cache) == 2
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        assert cache['c'] == 3
+        assert (cache.hits, cache.misses, cache.evictions) == (2, 1, 1)
+        assert cache.hit_rate() == 2/3.
+
+    def test_find_right_tag_in_tail(self):
+        st = self.p.sequence_tags
+        strings = st.outers['forward_string']
+        regexes = st._build_regex(strings, st.outer_gap, rev=True)
+        tag = 'ATACGACGTA'
+        for read in ['A' * 500 + tag, 'A' * 500 + tag + 'GGGGG',
+                'A' * 500 + tag + 'GGGGGG', tag + 'GG', tag[2:]]:
+            expected = None
+            for regex in regexes:
+                match = regex.search(read)
+                if match is not None:
+                    expected = (regex.pattern.split('[')[0], 'regex',
+                            match.start(), match.end(), read[match.start():
+                            match.end()])
+                    break
+            assert find_right_tag(read, regexes, strings, st.outer_gap,
+                    st.outer_len, False, 0, None, False) == expected
+
+    def test_find_tags_with_cache(self):
+        st = self.p.sequence_tags
+        strings = st.outers['forward_string']
+        regexes = st._build_regex(strings, st.outer_gap)
+        rev_regexes = st._build_regex(strings, st.outer_gap, rev=True)
+        cache = MatchCache(1000)
+        reads = FastaQualityReader('./test-data/454_test_sequence.fasta',
+                './test-data/454_test_sequence.qual')
+        for read in reads:
+            # twice, so that the second pass is from the cache, and with
+            # the start of the read (and its tag) at the end of reads of
+            # several lengths
+            for s in [read.sequence] * 2 + [read.sequence[30:30 + i] +
+                    read.sequence[:st.outer_gap + st.outer_len - i % 3]
+                    for i in xrange(0, 20, 2)]:
+                assert find_left_tag(s, regexes, strings, st.outer_gap,
+                        st.outer_len, True, 1, cache=cache,
+                        context='outer') == \
+                        find_left_tag(s, regexes, strings, st.outer_gap,
+                        st.outer_len, True, 1)
+                assert find_right_tag(s, rev_regexes, strings, st.outer_gap,
+                        st.outer_len, True, 1, None, cache=cache,
+                        context='outer') == \
+                        find_right_tag(s, rev_regexes, strings,
+                        st.outer_gap, st.outer_len, True, 1, None)
+        assert cache.hits > 0
+
+
+class TestConcatCheck(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.p.concat_check = True
+        self.p.concat_fuzzy = False
+        self.p.sequence_tags = self.p._get_sequence_tags(
+                self.p._get_all_outer(), self.p._get_all_inner())
+
+    def regex(self, regexes, s):
+        for regex in regexes:
+            match = regex.search(s)
+            if match:
+                return regex.pattern, "regex-concat", \
+                        s[match.start():match.end()]
+        return None, None, None
+
+    def test_automaton_per_outer(self):
+        all_tags = self.p.sequence_tags.all_tags
+        assert set(all_tags) == set(self.p.sequence_tags.inners)
+        for outer in all_tags:
+            assert all_tags[outer]['automaton'].tags == \
+                    [r.pattern for r in all_tags[outer]['regex']]
+
+    def test_concat_check_matches_regex(self):
+        all_tags = self.p.sequence_tags.all_tags
+        reads = FastaQualityReader('./test-data/454_test_sequence.fasta',
+                './test-data/454_test_sequence.qual')
+        for read in reads:
+            sequence = read.sequence
+            for outer in all_tags:
+                tags = list(all_tags[outer]['string'])
+                for i in xrange(0, 60, 20):
+                    tagged = Tagged(read)
+                    tagged.outer_seq = outer
+                    tagged.read.sequence = sequence[:i] + \
+                            tags[i % len(tags)] + sequence[i:]
+                    expected = self.regex(all_tags[outer]['regex'],
+                            tagged.read.sequence)
+                    tagged = concat_check(tagged, self.p)
+                    assert (tagged.concat_seq, tagged.concat_type,
+                            tagged.concat_match) == expected
+
+
+class TestQGramIndex(unittest.TestCase):
+    def setUp(self):
+        self.tags = ['ACGTACGTAC', 'TTGGCCAATT', 'GATTACAGAT']
+        self.index = QGramIndex(self.tags, 1)
+
+    def test_threshold(self):
+        # the longest q-grams leaving 2 shared per occurrence
+        assert self.index.q == 4
+        assert self.index.threshold == [3, 3, 3]
+
+    def test_candidates(self):
+        s = 'CCCCCCCCCCCCCCCCCCCC' + 'GATTACGAT' + 'CCCCCCCCCCCCCCCCCCCC'
+        candidates = self.index.candidates(s)
+        assert candidates.keys() == [2]
+        for start, end in candidates[2]:
+            assert start <= 20 and end >= 29
+
+    def test_no_candidates(self):
+        assert self.index.candidates('C' * 50) == {}
+
+    def test_short_tags(self):
+        index = QGramIndex(['ACG', 'TTG'], 3)
+        assert index.candidates('C' * 50) == {0: [(0, 50)], 1: [(0, 50)]}
+
+
+class TestQGramAligner(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.p.concat_check = True
+        self.p.sequence_tags = self.p._get_sequence_tags(
+                self.p._get_all_outer(), self.p._get_all_inner())
+        self.aligner = QGramAligner(align)
+
+    def test_get_aligner(self):
+        assert isinstance(get_aligner('QGram'), QGramAligner)
+
+    def test_matches_align_on_test_data(self):
+        for window, tags in _data_windows(self.p.sequence_tags):
+            for errors in [1, 2]:
+                assert self.aligner(window, tags, errors) == \
+                        align(window, tags, errors)
+
+    def test_matches_align_within_reads(self):
+        all_tags = self.p.sequence_tags.all_tags
+        reads = FastaQualityReader('./test-data/454_test_sequence.fasta',
+                './test-data/454_test_sequence.qual')
+        for read in reads:
+            for outer in all_tags:
+                tags = list(all_tags[outer]['string'])
+                for i in xrange(0, 60, 20):
+                    # a tag, with a deletion, within the read
+                    tag = tags[i % len(tags)]
+                    s = read.sequence[:i] + tag[:3] + tag[4:] + \
+                            read.sequence[i:]
+                    for errors in [0, 1]:
+                        assert self.aligner(s, tags, errors) == \
+                                align(s, tags, errors)
+
+
+class TestAlignEdits(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+
+    def test_get_aligner(self):
+        assert get_aligner('SemiGlobal') is align_edits
+
+    def test_align_edits(self):
+        tags = ['ATACGACGTA', 'TCACGTACTA', 'CGTCTAGTAC']
+        assert align_edits('GGATACGACGTAGG', tags, 1) == \
+                ('ATACGACGTA', 10, 'GGATACGACGTAGG', 'ATACGACGTA', 2, 12)
+        # an insertion, so a match is one base longer than the tag
+        assert align_edits('GTCACGTTACTAG', tags, 1) == \
+                ('TCACGTACTA', 10, 'GTCACGTTACTAG', 'TCACGTTACTA', 1, 12)
+        assert align_edits('GTCACGTTACTAG', tags, 0) is None
+
+    def test_errors_within_allowed(self):
+        myers = MyersAligner(align)
+        for window, tags in _data_windows(self.p.sequence_tags):
+            for errors in [1, 2]:
+                match = align_edits(window, tags, errors)
+                if match is not None:
+                    tag, matches, seq, span, start, end = match
+                    assert span == window[start:end]
+                    assert myers.search(span, tag, errors) is not None
+                else:
+                    assert not [tag for tag in tags
+                            if myers.within(window, tag, errors)]
+
+
+class TestTrieAligner(unittest.TestCase):
+    def setUp(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        self.p = Parameters(conf)
+        self.trie = TrieAligner()
+
+    def test_get_aligner(self):
+        assert isinstance(get_aligner('Trie'), TrieAligner)
+
+    def test_matches_align_on_test_data(self):
+        st = self.p.sequence_tags
+        with_distances = TrieAligner(st.outer_distance)
+        for window, tags in _data_windows(st):
+            for errors in [1, 2]:
+                assert self.trie(window, tags, errors) == \
+                        align(window, tags, errors)
+                assert with_distances(window, tags, errors) == \
+                        align(window, tags, errors)
+        assert self.trie.skipped > 0
+        assert self.trie.aligned > 0
+
+    def test_shared_prefixes(self):
+        tags = ['ACGTACGTAC', 'ACGTACGGTT', 'ACGTTTGCAA']
+        assert self.trie('TTACGTACGGATC', tags, 1) == \
+                align('TTACGTACGGATC', tags, 1)
+        assert len(self.trie.tries) == 1
+
+
+class TestFastqReader(unittest.TestCase):
+    def setUp(self):
+        self.reads = list(FastaQualityReader(
+                './test-data/454_test_sequence.fasta',
+                './test-data/454_test_sequence.qual'))
+        self.dir = tempfile.mkdtemp()
+        self.fastq = os.path.join(self.dir, 'test.fastq')
+        records = ''.join(['@{0}\n{1}\n+\n{2}\n'.format(read.identifier,
+                read.sequence, ''.join([chr(q + 33) for q in read.quality]))
+                for read in self.reads])
+        open(self.fastq, 'w').write(records)
+        handle = gzip.open(self.fastq + '.gz', 'wb')
+        handle.write(records)
+        handle.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _check(self, reader):
+        reads = list(reader)
+        assert len(reads) == len(self.reads)
+        for read, expected in zip(reads, self.reads):
+            assert read.identifier == expected.identifier
+            assert read.sequence == expected.sequence
+            assert list(read.quality) == list(expected.quality)
+            assert read.trim(10, True).sequence == \
+                    expected.trim(10, True).sequence
+
+    def test_plain(self):
+        self._check(FastqReader(self.fastq))
+
+    def test_gzip(self):
+        self._check(FastqReader(self.fastq + '.gz'))
+
+    def test_small_blocks(self):
+        # records and lines span the blocks read
+        self._check(FastqReader(self.fastq, size=7))
+        self._check(FastqReader(self.fastq + '.gz', size=7))
+
+    def test_bulk_lines(self):
+        lines = sum(bulk_lines(self.fastq + '.gz', 100), [])
+        assert lines == open(self.fastq).readlines()
+
+    def test_invalid(self):
+        open(self.fastq, 'w').write('>read\nACGT\n+\nIIII\n')
+        self.assertRaises(IOError, list, FastqReader(self.fastq))
+        open(self.fastq, 'w').write('@read\nACGT\n+\n')
+        self.assertRaises(IOError, list, FastqReader(self.fastq))
+
+    def test_below_offset(self):
+        # quality characters below the offset do not wrap around
+        open(self.fastq, 'w').write('@read\nACGTACGT\n+\n####hhhh\n')
+        self.assertRaises(IOError, list, FastqReader(self.fastq, offset=64))
+        read = list(FastqReader(self.fastq))[0]
+        assert list(read.quality) == [2] * 4 + [71] * 4
+
+    def test_parameters(self):
+        conf = ConfigParser.ConfigParser()
+        conf.read('./test-data/demuxi-test.conf')
+        conf.remove_option('Input', 'fasta')
+        conf.remove_option('Input', 'quality')
+        conf.set('Input', 'fastq', self.fastq + '.gz')
+        p = Parameters(conf)
+        assert p.fastq == self.fastq + '.gz'
+        assert p.fasta is None and p.quality is None
+
+
+
+class TestMappedFastaQualityReader(unittest.TestCase):
+    def setUp(self):
+        self.fasta = './test-data/454_test_sequence.fasta'
+        self.quality = './test-data/454_test_sequence.qual'
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, text):
+        path = os.path.join(self.dir, name)
+        open(path, 'w').write(text)
+        return path
+
+    def test_reads(self):
+        expected = list(FastaQualityReader(self.fasta, self.quality))
+        reads = list(MappedFastaQualityReader(self.fasta, self.quality))
+        assert len(reads) == len(expected)
+        for read, other in zip(reads, expected):
+            assert read.identifier == other.identifier
+            assert read.sequence == other.sequence
+            assert read.quality.dtype == numpy.uint8
+            assert list(read.quality) == list(other.quality)
+            assert read.slice(2, 10, True).sequence == other.sequence[2:10]
+            assert read.trim(10, True).sequence == \
+                    other.trim(10, True).sequence
+
+    def test_records(self):
+        path = self._write('test.fasta', '>a 1\r\nAC\nGT\n>b\n>c\nTT')
+        assert list(mapped_records(path)) == [('a 1', 'AC\nGT'), ('b', ''),
+                ('c', 'TT')]
+        assert list(mapped_records(self._write('empty.fasta', ''))) == []
+
+    def test_invalid(self):
+        fasta = self._write('test.fasta', '>a\nACGT\n>b\nAC\n')
+        quality = self._write('test.qual', '>a\n40 40 40 40\n')
+        self.assertRaises(IOError, list,
+                MappedFastaQualityReader(fasta, quality))
+        quality = self._write('test.qual', '>a\n40 40 40 40\n>c\n40 40\n')
+        self.assertRaises(IOError, list,
+                MappedFastaQualityReader(fasta, quality))
+        fasta = self._write('test.fasta', 'ACGT\n')
+        self.assertRaises(IOError, list,
+                MappedFastaQualityReader(fasta, quality))
+
+
+class TestInputIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in ['454_test_sequence.fasta', '454_test_sequence.qual']:
+            shutil.copy(os.path.join('./test-data', name), self.dir)
+        self.fasta = os.path.join(self.dir, '454_test_sequence.fasta')
+        self.quality = os.path.join(self.dir, '454_test_sequence.qual')
+        self.reads = list(FastaQualityReader(self.fasta, self.quality))
+        # quality lines starting with '@' must not start records
+        self.fastq = os.path.join(self.dir, 'test.fastq')
+        open(self.fastq, 'w').write(''.join(['@{0}\n{1}\n+\n{2}\n'.format(
+                read.identifier, read.sequence,
+                ''.join([chr(q + 24) for q in read.quality]))
+                for read in self.reads]))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _check(self, reads):
+        reads = list(reads)
+        assert len(reads) == len(self.reads)
+        for read, expected in zip(reads, self.reads):
+            assert read.identifier == expected.identifier
+            assert read.sequence == expected.sequence
+
+    def test_offsets(self):
+        text = open(self.fasta).read()
+        expected = [i for i in xrange(len(text))
+                if text[i] == '>' and (i == 0 or text[i - 1] == '\n')]
+        # small blocks, so that newlines and '>' span them
+        for size in [1, 7, 2**24]:
+            index = record_offsets(self.fasta, size=size)
+            assert list(index) == expected + [len(text)]
+            assert len(record_offsets(self.fastq, True, size)) == \
+                    len(self.reads) + 1
+
+    def test_ranges(self):
+        fasta = record_offsets(self.fasta)
+        quality = record_offsets(self.quality)
+        fastq = record_offsets(self.fastq, True)
+        for chunk in [1, 4, len(self.reads)]:
+            self._check([read for ranges in itertools.izip(
+                    byte_ranges(fasta, chunk), byte_ranges(quality, chunk))
+                    for read in MappedFastaQualityReader(self.fasta,
+                        self.quality, *ranges)])
+            self._check([read for start, end in byte_ranges(fastq, chunk)
+                    for read in FastqReader(self.fastq, offset=24,
+                        start=start, end=end)])
+
+    def test_sidecar(self):
+        index = load_index(self.fasta)
+        assert os.path.exists(self.fasta + '.idx')
+        assert list(load_index(self.fasta)) == list(index)
+        # a sidecar that does not match the file is rebuilt
+        numpy.array([0, 1], dtype='<i8').tofile(self.fasta + '.idx')
+        assert list(load_index(self.fasta)) == list(index)
+        assert list(numpy.fromfile(self.fasta + '.idx', dtype='<i8')) == \
+                list(index)
+
+    def test_invalid(self):
+        open(self.fasta, 'w').write('ACGT\n>read\nACGT\n')
+        self.assertRaises(IOError, record_offsets, self.fasta)
+        open(self.fasta, 'w').write('')
+        assert list(record_offsets(self.fasta)) == [0]
+
+
+class TestRead(unittest.TestCase):
+    def setUp(self):
+        self.expected = list(FastaQualityReader(
+                './test-data/454_test_sequence.fasta',
+                './test-data/454_test_sequence.qual'))
+        self.reads = [Read(read.identifier, read.sequence,
+                numpy.array(read.quality, dtype=numpy.uint8))
+                for read in self.expected]
+
+    def _same(self, read, expected):
+        assert read.identifier == expected.identifier
+        assert read.sequence == expected.sequence
+        assert list(read.quality) == list(expected.quality)
+
+    def test_slice(self):
+        for read, expected in zip(self.reads, self.expected):
+            for start, end in [(0, 10), (5, len(expected.sequence)),
+                    (3, 2), (200, 300), (-5, -1)]:
+                self._same(read.slice(start, end, True),
+                        expected.slice(start, end, True))
+            # slices of slices are offsets into the same buffers
+            sliced = read.slice(4, 30, True).slice(2, 20, False)
+            self._same(sliced, expected.slice(4, 30, True).slice(2, 20, True))
+            assert sliced.data is read.data and sliced.scores is read.scores
+
+    def test_trim(self):
+        for read, expected in zip(self.reads, self.expected):
+            self._same(read.trim(10, True), expected.trim(10, True))
+            self._same(read.trim(50, True), expected.trim(50, True))
+            trimmed = read.trim(10, False)
+            assert trimmed is read
+            self._same(trimmed, expected.trim(10, True))
+
+    def test_pickle(self):
+        read = self.reads[1].trim(10, True).slice(2, 12, True)
+        for protocol in [0, 2]:
+            other = cPickle.loads(cPickle.dumps(read, protocol))
+            self._same(other, read)
+            # only the part of the read that is left is pickled
+            assert other.data == read.sequence
+            assert len(other.scores) == len(read)
 
 '''
 class TestSequenceTagsCombinatorialMethods(unittest.TestCase):
@@ -6,7 +6,7 @@
 
 import unittest
 
-from Bio import pairwise2
+from demuxipy import pairwise2
 
 
 class TestPairwiseGlobal(unittest.TestCase):
@@ -379,6 +379,277 @@ abcde
 """)
 
 
+class TestPairwiseOneAlignment(unittest.TestCase):
+
+    def test_one_alignment_local(self):
+        # the alignment from the first of the best cells
+        aligns = pairwise2.align.localxs("abcce", "c", -0.3, -0.1,
+                                         one_alignment_only=1)
+        self.assertEqual(len(aligns), 1)
+        seq1, seq2, score, begin, end = aligns[0]
+        alignment = pairwise2.format_alignment(seq1, seq2, score, begin, end)
+        self.assertEqual(alignment, """\
+abcce
+  |
+--c--
+  Score=1
+""")
+
+    def test_one_alignment_in_all(self):
+        for seqA, seqB in [("AxBx", "zABz"), ("GAACT", "GAT"),
+                           ("ACGGTCAGGATCCTACG", "GGATTCCTAC")]:
+            aligns = pairwise2.align.localms(seqA, seqB, 5.0, -4.0, -9.0,
+                                             -0.5, one_alignment_only=1)
+            self.assertEqual(len(aligns), 1)
+            self.assertTrue(aligns[0] in pairwise2.align.localms(
+                seqA, seqB, 5.0, -4.0, -9.0, -0.5))
+
+
+class TestPairwiseNumpy(unittest.TestCase):
+
+    def test_numpy_global(self):
+        aligns = pairwise2.align.globalms("GAACT", "GAT", 2, -1, -0.5, -0.1,
+                                          force_numpy=1)
+        self.assertEqual(aligns,
+                pairwise2.align.globalms("GAACT", "GAT", 2, -1, -0.5, -0.1))
+        aligns = pairwise2.align.globalxs("GACT", "GT", -0.2, -1.5,
+                                          force_numpy=1)
+        self.assertEqual(aligns,
+                pairwise2.align.globalxs("GACT", "GT", -0.2, -1.5))
+
+    def test_numpy_local(self):
+        aligns = pairwise2.align.localxs("abcce", "c", -0.3, -0.1,
+                                         force_numpy=1)
+        self.assertEqual(len(aligns), 2)
+        aligns.sort()
+        seq1, seq2, score, begin, end = aligns[1]
+        alignment = pairwise2.format_alignment(seq1, seq2, score, begin, end)
+        self.assertEqual(alignment, """\
+abcce
+  |
+--c--
+  Score=1
+""")
+        seq, tag = "ACGGTCAGGATCCTACGATTACG", "GGATTCCTAC"
+        self.assertEqual(
+            pairwise2.align.localms(seq, tag, 5.0, -4.0, -9.0, -0.5,
+                                    force_numpy=1),
+            pairwise2.align.localms(seq, tag, 5.0, -4.0, -9.0, -0.5))
+
+    def test_numpy_tied_gaps(self):
+        # the cached gaps hold several equally good indexes when there
+        # is no extension penalty
+        aligns = pairwise2.align.localms("AAAAGGGGCCCC", "AAAACCCC", 1, -1,
+                                         -0.5, 0, force_numpy=1)
+        self.assertEqual(aligns,
+                pairwise2.align.localms("AAAAGGGGCCCC", "AAAACCCC", 1, -1,
+                                        -0.5, 0))
+        self.assertEqual(
+            pairwise2.align.localms("AAAAGGGGCCCC", "AAAACCCC", 1, -1,
+                                    -0.5, 0, force_numpy=1, score_only=1),
+            7.5)
+
+    def test_numpy_large(self):
+        # long anti-diagonals are filled with numpy by default
+        seqA = "ACGTTGCAAGTCCGATAGGCTTACGATCGGATCAAGTCGATTAGCGTACG" * 2
+        seqB = seqA[10:40] + "TTTT" + seqA[50:90]
+        self.assertEqual(
+            pairwise2.align.globalms(seqA, seqB, 5, -4, -9, -0.5),
+            pairwise2.align.globalms(seqA, seqB, 5, -4, -9, -0.5,
+                                     force_generic=1))
+
+
+class TestPairwiseScoreOnly(unittest.TestCase):
+
+    def test_score_only_global(self):
+        score = pairwise2.align.globalxs("GACT", "GT", -0.2, -1.5,
+                                         score_only=1)
+        self.assertAlmostEqual(score, 0.6)
+        aligns = pairwise2.align.globalms("GCT", "GATA", 1, -2, -0.1, 0)
+        self.assertEqual(pairwise2.align.globalms("GCT", "GATA", 1, -2,
+                                                  -0.1, 0, score_only=1),
+                         aligns[0][2])
+
+    def test_score_only_local(self):
+        aligns = pairwise2.align.localxs("AxBx", "zABz", -0.1, 0)
+        self.assertEqual(pairwise2.align.localxs("AxBx", "zABz", -0.1, 0,
+                                                 score_only=1),
+                         aligns[0][2])
+        self.assertEqual(pairwise2.align.localms("ACCGT", "TTTT", 1, -1,
+                                                 -1, 0, score_only=1), 1)
+
+    def test_local_score(self):
+        seq, tag = "ACGGTCAGGATCCTACGATTACG", "GGATTCCTAC"
+        score, row, col = pairwise2.local_score(seq, tag, 5.0, -4.0, -9.0,
+                                                -0.5)
+        self.assertEqual(score, pairwise2.align.localms(
+            seq, tag, 5.0, -4.0, -9.0, -0.5, score_only=1))
+        # the alignment ends with the last base of the tag, at
+        # seq[15]
+        self.assertEqual((score, row, col), (36.0, 15, 9))
+
+
+class TestPairwiseAligner(unittest.TestCase):
+
+    def setUp(self):
+        self.aligner = pairwise2.Aligner(5.0, -4.0, -9.0, -0.5, 15, 10)
+
+    def test_aligner_align(self):
+        for seqA, seqB in [("ACGGTCAGGATCCTA", "GGATTCCTAC"),
+                           ("TTTTTACGTACGTAC", "ACGTACGTAC"),
+                           ("AxBx", "zABz"), ("A", "A"), ("C", "G")]:
+            self.assertEqual(self.aligner.align(seqA, seqB),
+                             pairwise2.align.localms(seqA, seqB, 5.0, -4.0,
+                                                     -9.0, -0.5,
+                                                     one_alignment_only=1))
+
+    def test_aligner_score(self):
+        for seqA, seqB in [("ACGGTCAGGATCCTA", "GGATTCCTAC"), ("C", "G")]:
+            self.assertEqual(self.aligner.score(seqA, seqB),
+                             pairwise2.align.localms(seqA, seqB, 5.0, -4.0,
+                                                     -9.0, -0.5,
+                                                     score_only=1))
+
+    def test_aligner_grows(self):
+        seqA = "ACGGTCAGGATCCTACGATTACGGATTCCTAC"
+        seqB = "GGATTCCTACG"
+        self.assertEqual(self.aligner.align(seqA, seqB),
+                         pairwise2.align.localms(seqA, seqB, 5.0, -4.0,
+                                                 -9.0, -0.5,
+                                                 one_alignment_only=1))
+        self.assertEqual((self.aligner.lenA, self.aligner.lenB), (32, 11))
+        # and smaller sequences use part of the matrices
+        self.assertEqual(self.aligner.align("GGATCC", "GATC"),
+                         pairwise2.align.localms("GGATCC", "GATC", 5.0, -4.0,
+                                                 -9.0, -0.5,
+                                                 one_alignment_only=1))
+
+    def test_aligner_empty(self):
+        self.assertEqual(self.aligner.align("", "ACGT"), [])
+        self.assertRaises(ValueError, pairwise2.Aligner, 5.0, -4.0, 9.0, 0)
+
+
+class TestPairwiseSemiGlobal(unittest.TestCase):
+
+    def test_semiglobal_exact(self):
+        self.assertEqual(pairwise2.semiglobal_edits("GGATACGACGTAGG",
+                                                    "ATACGACGTA"),
+                         (2, 12, 0, 0, 0))
+
+    def test_semiglobal_edits(self):
+        tag = "ATACGACGTA"
+        # substitution, insertion, and deletion
+        self.assertEqual(pairwise2.semiglobal_edits("GGATACCACGTAGG", tag),
+                         (2, 12, 1, 0, 0))
+        self.assertEqual(pairwise2.semiglobal_edits("GGATACGTACGTAGG", tag),
+                         (2, 13, 0, 1, 0))
+        self.assertEqual(pairwise2.semiglobal_edits("GGATACACGTAGG", tag),
+                         (2, 11, 0, 0, 1))
+        # the whole tag is aligned, even a mismatched first base
+        self.assertEqual(pairwise2.semiglobal_edits("TTACGACGTA", tag),
+                         (0, 10, 1, 0, 0))
+
+    def test_semiglobal_short_sequence(self):
+        self.assertEqual(pairwise2.semiglobal_edits("ACG", "ACGT"),
+                         (0, 3, 0, 0, 1))
+        self.assertEqual(pairwise2.semiglobal_edits("", "ACGT"),
+                         (0, 0, 0, 0, 4))
+
+
+class TestPairwiseIntegerScoring(unittest.TestCase):
+
+    def test_integer_scale(self):
+        self.assertEqual(pairwise2._integer_scale([5, -4, -9, -1]), 1)
+        self.assertEqual(pairwise2._integer_scale([5.0, -4.0, -9.0, -0.5]), 2)
+        self.assertEqual(pairwise2._integer_scale([1, -0.25]), 4)
+        self.assertEqual(pairwise2._integer_scale([1, -0.1]), None)
+
+    def test_integer_alignments(self):
+        seqA, seqB = "ACGGTCAGGATCCTA", "GGATTCCTAC"
+        for args in [(5.0, -4.0, -9.0, -0.5), (1.5, -1, -0.25, 0),
+                     (1, -0.3, -0.1, -0.1)]:
+            for function in [pairwise2.align.localms, pairwise2.align.globalms]:
+                alignments = function(seqA, seqB, *args)
+                self.assertEqual(alignments,
+                                 function(seqA, seqB, *args, force_generic=1))
+                self.assertTrue(isinstance(alignments[0][2], float))
+                self.assertEqual(function(seqA, seqB, *args, score_only=1),
+                                 alignments[0][2])
+
+    def test_integer_aligner(self):
+        for args in [(5.0, -4.0, -9.0, -0.5), (5, -4, -9, -1)]:
+            aligner = pairwise2.Aligner(*args)
+            alignments = aligner.align("ACGGTCAGGATCCTA", "GGATTCCTAC")
+            self.assertEqual(alignments,
+                             pairwise2.align.localms("ACGGTCAGGATCCTA",
+                                                     "GGATTCCTAC", *args,
+                                                     force_generic=1,
+                                                     one_alignment_only=1))
+            self.assertEqual(type(alignments[0][2]), type(args[0]))
+
+
+class TestPairwiseGapCallbacks(unittest.TestCase):
+
+    def test_affine_callback(self):
+        seqA, seqB = "ACGGTCAGGATCCTA", "GGATTCCTAC"
+        gap_fn = pairwise2.affine_penalty(-2, -0.5)
+        for function in [pairwise2.align.localmc, pairwise2.align.globalmc]:
+            self.assertEqual(function(seqA, seqB, 2, -1, gap_fn, gap_fn),
+                             function(seqA, seqB, 2, -1, gap_fn, gap_fn,
+                                      nonaffine_gaps=1))
+
+    def test_position_callback(self):
+        # the penalty for opening a gap depends on where it is opened
+        def gap_fn(index, length):
+            if length <= 0:
+                return 0
+            return [-1, -5, -5, -1, -1, -1, -1][index] - 0.5 * (length - 1)
+        for seqA, seqB in [("ACGTAC", "ACGAC"), ("AAACGG", "AAAGG")]:
+            self.assertEqual(pairwise2.align.globalmc(seqA, seqB, 1, -1,
+                                                      gap_fn, gap_fn),
+                             pairwise2.align.globalmc(seqA, seqB, 1, -1,
+                                                      gap_fn, gap_fn,
+                                                      nonaffine_gaps=1))
+
+    def test_nonaffine_gaps(self):
+        def gap_fn(index, length):
+            if length <= 0:
+                return 0
+            elif length < 3:
+                return -2 - 0.1 * length
+            return -2.5
+        self.assertEqual(pairwise2.align.localmc("CACGGATCAT", "CAGCAG", 2,
+                                                 -2, gap_fn, gap_fn,
+                                                 nonaffine_gaps=1),
+                         [('CACGGATCAT', 'CA--G--CAG', 5.6, 0, 9)])
+
+
+class TestPairwiseTagTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = ["ACGTACGTAC", "ACGTACGGTT", "ACGTTTGCAA", "GGATTCCTAC",
+                     "ACGTACGTAC"]
+        self.trie = pairwise2.TagTrie(self.tags, 5.0, -4.0, -9.0, -0.5)
+
+    def test_trie_nodes(self):
+        # the shared prefixes, and the duplicate tag, add no nodes
+        self.assertEqual(self.trie.nodes, 10 + 3 + 6 + 10)
+
+    def test_trie_scores(self):
+        aligner = pairwise2.Aligner(5.0, -4.0, -9.0, -0.5)
+        for seqA in ["ACGGTCAGGATCCTA", "TTACGTACGGTTAC", "ACGTTGCAA", "A"]:
+            scores = self.trie.scores(seqA)
+            for tag, (score, row, col) in zip(self.tags, scores):
+                self.assertEqual(score, aligner.score(seqA, tag))
+                self.assertEqual((row, col),
+                                 aligner._fill(seqA, tag, False)[1:])
+
+    def test_trie_empty(self):
+        self.assertEqual(self.trie.scores(""), [None] * 5)
+        trie = pairwise2.TagTrie(["", "AC"], 1, -1, -1, -1)
+        self.assertEqual(trie.scores("AC"), [None, (2, 1, 1)])
+
+
 if __name__ == '__main__':
     runner = unittest.TextTestRunner(verbosity = 2)
     unittest.main(testRunner=runner)